@@ -41,13 +41,17 @@ sshpass -p "$SSHPASS" ssh -o StrictHostKeyChecking=no $SERVER \
 echo ""
 echo "📊 检查数据库状态..."
 sshpass -p "$SSHPASS" ssh -o StrictHostKeyChecking=no $SERVER \
-    "cd $PROJECT_DIR && sqlite3 stocks.db \"SELECT date, COUNT(*) as count, AVG(score) as avg_score FROM strategy_results WHERE strategy_name='b1' GROUP BY date ORDER BY date DESC LIMIT 10;\""
+    "cd $PROJECT_DIR && sqlite3 data/stocks.db \"SELECT date, COUNT(*) as count, AVG(score) as avg_score FROM strategy_results WHERE strategy_name='b1' GROUP BY date ORDER BY date DESC LIMIT 10;\""
 
 # 下载数据库到本地
 echo ""
 echo "📥 下载数据库到本地..."
+# WAL 模式下未 checkpoint 的写入还在 stocks.db-wal 里，下载前先合并回主文件
+sshpass -p "$SSHPASS" ssh -o StrictHostKeyChecking=no $SERVER \
+    "cd $PROJECT_DIR && sqlite3 data/stocks.db \"PRAGMA wal_checkpoint(TRUNCATE);\""
+mkdir -p ./data
 sshpass -p "$SSHPASS" scp -o StrictHostKeyChecking=no \
-    $SERVER:$PROJECT_DIR/stocks.db ./stocks.db || {
+    $SERVER:$PROJECT_DIR/data/stocks.db ./data/stocks.db || {
     echo "❌ 数据库下载失败"
     exit 1
 }
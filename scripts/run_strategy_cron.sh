@@ -30,7 +30,7 @@ echo "========================================" >> $LOG_FILE
 # 切换到项目目录
 cd $PROJECT_DIR
 
-# 执行策略脚本
+# 执行策略脚本（中途退出后再次执行会从当天的断点继续，B1_CHECKPOINT=0 时从头扫描）
 python3 $SCRIPT >> $LOG_FILE 2>&1
 
 # 记录执行结果
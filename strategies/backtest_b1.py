@@ -9,38 +9,23 @@ B1 策略回测脚本
 4. 统计5天的回测表现
 """
 
-import sqlite3
-import requests
-import pandas as pd
 from datetime import datetime, timedelta
 
+import kline_cache
+import price_lookup
+import storage
+
 # 配置
 BASE_URL = "http://139.155.158.47:8080"  # 使用服务器API
-DB_FILE = "stocks.db"
+DB_FILE = storage.DEFAULT_DB_FILE
+
+# 最近一个已收盘的交易日（K线缓存以此判断是否需要重新拉取）
+LATEST_TRADE_DATE = None
 
 def init_backtest_table():
     """初始化回测结果表"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS backtest_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                strategy_name TEXT NOT NULL,
-                date TEXT NOT NULL,
-                stock_count INTEGER,
-                valid_count INTEGER,
-                win_count INTEGER,
-                lose_count INTEGER,
-                win_rate REAL,
-                total_return REAL,
-                avg_return REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(strategy_name, date)
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        storage.ensure_backtest_results(DB_FILE)
     except Exception as e:
         print(f"初始化回测表失败: {e}")
 
@@ -50,32 +35,22 @@ def save_backtest_result(result, strategy_name="b1"):
         return
 
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-
         win_count = sum(1 for d in result['details'] if d['pnl'] > 0)
         lose_count = sum(1 for d in result['details'] if d['pnl'] < 0)
         win_rate = win_count / result['valid_count'] * 100 if result['valid_count'] > 0 else 0
 
-        c.execute('''
-            INSERT OR REPLACE INTO backtest_results
-            (strategy_name, date, stock_count, valid_count, win_count, lose_count,
-             win_rate, total_return, avg_return)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            strategy_name,
-            result['date'],
-            result['stock_count'],
-            result['valid_count'],
-            win_count,
-            lose_count,
-            win_rate,
-            result['total_return'],
-            result['avg_return']
-        ))
-
-        conn.commit()
-        conn.close()
+        # 当日汇总和逐笔交易一起写入
+        trades = [{
+            'select_date': result['date'],
+            'code': d['code'],
+            'name': d['name'],
+            'sell_date': d['sell_date'],
+            'entry_price': d['buy_price'],
+            'exit_price': d['sell_price'],
+            'pnl': d['pnl']
+        } for d in result['details']]
+        storage.save_backtest_results(DB_FILE, [dict(result, win_count=win_count, lose_count=lose_count,
+                                                     win_rate=win_rate, trades=trades)], strategy_name)
         print(f"✅ 回测结果已保存: {result['date']} 收益{result['avg_return']:+.2f}%")
     except Exception as e:
         print(f"❌ 保存回测结果失败: {e}")
@@ -95,88 +70,28 @@ def get_trading_dates(days=6):
 def get_top_stocks_from_db(date, top_n=10):
     """从数据库获取指定日期评分最高的前N只股票"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-
-        query = """
-            SELECT code, name, price, score, j_val, amplitude, vol_ratio, score_detail
-            FROM strategy_results
-            WHERE strategy_name = 'b1' AND date = ?
-            ORDER BY score DESC
-            LIMIT ?
-        """
-
-        c.execute(query, (date, top_n))
-        results = c.fetchall()
-        conn.close()
-
-        if not results:
-            return []
-
-        stocks = []
-        for row in results:
-            stocks.append({
-                'code': row[0],
-                'name': row[1],
-                'price': row[2],
-                'score': row[3],
-                'j_val': row[4],
-                'amplitude': row[5],
-                'vol_ratio': row[6],
-                'score_detail': row[7]
-            })
-
-        return stocks
+        return storage.top_selections(DB_FILE, date, top_n)
     except Exception as e:
         print(f"❌ 从数据库获取 {date} 数据失败: {e}")
         return []
 
-def get_next_day_price(code, current_date):
-    """获取股票次日收盘价（会自动跳过周末）"""
-    try:
-        # 获取K线数据
-        response = requests.get(f"{BASE_URL}/api/kline", params={
-            "code": code,
-            "type": "day"
-        }, timeout=10)
-
-        if response.status_code != 200:
-            return None
-
-        data = response.json()
-        if data['code'] != 0 or not data['data']:
-            return None
-
-        kline_list = data['data']['List']
-        if not kline_list:
-            return None
-
-        # 转换为DataFrame
-        df = pd.DataFrame(kline_list)
-        df['date'] = pd.to_datetime(df['Time']).dt.strftime('%Y-%m-%d')
+def get_next_day_price_with_date(code, current_date):
+    """
+    获取股票次日收盘价和实际日期（会自动跳过周末）
 
-        # 找到当前日期的索引
-        current_idx = df[df['date'] == current_date].index
-        if len(current_idx) == 0:
-            return None
-
-        current_idx = current_idx[0]
-
-        # 获取下一个交易日的收盘价（自动跳过周末和节假日）
-        if current_idx + 1 < len(df):
-            next_day = df.iloc[current_idx + 1]
-            return float(next_day['Close'])
-
-        return None
-    except Exception as e:
-        # print(f"获取 {code} 次日价格失败: {e}")
-        return None
+    Returns:
+        (price, date) 或 None
+    """
+    return price_lookup.get_lookup(BASE_URL, LATEST_TRADE_DATE).next_close(code, current_date)
 
 def calculate_daily_pnl(stocks, date):
     """计算某天选股组合次日的盈亏"""
     if not stocks:
         return None
 
+    # 一次并发取回组合内所有股票的K线（同一次运行内每只股票只取一次）
+    price_lookup.get_lookup(BASE_URL, LATEST_TRADE_DATE).prefetch(stock['code'] for stock in stocks)
+
     total_return = 0
     valid_count = 0
     details = []
@@ -185,12 +100,13 @@ def calculate_daily_pnl(stocks, date):
         code = stock['code']
         buy_price = stock['price']
 
-        # 获取次日收盘价
-        next_price = get_next_day_price(code, date)
+        # 获取次日收盘价和实际日期
+        next_close = get_next_day_price_with_date(code, date)
 
-        if next_price is None:
+        if next_close is None:
             # print(f"  ⚠️  {code} {stock['name']} 无法获取次日价格，跳过")
             continue
+        next_price, sell_date = next_close
 
         # 计算收益率
         pnl = (next_price - buy_price) / buy_price * 100
@@ -203,6 +119,7 @@ def calculate_daily_pnl(stocks, date):
             'score': stock['score'],
             'buy_price': buy_price,
             'sell_price': next_price,
+            'sell_date': sell_date,
             'pnl': pnl
         })
 
@@ -221,6 +138,7 @@ def calculate_daily_pnl(stocks, date):
     }
 
 def main():
+    global LATEST_TRADE_DATE
     print("=" * 80)
     print("📊 B1 策略回测分析")
     print("=" * 80)
@@ -230,6 +148,8 @@ def main():
     # 初始化回测结果表
     init_backtest_table()
 
+    LATEST_TRADE_DATE = kline_cache.get_latest_trade_date(BASE_URL)
+
     # 获取最近6天的日期
     dates = get_trading_dates(6)
     print(f"📅 回测日期: {dates[0]} ~ {dates[-1]} (最近6天)\n")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+B1 策略全历史向量化回测（基于本地K线缓存面板）
+
+backtest_b1.py / run_backtest_only.py 只回测最近几天，并且每笔交易都要重新取K线拿次日价格。
+这里直接在本地缓存的全市场面板上重放选股和次日卖出：
+1. 分批载入面板，一次算出所有股票、所有日期的指标和7个条件（截至当日判断，不用未来数据）
+2. 每个选股日取评分前10名（不足10个按实际数量），同 strategy_results 的 ORDER BY score DESC LIMIT 10
+3. 次日收盘卖出，按 run_backtest_only.py 的口径写入 backtest_results（date 为卖出日），
+   每笔交易写入 backtest_trades
+
+只读本地缓存，回测前先运行一次 strategy_b1.py 同步K线。
+
+用法：
+    python backtest_panel.py                         # 全部历史
+    python backtest_panel.py 2025-01-01 2025-06-30   # 指定选股日期范围
+"""
+
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+import http_client
+import kline_cache
+import panel
+import scoring
+import storage
+from strategy_b1 import M1, M2, M3, M4
+
+# 配置
+BASE_URL = "http://localhost:8080"
+DB_FILE = storage.DEFAULT_DB_FILE
+CHUNK_SIZE = 500  # 每批载入面板的股票数，控制内存占用
+TOP_N = 10        # 每天买入评分前N名
+
+# 全局股票名称缓存
+STOCK_NAMES_CACHE = {}
+
+def load_stock_names():
+    """批量加载股票名称（用于剔除ST股票，失败时不剔除）"""
+    global STOCK_NAMES_CACHE
+    try:
+        response = http_client.get(BASE_URL, "/api/stock-names")
+        response.raise_for_status()
+        data = response.json()
+        if data['code'] == 0:
+            STOCK_NAMES_CACHE = data['data']['data']
+            print(f"✅ 成功加载 {len(STOCK_NAMES_CACHE)} 只股票名称")
+            return True
+    except Exception as e:
+        print(f"⚠️  加载股票名称失败，不剔除ST股票: {e}")
+    return False
+
+def get_stock_name(code):
+    """获取股票名称"""
+    return STOCK_NAMES_CACHE.get(code, '')
+
+def is_st(name):
+    """ST股票（特别处理股票，退市风险高）"""
+    return bool(name) and ('ST' in name or '*ST' in name or 'S*' in name)
+
+def select_signals(p, start_date=None, end_date=None):
+    """
+    在面板上判断每只股票每个交易日是否满足B1条件
+
+    Returns:
+        [{'code', 'date', 'price', 'score', ..., 'sell_price', 'sell_date'}]：
+        sell_price / sell_date 为该股票下一根K线的收盘价和日期，没有时为 None
+    """
+    ind = panel.compute_indicators(p, (M1, M2, M3, M4))
+    close = p['close']
+    dates = p['dates']
+
+    with np.errstate(invalid='ignore'):
+        valid = ~(np.isnan(ind['zx_dk_line']) | np.isnan(ind['zx_trend_line']) | np.isnan(ind['j']))
+        cond1 = close > ind['zx_dk_line']
+        cond2 = ind['j'] < 13
+        cond3 = ind['zx_trend_line'] > ind['zx_dk_line']
+        cond4 = ind['amplitude'] < 4
+        cond5 = p['volume'] < ind['vol_ma12'] * 0.52
+    # 6/7. 截至当日过去40天无跳空缺口、无高位放量滞涨
+    cond6 = ~panel.has_gap_asof(p['high'], p['low'], days=40)
+    cond7 = ~panel.has_top_volume_stagnant_asof(p['open'], close, p['volume'], days=40, ma_period=20,
+                                                volume_threshold=1.5, up_strength_threshold=0.01)
+    # 截至当日K线数不足时与实时选股一样跳过
+    enough_bars = np.cumsum(~np.isnan(close), axis=-1) >= M4 + 5
+
+    hit = valid & cond1 & cond2 & cond3 & cond4 & cond5 & cond6 & cond7 & enough_bars
+    if start_date:
+        hit &= dates >= start_date
+    if end_date:
+        hit &= dates <= end_date
+
+    rows, cols = np.nonzero(hit)
+    scores = scoring.score_batch(close[rows, cols], ind['zx_dk_line'][rows, cols],
+                                 ind['zx_trend_line'][rows, cols], ind['j'][rows, cols],
+                                 p['volume'][rows, cols], ind['vol_ma12'][rows, cols],
+                                 ind['amplitude'][rows, cols], ind['amount_ma20'][rows, cols])
+    totals = scoring.round_scores(scores['total'])
+    deviations = scoring.round_scores(scores['trend_deviation'])
+
+    signals = []
+    length = close.shape[1]
+    for k, (i, t) in enumerate(zip(rows, cols)):
+        sell_price, sell_date = None, None
+        if t + 1 < length and not np.isnan(close[i, t + 1]):
+            sell_price, sell_date = float(close[i, t + 1]), str(dates[i, t + 1])
+
+        signals.append({
+            'code': p['codes'][i],
+            'date': str(dates[i, t]),
+            'price': float(close[i, t]),
+            'score': totals[k],
+            'score_detail': scoring.detail_at(scores, k),
+            'trend_strength': deviations[k],
+            'sell_price': sell_price,
+            'sell_date': sell_date,
+        })
+    return signals
+
+def scan_history(codes, start_date=None, end_date=None):
+    """分批载入面板并选股，返回全部信号"""
+    signals = []
+    for offset in range(0, len(codes), CHUNK_SIZE):
+        chunk = codes[offset:offset + CHUNK_SIZE]
+        p = panel.load_panel(chunk)
+        signals.extend(select_signals(p, start_date, end_date))
+        print(f"进度: {min(offset + CHUNK_SIZE, len(codes))}/{len(codes)} - 信号: {len(signals)}")
+    return signals
+
+def build_daily_results(signals, top_n=TOP_N):
+    """
+    按选股日期取评分前N名，计算次日收盘卖出的收益
+
+    Returns:
+        与 run_backtest_only.calculate_daily_pnl_with_sell_date() 相同结构的结果列表
+    """
+    by_date = {}
+    for sig in signals:
+        name = get_stock_name(sig['code'])
+        if is_st(name):
+            continue
+        sig['name'] = name
+        by_date.setdefault(sig['date'], []).append(sig)
+
+    results = []
+    for select_date in sorted(by_date):
+        stocks = sorted(by_date[select_date], key=lambda s: (-s['score'], s['code']))[:top_n]
+
+        total_return = 0
+        valid_count = 0
+        win_stocks = []
+        lose_stocks = []
+        trades = []
+        actual_sell_date = None
+        for stock in stocks:
+            if stock['sell_price'] is None:
+                continue
+            if actual_sell_date is None:
+                actual_sell_date = stock['sell_date']
+
+            pnl = (stock['sell_price'] - stock['price']) / stock['price'] * 100
+            total_return += pnl
+            valid_count += 1
+            trades.append({
+                'select_date': select_date,
+                'code': stock['code'],
+                'name': stock['name'],
+                'sell_date': stock['sell_date'],
+                'entry_price': stock['price'],
+                'exit_price': stock['sell_price'],
+                'pnl': pnl,
+            })
+            if pnl > 0:
+                win_stocks.append({'code': stock['code'], 'name': stock['name'], 'pnl': pnl})
+            elif pnl < 0:
+                lose_stocks.append({'code': stock['code'], 'name': stock['name'], 'pnl': pnl})
+
+        if valid_count == 0:
+            continue
+
+        results.append({
+            'select_date': select_date,
+            'sell_date': actual_sell_date,
+            'date': actual_sell_date,
+            'stock_count': len(stocks),
+            'valid_count': valid_count,
+            'win_count': len(win_stocks),
+            'lose_count': len(lose_stocks),
+            'total_return': total_return,
+            'avg_return': total_return / valid_count,
+            'win_rate': len(win_stocks) / valid_count * 100,
+            'win_stocks': win_stocks,
+            'lose_stocks': lose_stocks,
+            'trades': trades,
+        })
+    return results
+
+def init_backtest_table():
+    """初始化回测结果表"""
+    storage.ensure_backtest_results(DB_FILE)
+
+def save_backtest_results(results, strategy_name="b1"):
+    """一个事务内批量写入回测结果和逐笔交易"""
+    count = storage.save_backtest_results(DB_FILE, results, strategy_name)
+    trades = sum(len(r['trades']) for r in results)
+    print(f"💾 已保存 {count} 条回测结果、{trades} 笔交易到数据库")
+
+def print_trade_stats(start_date=None, end_date=None, strategy_name="b1"):
+    """按月汇总逐笔交易（SQL 聚合 backtest_trades）"""
+    rows = storage.trade_stats(DB_FILE, 'month', strategy_name, start_date=start_date, end_date=end_date)
+    if not rows:
+        return
+    print(f"\n📅 按月统计:")
+    print(f"{'月份':<10} {'交易':>6} {'胜率':>8} {'平均收益':>10} {'累计收益':>10}")
+    for row in rows:
+        print(f"{row['key']:<10} {row['count']:>6} {row['win_rate']:>7.1f}% "
+              f"{row['avg_pnl']:>+9.2f}% {row['total_pnl']:>+9.2f}%")
+
+def main():
+    start_date = sys.argv[1] if len(sys.argv) > 1 else None
+    end_date = sys.argv[2] if len(sys.argv) > 2 else None
+
+    print("=" * 70)
+    print("📊 B1 策略全历史回测（本地K线面板）")
+    print("=" * 70)
+    print(f"回测时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print(f"选股日期: {start_date or '最早'} ~ {end_date or '最新'}")
+    print(f"回测逻辑: 每天选出评分前{TOP_N}名，次日收盘卖出\n")
+
+    codes = kline_cache.cached_codes()
+    if not codes:
+        print("❌ 本地没有K线缓存，请先运行 strategy_b1.py")
+        return
+    print(f"📦 本地缓存 {len(codes)} 只股票")
+
+    load_stock_names()
+
+    start_time = time.time()
+    signals = scan_history(codes, start_date, end_date)
+    results = build_daily_results(signals)
+    duration = time.time() - start_time
+
+    print("\n" + "=" * 70)
+    print(f"🎉 回测完成！耗时: {duration:.2f}秒")
+    print(f"选股信号: {len(signals)} 个")
+    print(f"回测天数: {len(results)} 天")
+
+    if not results:
+        print("❌ 没有足够的数据进行回测")
+        print("=" * 70)
+        return
+
+    init_backtest_table()
+    save_backtest_results(results)
+
+    total_trades = sum(r['valid_count'] for r in results)
+    win_trades = sum(r['win_count'] for r in results)
+    total_pnl = sum(r['total_return'] for r in results)
+    avg_daily_return = sum(r['avg_return'] for r in results) / len(results)
+
+    print(f"📊 总交易次数: {total_trades} 次")
+    print(f"🎲 胜率: {win_trades / total_trades * 100:.1f}%")
+    print(f"📊 日均收益率: {avg_daily_return:+.2f}%")
+    print(f"📈 平均单笔收益: {total_pnl / total_trades:+.2f}%")
+    print_trade_stats(start_date, end_date)
+    print("=" * 70)
+
+if __name__ == "__main__":
+    main()
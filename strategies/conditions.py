@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按成本和选择性排序的短路条件评估器
+
+条件按“平均耗时 / 淘汰率”从小到大依次判断，遇到第一个不满足的条件立即停止；
+条件用到的特征按需计算并缓存，只有通过前面条件的股票才会计算昂贵的特征。
+
+多个条件共用同一个特征时，特征只在第一次访问时计算，耗时单独统计：
+一个条件的成本 = 自身判断耗时 + 它用到的各特征的平均计算耗时，
+这样排序不会因为“谁先触发了共享特征的计算”而偏向某一个条件。
+在判断条件之前就一定会计算的特征（prepaid，例如增量模式下每只股票都要推进状态的 curr）
+已经付过成本，排序时按 0 计，用到它的条件只算自身判断耗时。
+每次运行统计各条件的通过率和耗时并保存，下次运行据此调整顺序。
+"""
+
+import json
+import os
+import time
+
+
+class LazyFeatures:
+    """按需计算并缓存特征：第一次访问时调用对应的计算函数，并记录耗时"""
+
+    def __init__(self, providers, df, code=None):
+        self.df = df
+        self.code = code
+        self.timings = {}      # {特征名: 计算耗时秒}
+        self.accessed = set()  # 当前条件访问过的特征
+        self._providers = providers
+        self._values = {}
+        self._depth = 0
+        self._nested_seconds = 0.0
+
+    def __getitem__(self, name):
+        if self._depth == 0:
+            self.accessed.add(name)
+        if name not in self._values:
+            self._depth += 1
+            start = time.perf_counter()
+            try:
+                self._values[name] = self._providers[name](self.df, self)
+            finally:
+                self._depth -= 1
+            seconds = time.perf_counter() - start
+            self.timings[name] = seconds
+            if self._depth == 0:
+                self._nested_seconds += seconds
+        return self._values[name]
+
+    def begin(self):
+        """开始判断一个新条件：清空访问记录和特征计算耗时"""
+        self.accessed = set()
+        self._nested_seconds = 0.0
+
+    def feature_seconds(self):
+        """当前条件判断期间花在计算特征上的时间"""
+        return self._nested_seconds
+
+
+def order_conditions(names, stats, prepaid=()):
+    """
+    按 成本 / 淘汰率 升序排列条件
+
+    Args:
+        names: 条件名列表（声明顺序，作为统计数据不全时的默认顺序）
+        stats: 之前运行的统计 {'conditions': {...}, 'features': {...}}
+        prepaid: 判断条件之前总会先计算的特征，短路也省不下，不计入条件成本
+    """
+    cond_stats = (stats or {}).get('conditions', {})
+    feature_stats = (stats or {}).get('features', {})
+    if any(not cond_stats.get(name, {}).get('evaluated') for name in names):
+        return list(names)
+
+    def feature_cost(feature):
+        if feature in prepaid:
+            return 0.0
+        s = feature_stats.get(feature)
+        if not s or not s['computed']:
+            return 0.0
+        return s['seconds'] / s['computed']
+
+    def rank(name):
+        s = cond_stats[name]
+        cost = s['seconds'] / s['evaluated'] + sum(feature_cost(f) for f in s.get('uses', []))
+        reject_rate = 1 - s['passed'] / s['evaluated']
+        return cost / reject_rate if reject_rate > 0 else float('inf')
+
+    return sorted(names, key=rank)
+
+
+def evaluate(conditions, order, features):
+    """
+    依次判断条件，遇到第一个不满足的条件即停止
+
+    Returns:
+        (是否全部满足, trace)：trace 为
+        {'conditions': [(条件名, 是否满足, 自身耗时秒, 用到的特征)], 'features': {特征名: 耗时秒}}
+    """
+    steps = []
+    passed = True
+    for name in order:
+        features.begin()
+        start = time.perf_counter()
+        passed = bool(conditions[name](features))
+        seconds = time.perf_counter() - start - features.feature_seconds()
+        steps.append((name, passed, max(seconds, 0.0), sorted(features.accessed)))
+        if not passed:
+            break
+    return passed, {'conditions': steps, 'features': dict(features.timings)}
+
+
+def record(stats, trace):
+    """把一次评估的 trace 累加到统计中"""
+    cond_stats = stats.setdefault('conditions', {})
+    for name, passed, seconds, uses in trace['conditions']:
+        s = cond_stats.setdefault(name, {'evaluated': 0, 'passed': 0, 'seconds': 0.0, 'uses': []})
+        s['evaluated'] += 1
+        s['passed'] += int(passed)
+        s['seconds'] += seconds
+        s['uses'] = sorted(set(s['uses']) | set(uses))
+
+    feature_stats = stats.setdefault('features', {})
+    for name, seconds in trace['features'].items():
+        s = feature_stats.setdefault(name, {'computed': 0, 'seconds': 0.0})
+        s['computed'] += 1
+        s['seconds'] += seconds
+
+
+def merge_stats(old, new):
+    """用本次统计覆盖旧统计；本次没有评估到的条件（被前面的条件短路）保留旧数据"""
+    merged = {}
+    for key in ('conditions', 'features'):
+        merged[key] = dict((old or {}).get(key, {}))
+        merged[key].update((new or {}).get(key, {}))
+    return merged
+
+
+def load_stats(path):
+    """读取之前运行的统计，不存在或损坏时返回空字典"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def save_stats(path, stats):
+    """保存统计"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+
+
+def format_report(stats, order):
+    """生成各条件通过率报告（按本次评估顺序）"""
+    cond_stats = stats.get('conditions', {})
+    feature_stats = stats.get('features', {})
+    lines = [f"{'条件':<16} {'评估':>7} {'通过':>7} {'通过率':>8} {'平均耗时':>10}  特征"]
+    for name in order:
+        s = cond_stats.get(name)
+        if not s or not s['evaluated']:
+            lines.append(f"{name:<16} {0:>7} {0:>7} {'-':>8} {'-':>10}")
+            continue
+        rate = s['passed'] / s['evaluated'] * 100
+        avg_ms = s['seconds'] / s['evaluated'] * 1000
+        uses = ', '.join(s.get('uses', []))
+        lines.append(f"{name:<16} {s['evaluated']:>7} {s['passed']:>7} {rate:>7.1f}% {avg_ms:>8.3f}ms  {uses}")
+    for name, s in feature_stats.items():
+        avg_ms = s['seconds'] / s['computed'] * 1000
+        lines.append(f"  特征 {name:<12} 计算 {s['computed']:>7} 次，平均 {avg_ms:.3f}ms")
+    return "\n".join(lines)
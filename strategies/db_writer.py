@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台批量写库线程
+
+全市场扫描时命中结果原来先攒在列表里，扫描全部结束后才一次写库：
+中途进程崩溃会丢掉所有结果，网页在扫描结束前也看不到任何新数据。
+BatchWriter 在一个后台线程里写库，扫描循环 put() 一行后立即返回：
+- 攒够 batch_size 行，或距第一行到达已过 flush_interval 秒，就用一个小事务写入（storage.write_many()）
+- 队列最多缓存 max_pending 行，只有写库长时间跟不上时 put() 才会等待，内存不会无限增长
+- close() 是结束屏障：写完队列里剩下的所有行后才返回，之后再读库能看到全部结果
+- 某一批写入失败（例如其他进程长时间占着写锁）时保留下来，每隔 flush_interval 秒和新到的行一起重试；
+  连续失败 max_retries 次就丢弃这些行，行数累计在 failed 里、最后一次的异常记在 error 里，
+  保留的行数和 close() 的等待时间都有上限（close() 最多再重试 max_retries 次）。
+  调用方根据 failed 决定是否需要重跑（strategy_b1 有行写库失败时不把断点标记为完成）
+"""
+
+import queue
+import threading
+import time
+
+import storage
+
+_STOP = object()
+
+
+class BatchWriter:
+    """后台线程按小批量事务写入同一条 SQL 的参数行"""
+
+    def __init__(self, path, sql, batch_size=50, flush_interval=1.0, max_pending=10000, max_retries=3):
+        self.path = path
+        self.sql = sql
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.written = 0    # 已写入的行数
+        self.failed = 0     # 重试多次仍写不进去、已丢弃的行数
+        self.error = None   # 最近一次导致丢弃的异常
+        self._failures = 0  # 当前保留的行已连续失败的次数
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, row):
+        """提交一行（队列满时等待写入线程腾出空间）"""
+        self._queue.put(row)
+
+    def _flush(self, batch):
+        """写入一批，失败时原样返回留待重试；连续失败 max_retries 次时丢弃并返回空列表"""
+        try:
+            self.written += storage.write_many(self.path, self.sql, batch)
+            self._failures = 0
+            return []
+        except Exception as e:
+            self._failures += 1
+            if self._failures < self.max_retries:
+                print(f"❌ 后台写库失败（{len(batch)} 行，第 {self._failures} 次，稍后重试）: {e}")
+                return batch
+            print(f"❌ 后台写库连续失败 {self._failures} 次，丢弃 {len(batch)} 行: {e}")
+            self.failed += len(batch)
+            self.error = e
+            self._failures = 0
+            return []
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                row = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                row = None
+
+            if row is _STOP:
+                break
+            if row is not None:
+                batch.append(row)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            # 上一次写入失败后不再按行数触发，等到 deadline 才重试，避免每来一行就撞一次写锁
+            full = len(batch) >= self.batch_size and not self._failures
+            if batch and (full or time.monotonic() >= deadline):
+                batch = self._flush(batch)
+                deadline = time.monotonic() + self.flush_interval if batch else None
+
+        # 结束时剩下的行最多再试 max_retries 次
+        while batch:
+            batch = self._flush(batch)
+            if batch:
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        """结束屏障：等待队列中所有行写完（或重试多次后丢弃，见 failed），返回写入的总行数"""
+        while self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=1)
+                break
+            except queue.Full:
+                continue  # 写入线程仍在消费队列；线程意外退出时不会一直阻塞在这里
+        self._thread.join()
+        return self.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
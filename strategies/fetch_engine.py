@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio 并发抓取引擎
+
+全市场扫描几乎全部时间都在等网络，用固定的少量线程逐个阻塞请求时，
+线程数就是吞吐上限。这里由 asyncio 统一调度，同时在途的请求数可配置（默认100），
+每个请求完成后立即把结果交给分析阶段，不必等全部抓取结束。
+
+项目依赖只有 requests/pandas/numpy，抓取函数本身仍是阻塞调用，
+在与在途上限同样大小的线程池中执行，asyncio 负责限流和结果流式分发。
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+# 默认同时在途的请求数
+DEFAULT_MAX_INFLIGHT = 100
+
+_DONE = object()
+
+
+async def fetch_stream(codes, fetch_fn, max_inflight=DEFAULT_MAX_INFLIGHT, return_exceptions=False):
+    """
+    并发抓取并按完成顺序逐个产出结果
+
+    Args:
+        codes: 股票代码列表
+        fetch_fn: 抓取函数 fetch_fn(code) -> payload，失败时抛出异常（见 return_exceptions），
+                  没有数据时可以返回 None
+        max_inflight: 同时在途的请求数上限
+        return_exceptions: 为 True 时 fetch_fn 抛出的异常对象作为 payload 产出，便于调用方区分失败原因和无数据；
+                           为 False 时异常被吞掉，payload 为 None
+
+    Yields:
+        (code, payload)：fetch_fn 抛出异常时 payload 为异常对象（return_exceptions=True）或 None
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max_inflight)
+    # 结果队列有上限，分析阶段跟不上时抓取会自动放慢
+    queue = asyncio.Queue(maxsize=max_inflight)
+    code_iter = iter(codes)
+
+    async def worker():
+        # 所有 worker 共享同一个迭代器，每个代码只会被取走一次
+        for code in code_iter:
+            try:
+                payload = await loop.run_in_executor(executor, fetch_fn, code)
+            except Exception as e:
+                payload = e if return_exceptions else None
+            await queue.put((code, payload))
+
+    async def close_when_done(workers):
+        await asyncio.gather(*workers)
+        await queue.put(_DONE)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max_inflight)]
+    closer = asyncio.ensure_future(close_when_done(workers))
+
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        for task in workers:
+            task.cancel()
+        closer.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+选股结果的多周期远期收益
+
+对 strategy_results 中的每一条选股，用本地缓存的日K线一次算出
+T+1、T+3、T+5、T+10、T+20 收盘卖出的收益率，保存到 forward_returns 表，
+比较不同持有周期时直接查表，不必重新取数据。
+
+- 买入价和卖出价都取同一份缓存K线的收盘价（前复权口径一致），
+  T+N 指选股日之后该股票的第 N 根K线（停牌日不计）
+- 已保存的 (选股, 周期) 不重复计算；卖出日还没到的周期留到以后的运行再补
+- 永远算不出来的记为 unavailable（终态，不再重试）：K线里没有选股日这一根，
+  或选股日之后超过 MAX_WAIT_DAYS 个自然日仍没有第 N 根K线（退市、长期停牌）
+
+用法：
+    python forward_returns.py
+"""
+
+import time
+from datetime import datetime
+
+import numpy as np
+
+import kline_cache
+import storage
+
+# 配置
+BASE_URL = "http://localhost:8080"
+DB_FILE = storage.DEFAULT_DB_FILE
+HORIZONS = (1, 3, 5, 10, 20)  # 持有周期（交易日）
+TOP_N = 10                    # 汇总时另外统计每天评分前N名
+MAX_WAIT_DAYS = 90            # 选股日之后等待卖出K线的最长自然日数，超过记为 unavailable
+
+# forward_returns.status
+STATUS_OK = 'ok'
+STATUS_UNAVAILABLE = 'unavailable'  # 价格和收益为空
+
+# 最近一个已收盘的交易日（K线缓存以此判断是否需要重新拉取）
+LATEST_TRADE_DATE = None
+
+def init_forward_returns_table():
+    """初始化远期收益表"""
+    with storage.transaction(DB_FILE) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS forward_returns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                strategy_name TEXT NOT NULL,
+                code TEXT NOT NULL,
+                date TEXT NOT NULL,
+                horizon INTEGER NOT NULL,
+                entry_price REAL,
+                exit_date TEXT,
+                exit_price REAL,
+                return_pct REAL,
+                status TEXT NOT NULL DEFAULT 'ok',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(strategy_name, code, date, horizon)
+            )
+        ''')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(forward_returns)')]
+        if 'status' not in columns:
+            conn.execute("ALTER TABLE forward_returns ADD COLUMN status TEXT NOT NULL DEFAULT 'ok'")
+
+def get_pending_selections(strategy_name="b1"):
+    """
+    取出还缺少部分周期远期收益的选股（unavailable 也算已有，不再重试）
+
+    Returns:
+        {code: [date, ...]}
+    """
+    rows = storage.query(DB_FILE, '''
+        SELECT s.code, s.date
+        FROM strategy_results s
+        LEFT JOIN forward_returns f
+            ON f.strategy_name = s.strategy_name AND f.code = s.code AND f.date = s.date
+        WHERE s.strategy_name = ?
+        GROUP BY s.code, s.date
+        HAVING COUNT(f.horizon) < ?
+    ''', (strategy_name, len(HORIZONS)))
+
+    pending = {}
+    for code, date in rows:
+        pending.setdefault(code, []).append(date)
+    return pending
+
+def expired(dates, as_of, max_wait_days=MAX_WAIT_DAYS):
+    """各选股日到 as_of 是否已超过 max_wait_days 个自然日（as_of 为 None 时都未超过）"""
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    if as_of is None:
+        return np.zeros(len(dates), dtype=bool)
+    return (np.datetime64(as_of, 'D') - dates).astype(int) > max_wait_days
+
+def compute_forward_returns(df, dates, horizons=HORIZONS, as_of=None):
+    """
+    向量化计算一只股票若干选股日的多周期收益
+
+    Args:
+        df: 该股票的日K线（kline_cache 格式，按日期升序），接口没有该股票的数据时为 None
+        dates: 选股日期列表
+        horizons: 持有周期
+        as_of: 计算时的日期（最近交易日），用来判断卖出K线是否已经等得太久
+
+    Returns:
+        [(date, horizon, entry_price, exit_date, exit_price, return_pct, status)]：
+        卖出日已到的周期为 STATUS_OK；永远算不出来的为 STATUS_UNAVAILABLE（价格和收益为 None）；
+        还可能等到的周期不返回
+    """
+    dates = np.asarray(dates, dtype=str)
+    if df is None or len(df) == 0:
+        return [(d, horizon, None, None, None, None, STATUS_UNAVAILABLE)
+                for d in dates[expired(dates, as_of)] for horizon in horizons]
+
+    kline_dates = df['date'].to_numpy(dtype=str)
+    closes = df['close'].to_numpy(dtype=np.float64)
+
+    idx = np.searchsorted(kline_dates, dates)
+    found = (idx < len(kline_dates)) & (kline_dates[np.minimum(idx, len(kline_dates) - 1)] == dates)
+    # K线已经覆盖到选股日之后却没有这一天，或者K线停在选股日之前太久：都不会再有结果
+    missing = ~found & ((dates < kline_dates[-1]) | expired(dates, as_of))
+    rows = [(d, horizon, None, None, None, None, STATUS_UNAVAILABLE)
+            for d in dates[missing] for horizon in horizons]
+
+    dates, idx = dates[found], idx[found]
+    entry = closes[idx]
+    too_late = expired(dates, as_of)
+    for horizon in horizons:
+        exit_idx = idx + horizon
+        ready = exit_idx < len(closes)
+        exit_price = closes[np.minimum(exit_idx, len(closes) - 1)]
+        returns = (exit_price - entry) / entry * 100
+        for k in np.nonzero(ready)[0]:
+            rows.append((dates[k], horizon, float(entry[k]), kline_dates[exit_idx[k]],
+                         float(exit_price[k]), float(returns[k]), STATUS_OK))
+        for k in np.nonzero(~ready & too_late)[0]:
+            rows.append((dates[k], horizon, float(entry[k]), None, None, None, STATUS_UNAVAILABLE))
+    return rows
+
+def save_forward_returns(rows, strategy_name="b1"):
+    """一个事务内批量写入"""
+    storage.write_many(DB_FILE, '''
+        INSERT OR REPLACE INTO forward_returns
+        (strategy_name, code, date, horizon, entry_price, exit_date, exit_price, return_pct, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(strategy_name,) + row for row in rows])
+
+def update_forward_returns(strategy_name="b1"):
+    """
+    补算所有缺少周期的选股（其已有周期一并重写）
+
+    Returns:
+        (写入的条数, 其中 unavailable 的条数)
+    """
+    init_forward_returns_table()
+    pending = get_pending_selections(strategy_name)
+    print(f"📋 待计算: {sum(len(v) for v in pending.values())} 条选股，{len(pending)} 只股票")
+
+    as_of = LATEST_TRADE_DATE or datetime.now().strftime('%Y-%m-%d')
+    rows = []
+    for code, dates in pending.items():
+        try:
+            df = kline_cache.get_kline(code, BASE_URL, until=LATEST_TRADE_DATE)
+        except Exception:
+            continue  # 网络等临时错误，下次运行再算
+        rows.extend((code,) + row for row in compute_forward_returns(df, dates, as_of=as_of))
+
+    if rows:
+        save_forward_returns(rows, strategy_name)
+    return len(rows), sum(1 for row in rows if row[-1] == STATUS_UNAVAILABLE)
+
+def summarize(strategy_name="b1", top_n=TOP_N):
+    """
+    按持有周期汇总收益
+
+    Returns:
+        {'all': {horizon: stats}, 'top': {horizon: stats}}：top 为每天评分前 top_n 名
+    """
+    rows = storage.query(DB_FILE, '''
+        SELECT f.horizon, f.return_pct, s.rank
+        FROM forward_returns f
+        JOIN (
+            SELECT strategy_name, code, date,
+                   ROW_NUMBER() OVER (PARTITION BY date ORDER BY score DESC, code) - 1 AS rank
+            FROM strategy_results
+            WHERE strategy_name = ?
+        ) s ON s.strategy_name = f.strategy_name AND s.code = f.code AND s.date = f.date
+        WHERE f.strategy_name = ? AND f.status = ?
+    ''', (strategy_name, strategy_name, STATUS_OK))
+
+    def stats(values):
+        values = np.asarray(values, dtype=np.float64)
+        return {
+            'count': len(values),
+            'mean': float(values.mean()),
+            'median': float(np.median(values)),
+            'win_rate': float((values > 0).mean() * 100),
+        }
+
+    summary = {'all': {}, 'top': {}}
+    for horizon in HORIZONS:
+        all_values = [r for h, r, _ in rows if h == horizon]
+        top_values = [r for h, r, rank in rows if h == horizon and rank < top_n]
+        if all_values:
+            summary['all'][horizon] = stats(all_values)
+        if top_values:
+            summary['top'][horizon] = stats(top_values)
+    return summary
+
+def print_summary(summary):
+    """打印各持有周期的收益对比"""
+    for key, title in (('all', '全部选股'), ('top', f'每天评分前{TOP_N}名')):
+        print(f"\n📊 {title}")
+        print(f"{'周期':<8} {'样本':>6} {'平均收益':>10} {'中位数':>10} {'胜率':>8}")
+        for horizon, s in summary[key].items():
+            print(f"T+{horizon:<6} {s['count']:>6} {s['mean']:>+9.2f}% {s['median']:>+9.2f}% {s['win_rate']:>7.1f}%")
+
+def main():
+    global LATEST_TRADE_DATE
+    print("=" * 70)
+    print(f"📈 计算选股多周期远期收益 (T+{', T+'.join(str(h) for h in HORIZONS)})")
+    print("=" * 70)
+
+    LATEST_TRADE_DATE = kline_cache.get_latest_trade_date(BASE_URL)
+
+    start_time = time.time()
+    count, unavailable = update_forward_returns()
+    print(f"💾 写入 {count} 条远期收益（其中无法计算 {unavailable} 条），耗时 {time.time() - start_time:.2f}秒")
+
+    print_summary(summarize())
+    print("=" * 70)
+
+if __name__ == "__main__":
+    main()
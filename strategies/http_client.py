@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+策略脚本共用的HTTP客户端
+
+所有脚本共享一个带连接池的 requests.Session（keep-alive 复用TCP连接），
+请求失败（连接错误、超时、5xx）时按带抖动的指数退避重试有限次数，
+各接口使用各自的超时时间。
+
+Go 服务端把上游（通达信/同花顺）的错误以 HTTP 200 + {"code": -1, "message": ...} 返回
+（web/server.go 的 errorResponse），只看状态码永远不会重试。
+读取业务数据用 get_json()：code != 0 同样退避重试，用尽后抛出 APIError。
+"""
+
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 各接口超时时间（秒），未列出的接口使用 DEFAULT_TIMEOUT
+ENDPOINT_TIMEOUTS = {
+    '/api/kline': 10,
+    '/api/kline-history': 10,
+    '/api/stock-names': 30,
+    '/api/stock-codes': 30,
+    '/api/search': 5,
+    '/api/workday': 10,
+}
+DEFAULT_TIMEOUT = 10
+
+# 重试参数：最多重试次数、退避基数（秒）、单次退避上限（秒）
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+
+# 需要重试的HTTP状态码
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+
+class APIError(requests.RequestException):
+    """接口返回 code != 0（服务端或上游数据源出错），重试用尽后抛出"""
+
+    def __init__(self, path, code, message=''):
+        super().__init__(f"{path} code={code}: {message}")
+        self.path = path
+        self.code = code
+        self.message = message
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _build_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def configure(pool_size=10):
+    """按并发数创建连接池（应在启动工作线程之前调用）"""
+    global _session
+    session = _build_session(pool_size)
+    with _session_lock:
+        _session = session
+    return session
+
+
+def get_session():
+    """获取共享 Session，未配置时按默认连接池大小创建"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _build_session(10)
+        return _session
+
+
+def _backoff(attempt):
+    """第 attempt 次重试前的等待时间（full jitter）"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def get(base_url, path, params=None, timeout=None):
+    """
+    发送GET请求，失败时退避重试
+
+    Args:
+        base_url: API 地址
+        path: 接口路径，如 /api/kline
+        params: 查询参数
+        timeout: 超时时间，默认按接口取 ENDPOINT_TIMEOUTS
+
+    Returns:
+        requests.Response（重试用尽后仍可能是5xx响应，由调用方判断状态码）
+
+    Raises:
+        requests.RequestException: 重试用尽后仍连接失败或超时
+    """
+    if timeout is None:
+        timeout = ENDPOINT_TIMEOUTS.get(path, DEFAULT_TIMEOUT)
+
+    session = get_session()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = session.get(f"{base_url}{path}", params=params, timeout=timeout)
+            if response.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                return response
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+        time.sleep(_backoff(attempt))
+
+
+def get_json(base_url, path, params=None, timeout=None):
+    """
+    发送GET请求并返回 JSON 中的 data 字段
+
+    连接错误、超时、5xx 由 get() 重试；返回 code != 0 时也按同样的退避重试。
+
+    Raises:
+        requests.HTTPError: 重试用尽后仍是 5xx，或其他非 200 状态码
+        APIError: 重试用尽后仍返回 code != 0
+        requests.RequestException: 重试用尽后仍连接失败或超时
+        ValueError: 返回内容不是 JSON
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        response = get(base_url, path, params=params, timeout=timeout)
+        response.raise_for_status()
+        payload = response.json()
+        if payload['code'] == 0:
+            return payload.get('data')
+        if attempt == MAX_RETRIES:
+            raise APIError(path, payload['code'], payload.get('message', ''))
+        time.sleep(_backoff(attempt))
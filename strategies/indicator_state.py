@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化的增量指标状态
+
+B1 用到的指标都可以逐根K线推进：
+- EMA10、趋势线 EMA(EMA10)、KDJ 的 K/D 是 adjust=False 的指数加权递推，只需保存当前值和权重；
+- MA14/28/57/114、vol_ma12、amount_ma20、9日高低点是有限窗口，只需保存最近 max(周期) 根K线。
+
+每只股票的状态保存在 data/indicator_state/<code>.npz。收盘后选股时读取状态，
+只用上次之后新增的K线推进，再保存；每只股票的计算量与历史长度无关。
+
+状态与传入的K线对不上时（没有状态、上次状态的日期已不在传入的K线中、
+该日收盘价变了即复权发生变化），用传入的K线从头重建状态。
+"""
+
+import os
+
+import numpy as np
+
+import kline_cache
+import panel
+
+STATE_DIR = os.path.join("data", "indicator_state")
+
+# 指数加权递推的 alpha，状态中 (均值, 权重) 成对保存
+EWM_SERIES = {
+    'ema10': 2 / 11,          # EMA(C, 10)
+    'zx_trend_line': 2 / 11,  # EMA(EMA10, 10)
+    'k': 1 / 3,               # com=2
+    'd': 1 / 3,
+}
+
+# KDJ 的 RSV 窗口
+RSV_WINDOW = 9
+
+
+def _state_path(code):
+    return os.path.join(STATE_DIR, f"{code}.npz")
+
+
+def new_state(buffer_bars):
+    """空状态：保存最近 buffer_bars 根K线的窗口，递推值为 NaN、权重为 1"""
+    state = {'date': '', 'rsv': np.nan}
+    for field in kline_cache.PRICE_COLUMNS:
+        state[field] = np.full(buffer_bars, np.nan)
+    for name in EWM_SERIES:
+        state[name] = np.nan
+        state[name + '_wt'] = 1.0
+    return state
+
+
+def _window_mean(buf, window):
+    values = buf[-window:]
+    if len(values) < window or np.isnan(values).any():
+        return np.nan
+    return values.mean()
+
+
+def advance(state, bar):
+    """
+    用一根新K线推进状态
+
+    Args:
+        state: new_state() / load_state() 返回的状态（原地修改）
+        bar: 一根K线，包含 date 和 kline_cache.PRICE_COLUMNS 各字段
+    """
+    for field in kline_cache.PRICE_COLUMNS:
+        buf = state[field]
+        buf[:-1] = buf[1:]
+        buf[-1] = float(bar[field])
+    state['date'] = str(bar['date'])
+
+    low_min = state['low'][-RSV_WINDOW:].min()
+    high_max = state['high'][-RSV_WINDOW:].max()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        state['rsv'] = float((state['close'][-1] - low_min) / (high_max - low_min) * 100)
+
+    # 按依赖顺序递推：趋势线用本步的 ema10，D 用本步的 K
+    _advance_ewm(state, 'ema10', state['close'][-1])
+    _advance_ewm(state, 'zx_trend_line', state['ema10'])
+    _advance_ewm(state, 'k', state['rsv'])
+    _advance_ewm(state, 'd', state['k'])
+
+
+def _advance_ewm(state, name, cur):
+    weighted, old_wt = panel.ewm_step(state[name], state[name + '_wt'], cur, EWM_SERIES[name])
+    state[name] = float(weighted)
+    state[name + '_wt'] = float(old_wt)
+
+
+def snapshot(state, ma_periods=panel.DEFAULT_MA_PERIODS):
+    """
+    最新一根K线的指标
+
+    Returns:
+        {指标名: 值}，指标名与 strategy_b1.calculate_indicators() 生成的列名相同
+    """
+    close = state['close']
+    ind = {}
+    for i, period in enumerate(ma_periods, start=1):
+        ind[f'ma_m{i}'] = _window_mean(close, period)
+    ind['zx_dk_line'] = sum(ind[f'ma_m{i}'] for i in range(1, len(ma_periods) + 1)) / len(ma_periods)
+
+    ind['ema10'] = state['ema10']
+    ind['zx_trend_line'] = state['zx_trend_line']
+    ind['rsv'] = state['rsv']
+    ind['k'] = state['k']
+    ind['d'] = state['d']
+    ind['j'] = 3 * state['k'] - 2 * state['d']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ind['amplitude'] = float((state['high'][-1] - state['low'][-1]) / state['pre_close'][-1] * 100)
+    ind['vol_ma12'] = _window_mean(state['volume'], 12)
+    ind['amount_ma20'] = _window_mean(state['amount'], 20)
+    return ind
+
+
+def load_state(code):
+    """读取保存的状态，不存在或损坏时返回 None"""
+    path = _state_path(code)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            state = {}
+            for key in data.files:
+                value = data[key]
+                state[key] = value.copy() if value.ndim else value.item()
+            state['date'] = str(state['date'])
+            return state
+    except Exception:
+        return None
+
+
+def save_state(code, state):
+    """原子写入状态文件（先写临时文件再替换）"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = _state_path(code)
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **state)
+    os.replace(tmp_path, path)
+
+
+def _resume_index(state, df):
+    """
+    状态可以接着推进时，返回第一根新K线在 df 中的位置，否则返回 None
+
+    要求状态的日期在 df 中，且该日收盘价与状态中的一致（复权没有变化）。
+    """
+    if state is None or not state['date']:
+        return None
+    dates = df['date'].to_numpy(dtype=str)
+    pos = np.searchsorted(dates, state['date'])
+    if pos >= len(dates) or dates[pos] != state['date']:
+        return None
+    saved_close = state['close'][-1]
+    close = float(df['close'].iloc[pos])
+    if abs(close - saved_close) > kline_cache.ADJUST_TOLERANCE * max(abs(saved_close), 1e-12):
+        return None
+    return pos + 1
+
+
+def update(code, df, ma_periods=panel.DEFAULT_MA_PERIODS):
+    """
+    把状态推进到 df 的最后一根K线并保存，返回最后一根K线的指标
+
+    Args:
+        code: 股票代码
+        df: 按日期升序的K线（至少包含上次状态之后的全部新K线）
+        ma_periods: 知行多空线均线周期
+
+    Returns:
+        snapshot() 的结果
+    """
+    buffer_bars = max(max(ma_periods), RSV_WINDOW, 20)
+    state = load_state(code)
+    start = _resume_index(state, df)
+    if start is None or len(state['close']) != buffer_bars:
+        state = new_state(buffer_bars)
+        start = 0
+
+    if start < len(df):
+        for bar in df.iloc[start:].to_dict('records'):
+            advance(state, bar)
+        save_state(code, state)
+
+    return snapshot(state, ma_periods)
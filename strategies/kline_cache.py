@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地日K线缓存（前复权）
+
+每只股票一个 .npz 文件，按列保存 date/open/high/low/close/volume/amount/pre_close，
+以日期为索引。strategy_b1.py、run_strategy_for_date.py 和回测脚本共享同一份缓存：
+先读本地，缓存缺失时请求 /api/kline 拉全量；缓存不够新时只通过
+/api/kline-history 增量拉取最后缓存日期之后的K线并追加。
+
+前复权价格在除权除息后会整体改写历史，所以增量请求总是包含最后一根已缓存K线，
+比较其收盘价：不一致说明该股票发生了复权变化，只对这只股票重新全量拉取。
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+import http_client
+
+# 缓存目录（相对项目根目录，与 data/stocks.db 同目录）
+CACHE_DIR = os.path.join("data", "kline_cache")
+
+# 缓存的数值列
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'amount', 'pre_close']
+
+# /api/kline-history 单次最多返回的K线条数
+HISTORY_LIMIT_MAX = 800
+
+# 重叠K线收盘价的相对误差超过该值即认为复权因子变化
+ADJUST_TOLERANCE = 1e-4
+
+# 本次运行中检测到复权变化、已重新全量拉取的股票
+ADJUSTED_CODES = set()
+
+
+def _cache_path(code):
+    return os.path.join(CACHE_DIR, f"{code}.npz")
+
+
+def kline_list_to_df(kline_list):
+    """把 /api/kline 返回的 List 转成标准 DataFrame（日期统一为 YYYY-MM-DD）"""
+    df = pd.DataFrame(kline_list)
+    df = df.rename(columns={
+        'Time': 'date',
+        'Open': 'open',
+        'High': 'high',
+        'Low': 'low',
+        'Close': 'close',
+        'Volume': 'volume',
+        'Amount': 'amount',
+        'Last': 'pre_close'
+    })
+    df['date'] = df['date'].astype(str).str[:10]
+
+    # 确保数值类型
+    for col in PRICE_COLUMNS:
+        df[col] = pd.to_numeric(df[col])
+
+    return df[['date'] + PRICE_COLUMNS].reset_index(drop=True)
+
+
+def load_kline(code):
+    """
+    读取本地缓存
+
+    Returns:
+        (df, synced_to): synced_to 为缓存已确认完整的最后日期；无缓存时返回 (None, None)
+    """
+    path = _cache_path(code)
+    if not os.path.exists(path):
+        return None, None
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            df = pd.DataFrame({'date': data['date'].astype(str)})
+            for col in PRICE_COLUMNS:
+                df[col] = data[col]
+            synced_to = str(data['synced_to'])
+        return df, synced_to
+    except Exception:
+        # 文件损坏视为缓存缺失
+        return None, None
+
+
+def cached_codes():
+    """本地已缓存的全部股票代码（按代码排序）"""
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    return sorted(name[:-len(".npz")] for name in os.listdir(CACHE_DIR) if name.endswith(".npz"))
+
+
+def save_kline(code, df, synced_to):
+    """写入本地缓存（先写临时文件再替换，避免中断时留下半个文件）"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _cache_path(code)
+    tmp_path = path + ".tmp"
+
+    arrays = {'date': df['date'].to_numpy(dtype=str)}
+    for col in PRICE_COLUMNS:
+        arrays[col] = df[col].to_numpy(dtype=np.float64)
+
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, synced_to=np.array(synced_to), **arrays)
+    os.replace(tmp_path, path)
+
+
+def fetch_kline_api(code, base_url):
+    """
+    从 /api/kline 拉取完整日K线（前复权），接口正常返回但没有K线时返回 None
+
+    Raises:
+        requests.HTTPError: 重试用尽后仍是 5xx（服务端故障，与“没有数据”区分开）
+        http_client.APIError: 重试用尽后仍返回 code != 0（上游数据源出错，同样不是“没有数据”）
+    """
+    data = http_client.get_json(base_url, "/api/kline", params={
+        "code": code,
+        "type": "day"
+    })
+    if not data:
+        return None
+
+    kline_list = data['List']
+    if not kline_list:
+        return None
+
+    return kline_list_to_df(kline_list)
+
+
+def fetch_kline_delta(code, base_url, since, until):
+    """
+    从 /api/kline-history 拉取 since（含）之后的日K线
+
+    接口只支持按条数截取最近的K线，这里按自然日天数估算条数（必然不少于交易日数）。
+
+    Returns:
+        DataFrame（可能为空）；返回的K线没有覆盖到 since 时返回 None，需要全量拉取
+
+    Raises:
+        异常同 fetch_kline_api()
+    """
+    days = (datetime.strptime(until, '%Y-%m-%d') - datetime.strptime(since, '%Y-%m-%d')).days + 1
+    if days > HISTORY_LIMIT_MAX:
+        return None
+
+    data = http_client.get_json(base_url, "/api/kline-history", params={
+        "code": code,
+        "type": "day",
+        "start_date": since.replace('-', ''),
+        "end_date": until.replace('-', ''),
+        "limit": days
+    })
+    if not data:
+        return None
+
+    kline_list = data['List']
+    if not kline_list:
+        return None
+
+    df = kline_list_to_df(kline_list)
+    if df['date'].iloc[0] > since:
+        # 截取的条数不够，中间可能缺K线
+        return None
+
+    return df[(df['date'] >= since) & (df['date'] <= until)].reset_index(drop=True)
+
+
+def is_adjustment_changed(cached, delta):
+    """
+    检查增量数据与缓存是否处于同一复权基准
+
+    delta 的第一根K线应与缓存最后一根K线是同一天，两者收盘价一致说明历史未被改写。
+    """
+    if len(delta) == 0 or delta['date'].iloc[0] != cached['date'].iloc[-1]:
+        return True
+
+    old_close = cached['close'].iloc[-1]
+    new_close = delta['close'].iloc[0]
+    return abs(new_close - old_close) > abs(old_close) * ADJUST_TOLERANCE
+
+
+def sync_kline(code, base_url, until):
+    """
+    把缓存增量同步到 until
+
+    - 无缓存（含上次同步后新上市的股票）：全量拉取
+    - 有缓存：只拉最后一根缓存K线之后的数据并追加
+    - 停牌：没有新K线，只推进 synced_to
+    - 复权变化（重叠K线收盘价不一致）：全量重新拉取
+
+    Returns:
+        同步后的 DataFrame，没有数据返回 None（请求失败时抛出异常，见 fetch_kline_api()）
+    """
+    cached, synced_to = load_kline(code)
+    if cached is not None and len(cached) > 0:
+        last_date = cached['date'].iloc[-1]
+        delta = fetch_kline_delta(code, base_url, last_date, until)
+        if delta is not None and is_adjustment_changed(cached, delta):
+            ADJUSTED_CODES.add(code)
+        elif delta is not None:
+            new_rows = delta[delta['date'] > last_date]
+            df = pd.concat([cached, new_rows], ignore_index=True)
+            save_kline(code, df, until)
+            return df
+
+    df = fetch_kline_api(code, base_url)
+    if df is None:
+        return None
+
+    # 全量接口会带上当天盘中未收盘的K线，只缓存 until 及之前的（已收盘）
+    df = df[df['date'] <= until].reset_index(drop=True)
+    if len(df) == 0:
+        return None
+
+    # 停牌股票最后一根K线早于 until，也记为已同步，避免每次重复拉取
+    save_kline(code, df, until)
+    return df
+
+
+def get_kline(code, base_url, until=None):
+    """
+    获取日K线：缓存已同步到 until 时直接读本地，否则增量同步
+
+    Args:
+        code: 股票代码
+        base_url: API 地址
+        until: 需要覆盖到的日期（YYYY-MM-DD，必须是已收盘的交易日）；
+               为 None 时总是全量请求HTTP
+
+    Returns:
+        DataFrame 或 None（没有数据）
+
+    Raises:
+        requests.RequestException: 请求失败（超时、连接失败、重试用尽后仍是 5xx 或 code != 0）
+    """
+    if until is None:
+        df = fetch_kline_api(code, base_url)
+        # 不知道最后一根K线是否已收盘：只缓存它之前的K线（后面还有K线，必然已收盘）
+        if df is not None and len(df) > 1:
+            save_kline(code, df.iloc[:-1], df['date'].iloc[-2])
+        return df
+
+    df, synced_to = load_kline(code)
+    if df is not None and synced_to >= until:
+        return df
+
+    return sync_kline(code, base_url, until)
+
+
+def get_latest_trade_date(base_url):
+    """获取最近一个已收盘的交易日（YYYY-MM-DD），失败返回 None"""
+    try:
+        info = http_client.get_json(base_url, "/api/workday", params={"count": 1})
+        # 交易日15:00收盘后当日K线才完整
+        if info['is_workday'] and datetime.now().hour >= 15:
+            return info['date']['iso']
+        if info['previous']:
+            return info['previous'][0]['iso']
+        return None
+    except Exception as e:
+        print(f"获取最近交易日失败: {e}")
+        return None
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全市场面板指标引擎
+
+把本地缓存的全市场日K线载入对齐的二维数组 [股票, K线]，一次向量化计算所有股票的
+知行多空线（MA14/28/57/114）、知行短期趋势线（双重EMA10）、KDJ、振幅、
+vol_ma12、amount_ma20，结果与 strategy_b1.calculate_indicators() 逐只计算一致。
+
+对齐方式：每只股票按自己的K线序列右对齐（最后一列是各自最新的一根K线），
+左侧不足部分填 NaN。这样停牌日不会在序列中留下空洞，滚动窗口与逐只计算完全相同；
+每根K线对应的日期保存在同形状的 dates 数组中。
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import kline_cache
+
+# 面板包含的行情字段
+PANEL_FIELDS = kline_cache.PRICE_COLUMNS
+
+# 知行多空线均线周期
+DEFAULT_MA_PERIODS = (14, 28, 57, 114)
+
+
+def build_panel(frames, length=None):
+    """
+    把多只股票的K线 DataFrame 组装成面板
+
+    Args:
+        frames: {code: DataFrame}，列同 kline_cache
+        length: 每只股票保留的最近K线数，默认取最长的一只
+
+    Returns:
+        {'codes': [...], 'dates': 2D str, 'open': 2D float, ...}
+    """
+    codes = list(frames.keys())
+    if length is None:
+        length = max((len(df) for df in frames.values()), default=0)
+
+    panel = {
+        'codes': codes,
+        'dates': np.full((len(codes), length), '', dtype='U10'),
+    }
+    for field in PANEL_FIELDS:
+        panel[field] = np.full((len(codes), length), np.nan)
+
+    for i, code in enumerate(codes):
+        df = frames[code].iloc[-length:] if length else frames[code].iloc[0:0]
+        n = len(df)
+        if n == 0:
+            continue
+        panel['dates'][i, length - n:] = df['date'].to_numpy(dtype=str)
+        for field in PANEL_FIELDS:
+            panel[field][i, length - n:] = df[field].to_numpy(dtype=np.float64)
+
+    return panel
+
+
+def load_panel(codes, length=None):
+    """从本地K线缓存载入面板（没有缓存的股票跳过）"""
+    frames = {}
+    for code in codes:
+        df, _ = kline_cache.load_kline(code)
+        if df is not None and len(df) > 0:
+            frames[code] = df
+    return build_panel(frames, length)
+
+
+def rolling_mean(x, window):
+    """
+    沿最后一维的滚动均值，窗口内有 NaN 时为 NaN（同 pandas rolling(window).mean()）
+
+    用累加和差分计算，与 pandas 的结果只差浮点舍入误差。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < window:
+        return out
+
+    valid = ~np.isnan(x)
+    csum = np.cumsum(np.where(valid, x, 0.0), axis=-1)
+    ccount = np.cumsum(valid, axis=-1)
+
+    pad = np.zeros(x.shape[:-1] + (1,))
+    csum = np.concatenate([pad, csum], axis=-1)
+    ccount = np.concatenate([pad, ccount], axis=-1)
+
+    window_sum = csum[..., window:] - csum[..., :-window]
+    window_count = ccount[..., window:] - ccount[..., :-window]
+    out[..., window - 1:] = np.where(window_count == window, window_sum / window, np.nan)
+    return out
+
+
+def rolling_min(x, window):
+    """沿最后一维的滚动最小值，窗口内有 NaN 时为 NaN"""
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] >= window:
+        out[..., window - 1:] = sliding_window_view(x, window, axis=-1).min(axis=-1)
+    return out
+
+
+def rolling_max(x, window):
+    """沿最后一维的滚动最大值，窗口内有 NaN 时为 NaN"""
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] >= window:
+        out[..., window - 1:] = sliding_window_view(x, window, axis=-1).max(axis=-1)
+    return out
+
+
+def ewm_step(weighted, old_wt, cur, alpha):
+    """
+    指数加权均值（adjust=False）的单步递推，ewm_mean 和增量指标状态共用
+
+    Args:
+        weighted: 上一步的均值（尚无有效值时为 NaN）
+        old_wt: 上一步的权重（初始为 1）
+        cur: 本步的新值
+
+    Returns:
+        (weighted, old_wt)
+    """
+    cur = np.asarray(cur, dtype=np.float64)
+    is_obs = ~np.isnan(cur)
+    started = ~np.isnan(weighted)
+
+    old_wt = np.where(started, old_wt * (1.0 - alpha), old_wt)
+    update = started & is_obs & (weighted != cur)
+    blended = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+    weighted = np.where(update, blended, weighted)
+    old_wt = np.where(started & is_obs, 1.0, old_wt)
+
+    # 首个有效值之前保持 NaN，遇到首个有效值时直接取该值
+    weighted = np.where(~started & is_obs, cur, weighted)
+    return weighted, old_wt
+
+
+def ewm_mean(x, alpha):
+    """
+    沿最后一维的指数加权均值，等价于 pandas ewm(alpha=alpha, adjust=False).mean()
+
+    逐列递推、各股票之间向量化；运算顺序与 pandas 的实现保持一致（包括中间 NaN 的
+    权重衰减和“值不变时跳过更新”），结果逐位相同。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    out = np.full(x.shape, np.nan)
+
+    weighted = np.full(x.shape[:-1], np.nan)
+    old_wt = np.ones(x.shape[:-1])
+    for t in range(x.shape[-1]):
+        weighted, old_wt = ewm_step(weighted, old_wt, x[..., t], alpha)
+        out[..., t] = weighted
+
+    return out
+
+
+def compute_indicators(panel, ma_periods=DEFAULT_MA_PERIODS):
+    """
+    一次计算全市场所有股票的B1指标
+
+    Returns:
+        {指标名: 2D数组}，指标名与 calculate_indicators() 生成的列名相同
+    """
+    close = panel['close']
+    high = panel['high']
+    low = panel['low']
+
+    ind = {}
+
+    # 1. 知行多空线
+    m1, m2, m3, m4 = ma_periods
+    ind['ma_m1'] = rolling_mean(close, m1)
+    ind['ma_m2'] = rolling_mean(close, m2)
+    ind['ma_m3'] = rolling_mean(close, m3)
+    ind['ma_m4'] = rolling_mean(close, m4)
+    ind['zx_dk_line'] = (ind['ma_m1'] + ind['ma_m2'] + ind['ma_m3'] + ind['ma_m4']) / 4
+
+    # 2. 知行短期趋势线: EMA(EMA(C,10),10)，span=10 即 alpha=2/11
+    ind['ema10'] = ewm_mean(close, 2 / 11)
+    ind['zx_trend_line'] = ewm_mean(ind['ema10'], 2 / 11)
+
+    # 3. KDJ，com=2 即 alpha=1/3
+    low_min = rolling_min(low, 9)
+    high_max = rolling_max(high, 9)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ind['rsv'] = (close - low_min) / (high_max - low_min) * 100
+    ind['k'] = ewm_mean(ind['rsv'], 1 / 3)
+    ind['d'] = ewm_mean(ind['k'], 1 / 3)
+    ind['j'] = 3 * ind['k'] - 2 * ind['d']
+
+    # 4. 振幅
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ind['amplitude'] = (high - low) / panel['pre_close'] * 100
+
+    # 5. 成交量均值 (最近12天)
+    ind['vol_ma12'] = rolling_mean(panel['volume'], 12)
+
+    # 6. 成交额均值 (最近20天)
+    ind['amount_ma20'] = rolling_mean(panel['amount'], 20)
+
+    return ind
+
+
+def window_any(flags, days):
+    """最后 days 根K线中是否有任一标记为 True（沿最后一维）"""
+    return np.asarray(flags)[..., -days:].any(axis=-1)
+
+
+def gap_flags(high, low):
+    """
+    逐根K线标记是否相对前一根跳空
+
+    - 向上跳空：low[i] > high[i-1]
+    - 向下跳空：high[i] < low[i-1]
+    第一根K线没有前一根，标记为 False；含 NaN 的比较结果为 False。
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    flags = np.zeros(high.shape, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        flags[..., 1:] = (low[..., 1:] > high[..., :-1]) | (high[..., 1:] < low[..., :-1])
+    return flags
+
+
+def has_gap(high, low, days=40):
+    """过去 days 天（即最后 days+1 根K线之间）是否有跳空缺口"""
+    return window_any(gap_flags(high, low), days)
+
+
+def stagnant_flags(open_, close, volume, ma, vol_ma,
+                   volume_threshold=1.5, up_strength_threshold=0.01):
+    """
+    逐根K线标记是否“高位放量但滞涨”
+
+    同时满足：close > ma、volume > vol_ma × volume_threshold、
+    阴线（close < open）或弱阳线（close > open 且涨幅 < up_strength_threshold）。
+    均线为 NaN 的K线标记为 False。
+    """
+    open_ = np.asarray(open_, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        is_high_price = close > ma
+        is_high_volume = volume > vol_ma * volume_threshold
+        is_stagnant = (close < open_) | ((close > open_) &
+                                         ((close - open_) / open_ < up_strength_threshold))
+    return is_high_price & is_high_volume & is_stagnant
+
+
+def has_top_volume_stagnant(open_, close, volume, days=40, ma_period=20,
+                            volume_threshold=1.5, up_strength_threshold=0.01,
+                            ma=None, vol_ma=None):
+    """
+    过去 days 天是否出现“高位放量但滞涨”
+
+    ma / vol_ma 未传入时按 ma_period 计算；有效K线不足 ma_period+1 根的股票视为没有。
+    """
+    close = np.asarray(close, dtype=np.float64)
+    if ma is None:
+        ma = rolling_mean(close, ma_period)
+    if vol_ma is None:
+        vol_ma = rolling_mean(volume, ma_period)
+
+    flags = stagnant_flags(open_, close, volume, ma, vol_ma,
+                           volume_threshold, up_strength_threshold)
+    enough_bars = (~np.isnan(close)).sum(axis=-1) >= ma_period + 1
+    return window_any(flags, days) & enough_bars
+
+
+# --- 按日期截断（as-of）判断：每根K线只看它自己及之前的数据 ---
+
+def rolling_any(flags, days):
+    """
+    逐根K线判断“截至该K线的最后 days 个标记中是否有 True”（沿最后一维）
+
+    用前缀和一次算出所有K线的结果，第 i 根的值等于 window_any(flags[..., :i+1], days)。
+    """
+    flags = np.asarray(flags, dtype=bool)
+    csum = np.cumsum(flags, axis=-1)
+    lagged = np.zeros(csum.shape, dtype=csum.dtype)
+    lagged[..., days:] = csum[..., :-days]
+    return csum - lagged > 0
+
+
+def has_gap_asof(high, low, days=40):
+    """逐根K线的 has_gap()：截至该K线的过去 days 天是否有跳空缺口"""
+    return rolling_any(gap_flags(high, low), days)
+
+
+def has_top_volume_stagnant_asof(open_, close, volume, days=40, ma_period=20,
+                                 volume_threshold=1.5, up_strength_threshold=0.01,
+                                 ma=None, vol_ma=None):
+    """
+    逐根K线的 has_top_volume_stagnant()：截至该K线的过去 days 天是否出现高位放量滞涨
+
+    MA 是只用过去数据的滚动均值，逐根标记本身没有未来数据；
+    截至该K线的有效K线不足 ma_period+1 根时视为没有。
+    """
+    close = np.asarray(close, dtype=np.float64)
+    if ma is None:
+        ma = rolling_mean(close, ma_period)
+    if vol_ma is None:
+        vol_ma = rolling_mean(volume, ma_period)
+    flags = stagnant_flags(open_, close, volume, ma, vol_ma,
+                           volume_threshold, up_strength_threshold)
+    enough_bars = np.cumsum(~np.isnan(close), axis=-1) >= ma_period + 1
+    return rolling_any(flags, days) & enough_bars
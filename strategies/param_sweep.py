@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+B1 策略参数扫描（基于本地K线缓存面板）
+
+strategy_b1.py 的阈值和均线周期都是模块常量，每试一组参数都要重新扫描一遍全市场。
+这里在本地缓存的全市场面板上一次评估一整组参数：
+1. 股票分成若干批，交给进程池并行处理；每批只载入一次面板
+2. 同一批内，与参数无关的指标（趋势线、KDJ、振幅、量均线等）只算一次，
+   各周期的均线、各回看天数的缺口/滞涨标记按需计算并缓存，所有参数组共用
+3. 每组参数按 backtest_panel.py 的口径回测（每天评分前10名，次日收盘卖出），
+   按夏普比率等指标排序，结果保存到 data/param_sweep.csv
+
+只读本地缓存，扫描前先运行一次 strategy_b1.py 同步K线。
+
+用法：
+    python param_sweep.py                         # 全部历史
+    python param_sweep.py 2025-01-01 2025-06-30   # 指定选股日期范围
+"""
+
+import itertools
+import os
+import sys
+import time
+import numpy as np
+
+import backtest_panel
+import kline_cache
+import panel
+import pipeline
+import scoring
+from strategy_b1 import (M1, M2, M3, M4, J_MAX, AMPLITUDE_MAX, VOLUME_RATIO_MAX, GAP_DAYS,
+                         STAGNANT_DAYS, STAGNANT_VOLUME, STAGNANT_UP)
+
+# 配置
+BASE_URL = "http://localhost:8080"
+CHUNK_SIZE = 200  # 每个任务处理的股票数
+MAX_WORKERS = os.cpu_count() or 4
+TOP_N = 10        # 每天买入评分前N名
+RANK_BY = 'sharpe'
+RESULT_CSV = os.path.join("data", "param_sweep.csv")
+
+# 当前策略使用的参数（strategy_b1.py 中的常量）
+DEFAULT_PARAMS = {
+    'ma_periods': (M1, M2, M3, M4),      # 知行多空线的4条均线周期
+    'j_max': J_MAX,                      # J值上限
+    'amplitude_max': AMPLITUDE_MAX,      # 振幅上限（%）
+    'volume_ratio': VOLUME_RATIO_MAX,    # 成交量 / 12日均量 上限
+    'gap_days': GAP_DAYS,                # 跳空缺口回看天数
+    'stagnant_days': STAGNANT_DAYS,      # 放量滞涨回看天数
+    'stagnant_volume': STAGNANT_VOLUME,  # 放量倍数
+    'stagnant_up': STAGNANT_UP,          # 弱阳线涨幅上限
+}
+
+# 扫描的参数网格（未列出的参数取 DEFAULT_PARAMS）
+PARAM_GRID = {
+    'ma_periods': [(14, 28, 57, 114), (10, 20, 40, 80), (20, 40, 80, 160)],
+    'j_max': [10, 13, 16],
+    'amplitude_max': [3, 4, 5],
+    'volume_ratio': [0.45, 0.52, 0.6],
+}
+
+def expand_grid(grid):
+    """把参数网格展开成参数组列表"""
+    names = list(grid)
+    return [dict(DEFAULT_PARAMS, **dict(zip(names, values)))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+class SharedFeatures:
+    """一批股票的面板特征：与参数无关的只算一次，依赖参数的按参数值缓存"""
+
+    def __init__(self, p):
+        self.p = p
+        self.close = p['close']
+        self.base = panel.compute_indicators(p, DEFAULT_PARAMS['ma_periods'])
+        self.bar_count = np.cumsum(~np.isnan(self.close), axis=-1)
+        # 默认周期的均线已经算好，直接放进缓存
+        self._ma = {w: self.base[f'ma_m{k}'] for k, w in enumerate(DEFAULT_PARAMS['ma_periods'], 1)}
+        self._cache = {}
+
+    def ma(self, window):
+        """收盘价 window 日均线"""
+        if window not in self._ma:
+            self._ma[window] = panel.rolling_mean(self.close, window)
+        return self._ma[window]
+
+    def dk_line(self, ma_periods):
+        """知行多空线 = 4条均线的平均"""
+        key = ('dk_line', tuple(ma_periods))
+        if key not in self._cache:
+            self._cache[key] = sum(self.ma(w) for w in ma_periods) / len(ma_periods)
+        return self._cache[key]
+
+    def has_gap(self, days):
+        key = ('gap', days)
+        if key not in self._cache:
+            if 'gap_flags' not in self._cache:
+                self._cache['gap_flags'] = panel.gap_flags(self.p['high'], self.p['low'])
+            self._cache[key] = panel.rolling_any(self._cache['gap_flags'], days)
+        return self._cache[key]
+
+    def has_stagnant(self, days, volume_threshold, up_threshold):
+        key = ('stagnant', days, volume_threshold, up_threshold)
+        if key not in self._cache:
+            if 'vol_ma20' not in self._cache:
+                self._cache['vol_ma20'] = panel.rolling_mean(self.p['volume'], 20)
+            self._cache[key] = panel.has_top_volume_stagnant_asof(
+                self.p['open'], self.close, self.p['volume'], days=days, ma_period=20,
+                volume_threshold=volume_threshold, up_strength_threshold=up_threshold,
+                ma=self.ma(20), vol_ma=self._cache['vol_ma20'])
+        return self._cache[key]
+
+def select_hits(features, params, start_date=None, end_date=None):
+    """一组参数下的选股信号（截至当日判断），返回 (股票下标数组, K线下标数组)"""
+    p = features.p
+    base = features.base
+    dk_line = features.dk_line(params['ma_periods'])
+
+    with np.errstate(invalid='ignore'):
+        hit = ~(np.isnan(dk_line) | np.isnan(base['zx_trend_line']) | np.isnan(base['j']))
+        hit &= features.close > dk_line
+        hit &= base['j'] < params['j_max']
+        hit &= base['zx_trend_line'] > dk_line
+        hit &= base['amplitude'] < params['amplitude_max']
+        hit &= p['volume'] < base['vol_ma12'] * params['volume_ratio']
+    hit &= ~features.has_gap(params['gap_days'])
+    hit &= ~features.has_stagnant(params['stagnant_days'], params['stagnant_volume'],
+                                  params['stagnant_up'])
+    hit &= features.bar_count >= max(params['ma_periods']) + 5
+    if start_date:
+        hit &= p['dates'] >= start_date
+    if end_date:
+        hit &= p['dates'] <= end_date
+    return np.nonzero(hit)
+
+def sweep_chunk(codes, param_sets, start_date=None, end_date=None):
+    """
+    在一批股票上评估所有参数组（进程池任务）
+
+    Returns:
+        每组参数一个信号列表，信号结构同 backtest_panel.select_signals()，
+        另有 components 为各维度评分（顺序同 scoring.SCORE_COMPONENTS）
+    """
+    p = panel.load_panel(codes)
+    if not p['codes']:
+        return [[] for _ in param_sets]
+
+    features = SharedFeatures(p)
+    close = p['close']
+    dates = p['dates']
+    length = close.shape[1]
+    base = features.base
+
+    results = []
+    for params in param_sets:
+        dk_line = features.dk_line(params['ma_periods'])
+        rows, cols = select_hits(features, params, start_date, end_date)
+        scores = scoring.score_batch(close[rows, cols], dk_line[rows, cols],
+                                     base['zx_trend_line'][rows, cols], base['j'][rows, cols],
+                                     p['volume'][rows, cols], base['vol_ma12'][rows, cols],
+                                     base['amplitude'][rows, cols], base['amount_ma20'][rows, cols])
+        totals = scoring.round_scores(scores['total'])
+        components = np.column_stack([scores[name] for name in scoring.SCORE_COMPONENTS]).tolist()
+
+        signals = []
+        for k, (i, t) in enumerate(zip(rows, cols)):
+            sell_price, sell_date = None, None
+            if t + 1 < length and not np.isnan(close[i, t + 1]):
+                sell_price, sell_date = float(close[i, t + 1]), str(dates[i, t + 1])
+
+            signals.append({
+                'code': p['codes'][i],
+                'date': str(dates[i, t]),
+                'price': float(close[i, t]),
+                'score': totals[k],
+                'components': tuple(components[k]),
+                'sell_price': sell_price,
+                'sell_date': sell_date,
+            })
+        results.append(signals)
+    return results
+
+def evaluate_results(daily_results):
+    """
+    由逐日回测结果计算排序指标
+
+    每天的收益取当天选股的平均收益，按日复利得到净值曲线。
+    """
+    if not daily_results:
+        return {'days': 0, 'trades': 0, 'win_rate': 0.0, 'avg_daily_return': 0.0,
+                'total_return': 0.0, 'max_drawdown': 0.0, 'sharpe': 0.0}
+
+    daily = np.array([r['avg_return'] for r in daily_results]) / 100
+    nav = np.cumprod(1 + daily)
+    drawdown = 1 - nav / np.maximum.accumulate(np.maximum(nav, 1.0))
+    std = daily.std(ddof=1) if len(daily) > 1 else 0.0
+    trades = sum(r['valid_count'] for r in daily_results)
+    wins = sum(r['win_count'] for r in daily_results)
+
+    return {
+        'days': len(daily_results),
+        'trades': trades,
+        'win_rate': wins / trades * 100,
+        'avg_daily_return': float(daily.mean() * 100),
+        'total_return': float((nav[-1] - 1) * 100),
+        'max_drawdown': float(drawdown.max() * 100),
+        'sharpe': float(daily.mean() / std * np.sqrt(252)) if std > 0 else 0.0,
+    }
+
+def collect_signals(codes, param_sets, start_date=None, end_date=None, workers=MAX_WORKERS):
+    """并行计算所有参数组的选股信号，返回每组参数一个信号列表"""
+    chunks = [codes[i:i + CHUNK_SIZE] for i in range(0, len(codes), CHUNK_SIZE)]
+    signals = [[] for _ in param_sets]
+
+    with pipeline.process_pool(workers) as pool:
+        futures = [pool.submit(sweep_chunk, chunk, param_sets, start_date, end_date)
+                   for chunk in chunks]
+        for done, future in enumerate(futures, 1):
+            for k, chunk_signals in enumerate(future.result()):
+                signals[k].extend(chunk_signals)
+            print(f"进度: {done}/{len(chunks)} 批")
+    return signals
+
+def run_sweep(codes, param_sets, start_date=None, end_date=None, workers=MAX_WORKERS):
+    """
+    并行评估所有参数组
+
+    Returns:
+        [(params, metrics)]，按 RANK_BY 降序
+    """
+    signals = collect_signals(codes, param_sets, start_date, end_date, workers)
+    ranked = []
+    for params, param_signals in zip(param_sets, signals):
+        daily_results = backtest_panel.build_daily_results(param_signals, TOP_N)
+        ranked.append((params, evaluate_results(daily_results)))
+    ranked.sort(key=lambda item: item[1][RANK_BY], reverse=True)
+    return ranked
+
+def save_csv(ranked, path=RESULT_CSV):
+    """保存扫描结果（每组参数一行）"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    param_names = list(DEFAULT_PARAMS)
+    metric_names = list(ranked[0][1]) if ranked else []
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(",".join(param_names + metric_names) + "\n")
+        for params, metrics in ranked:
+            values = ['/'.join(map(str, params[n])) if isinstance(params[n], tuple) else str(params[n])
+                      for n in param_names]
+            values += [f"{metrics[n]:.4f}" if isinstance(metrics[n], float) else str(metrics[n])
+                       for n in metric_names]
+            f.write(",".join(values) + "\n")
+
+def format_params(params):
+    """只显示与默认参数不同的项"""
+    diff = {k: v for k, v in params.items() if v != DEFAULT_PARAMS[k]}
+    if not diff:
+        return "(默认参数)"
+    return ", ".join(f"{k}={'/'.join(map(str, v)) if isinstance(v, tuple) else v}" for k, v in diff.items())
+
+def main():
+    start_date = sys.argv[1] if len(sys.argv) > 1 else None
+    end_date = sys.argv[2] if len(sys.argv) > 2 else None
+
+    param_sets = expand_grid(PARAM_GRID)
+
+    print("=" * 70)
+    print("🔬 B1 策略参数扫描（本地K线面板）")
+    print("=" * 70)
+    print(f"选股日期: {start_date or '最早'} ~ {end_date or '最新'}")
+    print(f"参数组数: {len(param_sets)}，进程数: {MAX_WORKERS}，排序指标: {RANK_BY}\n")
+
+    codes = kline_cache.cached_codes()
+    if not codes:
+        print("❌ 本地没有K线缓存，请先运行 strategy_b1.py")
+        return
+    print(f"📦 本地缓存 {len(codes)} 只股票")
+
+    backtest_panel.BASE_URL = BASE_URL
+    backtest_panel.load_stock_names()
+
+    start_time = time.time()
+    ranked = run_sweep(codes, param_sets, start_date, end_date)
+    duration = time.time() - start_time
+
+    print("\n" + "=" * 70)
+    print(f"🎉 扫描完成！耗时: {duration:.2f}秒")
+    print(f"{'排名':<4} {'夏普':>6} {'总收益':>9} {'最大回撤':>8} {'胜率':>7} {'交易':>6}  参数")
+    for rank, (params, m) in enumerate(ranked[:20], 1):
+        print(f"{rank:<4} {m['sharpe']:>6.2f} {m['total_return']:>+8.2f}% {m['max_drawdown']:>7.2f}% "
+              f"{m['win_rate']:>6.1f}% {m['trades']:>6}  {format_params(params)}")
+
+    save_csv(ranked)
+    print(f"\n💾 全部结果已保存: {RESULT_CSV}")
+    print("=" * 70)
+
+if __name__ == "__main__":
+    main()
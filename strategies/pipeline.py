@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+抓取 / 计算分离的流水线
+
+抓取阶段（fetch_engine，I/O 密集）把K线数据交给进程池，
+解析、指标计算和条件判断（CPU 密集，受 GIL 限制）在多个进程中并行执行。
+两个阶段之间的待处理任务数有上限：进程池处理不过来时暂停从抓取队列取数据，
+抓取队列满后抓取也随之放慢，内存占用保持有界。
+
+计算进程不用 fork 启动：进程池创建时抓取线程（asyncio 默认线程池、http_client 连接池）已经在运行，
+fork 会把其他线程持有的锁原样复制到子进程里，子进程可能卡死。forkserver 从一个干净的单线程
+服务进程 fork 出计算进程，子进程重新导入模块，看不到父进程运行时修改的全局变量，
+需要的值（例如最近交易日）要通过参数（functools.partial）传给 analyze_fn。
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import fetch_engine
+
+# 默认计算进程数
+DEFAULT_WORKERS = os.cpu_count() or 1
+# 计算进程的启动方式（没有 forkserver 的平台用 spawn）
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def process_pool(workers=DEFAULT_WORKERS):
+    """创建计算进程池（START_METHOD 启动，任务函数必须能按模块名导入）"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD))
+
+
+async def analyze_stream(codes, fetch_fn, analyze_fn,
+                         max_inflight=fetch_engine.DEFAULT_MAX_INFLIGHT,
+                         workers=DEFAULT_WORKERS, max_pending=None, return_exceptions=False):
+    """
+    抓取并在进程池中分析，按完成顺序产出结果
+
+    Args:
+        codes: 股票代码列表
+        fetch_fn: 抓取函数 fetch_fn(code) -> payload，失败时抛出异常（见 return_exceptions），
+                  没有数据时可以返回 None
+        analyze_fn: 分析函数 analyze_fn(code, payload) -> result，必须是模块级函数（可 pickle），
+                    在子进程中只能看到导入时的全局变量（见模块说明）
+        max_inflight: 同时在途的请求数上限
+        workers: 计算进程数
+        max_pending: 已提交但未完成的分析任务上限，默认 workers * 4
+        return_exceptions: 为 True 时 fetch_fn / analyze_fn 抛出的异常对象作为 result 产出，
+                           调用方可以按异常类型区分失败原因；为 False 时异常被吞掉，result 为 None
+
+    Yields:
+        (code, result)：fetch_fn 或 analyze_fn 抛出异常时 result 为异常对象（return_exceptions=True）
+        或 None；fetch_fn 返回 None 时 result 为 None，不交给 analyze_fn
+    """
+    loop = asyncio.get_running_loop()
+    if max_pending is None:
+        max_pending = workers * 4
+
+    with process_pool(workers) as pool:
+
+        async def run(code, payload):
+            try:
+                return code, await loop.run_in_executor(pool, analyze_fn, code, payload)
+            except Exception as e:
+                return code, e if return_exceptions else None
+
+        pending = set()
+        async for code, payload in fetch_engine.fetch_stream(codes, fetch_fn, max_inflight=max_inflight,
+                                                             return_exceptions=return_exceptions):
+            if payload is None or isinstance(payload, Exception):
+                yield code, payload
+            else:
+                pending.add(asyncio.ensure_future(run(code, payload)))
+
+            # 待处理任务达到上限时阻塞等待（背压），否则只收取已完成的结果
+            if len(pending) >= max_pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                done = {task for task in pending if task.done()}
+                pending -= done
+            for task in done:
+                yield task.result()
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
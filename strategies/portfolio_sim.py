@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+B1 选股组合资金曲线模拟
+
+backtest_results 只记录每天选股的平均收益，不复利、不计费用、也不处理持仓重叠。
+这里在 strategy_results 的选股上模拟一个真实账户：
+- 每个选股日收盘按评分从高到低买入前 TOP_N 只，每只占用权益的 position_pct，按 100 股一手取整；
+  已持有的股票不重复买入，剩余现金买不起某一只时跳过它，继续买后面更便宜的
+- 持有 hold_days 根K线后收盘卖出（停牌日不计，复牌后第一个交易日卖出）
+- 买卖都计佣金（有最低收费）和滑点，卖出另计印花税
+- 每天按收盘价（停牌沿用最近收盘价）计算权益，得到资金曲线、最大回撤、夏普比率和换手率；
+  回撤的高点从初始资金算起（drawdown_curve()），保存的资金曲线和汇总指标用同一口径
+
+价格取本地缓存的前复权收盘价。账户逐日推进（现金依赖前一天的结果），
+每一天内的买卖、估值对所有股票向量化计算，多年的模拟也只需要几秒。
+
+用法：
+    python portfolio_sim.py                         # 全部选股日期
+    python portfolio_sim.py 2025-01-01 2025-06-30   # 指定日期范围
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import kline_cache
+import storage
+
+# 配置
+BASE_URL = "http://localhost:8080"
+DB_FILE = storage.DEFAULT_DB_FILE
+EQUITY_CSV = os.path.join("data", "portfolio_equity.csv")
+
+# 默认模拟参数
+INITIAL_CAPITAL = 1_000_000  # 初始资金（元）
+TOP_N = 10                   # 每天最多买入评分前N名
+HOLD_DAYS = 1                # 持有K线数（1 = 次日收盘卖出）
+COMMISSION_RATE = 0.00025    # 佣金费率（买卖双向）
+MIN_COMMISSION = 5.0         # 单笔最低佣金（元）
+STAMP_DUTY_RATE = 0.0005     # 印花税（仅卖出）
+SLIPPAGE = 0.001             # 滑点（买入价上浮、卖出价下浮的比例）
+LOT_SIZE = 100               # 一手股数
+TRADING_DAYS_PER_YEAR = 252
+
+# 最近一个已收盘的交易日（K线缓存以此判断是否需要重新拉取）
+LATEST_TRADE_DATE = None
+
+def load_selections(start_date=None, end_date=None, strategy_name="b1"):
+    """
+    读取选股结果
+
+    Returns:
+        {date: [code, ...]}：每天按评分降序（同分按代码）排列
+    """
+    sql = "SELECT date, code FROM strategy_results WHERE strategy_name = ?"
+    params = [strategy_name]
+    if start_date:
+        sql += " AND date >= ?"
+        params.append(start_date)
+    if end_date:
+        sql += " AND date <= ?"
+        params.append(end_date)
+    sql += " ORDER BY date, score DESC, code"
+
+    rows = storage.query(DB_FILE, sql, params)
+
+    selections = {}
+    for date, code in rows:
+        selections.setdefault(date, []).append(code)
+    return selections
+
+def build_price_matrix(codes, start_date):
+    """
+    把相关股票的收盘价对齐到统一的交易日历
+
+    Returns:
+        (dates, close)：dates 为交易日数组，close 为 [日期, 股票] 矩阵，该股票当天没有K线时为 NaN
+    """
+    frames = {}
+    for code in codes:
+        try:
+            df = kline_cache.get_kline(code, BASE_URL, until=LATEST_TRADE_DATE)
+        except Exception:
+            df = None
+        if df is not None and len(df) > 0:
+            frames[code] = df[df['date'] >= start_date]
+
+    all_dates = [df['date'].to_numpy(dtype=str) for df in frames.values()]
+    dates = np.unique(np.concatenate(all_dates)) if all_dates else np.array([], dtype=str)
+
+    close = np.full((len(dates), len(codes)), np.nan)
+    for j, code in enumerate(codes):
+        df = frames.get(code)
+        if df is None:
+            continue
+        idx = np.searchsorted(dates, df['date'].to_numpy(dtype=str))
+        close[idx, j] = df['close'].to_numpy(dtype=np.float64)
+    return dates, close
+
+def _forward_fill(close):
+    """停牌日沿用最近收盘价（沿日期方向）"""
+    valid = ~np.isnan(close)
+    last = np.where(valid, np.arange(close.shape[0])[:, None], 0)
+    np.maximum.accumulate(last, axis=0, out=last)
+    filled = close[last, np.arange(close.shape[1])]
+    # 第一根K线之前保持 NaN
+    return np.where(np.cumsum(valid, axis=0) > 0, filled, np.nan)
+
+def _commission(value, rate, minimum):
+    return np.where(value > 0, np.maximum(value * rate, minimum), 0.0)
+
+def simulate(selections, dates, close, codes,
+             initial_capital=INITIAL_CAPITAL, top_n=TOP_N, hold_days=HOLD_DAYS,
+             position_pct=None, commission_rate=COMMISSION_RATE, min_commission=MIN_COMMISSION,
+             stamp_duty_rate=STAMP_DUTY_RATE, slippage=SLIPPAGE, lot_size=LOT_SIZE):
+    """
+    逐日模拟账户
+
+    Args:
+        selections: {date: [code, ...]}，按评分降序
+        dates, close: build_price_matrix() 的结果
+        codes: close 的列对应的股票代码
+        position_pct: 每只股票买入时占用权益的比例，默认 1 / (top_n × hold_days)，满仓时正好用完资金
+
+    Returns:
+        {'dates', 'equity', 'cash', 'drawdown', 'trades': [...], 'metrics': {...}}
+    """
+    if position_pct is None:
+        position_pct = 1.0 / (top_n * hold_days)
+
+    n_days, n_stocks = close.shape
+    col = {code: j for j, code in enumerate(codes)}
+    tradable = ~np.isnan(close)
+    bar_no = np.cumsum(tradable, axis=0)   # 每只股票截至当日的K线序号
+    mark = _forward_fill(close)
+
+    cash = float(initial_capital)
+    shares = np.zeros(n_stocks)
+    cost_basis = np.zeros(n_stocks)         # 买入总成本（含费用）
+    exit_bar = np.zeros(n_stocks)           # 到达该K线序号时卖出
+    entry_date = np.full(n_stocks, '', dtype=object)
+
+    equity_curve = np.zeros(n_days)
+    cash_curve = np.zeros(n_days)
+    traded_value = 0.0
+    total_fees = 0.0
+    trades = []
+
+    for t in range(n_days):
+        price = close[t]
+
+        # 1. 卖出到期持仓（当天有K线才能卖）
+        sell = (shares > 0) & tradable[t] & (bar_no[t] >= exit_bar)
+        if sell.any():
+            exec_price = price[sell] * (1 - slippage)
+            value = shares[sell] * exec_price
+            fees = _commission(value, commission_rate, min_commission) + value * stamp_duty_rate
+            proceeds = value - fees
+            cash += proceeds.sum()
+            traded_value += value.sum()
+            total_fees += fees.sum()
+            for j, p, pnl_value in zip(np.nonzero(sell)[0], exec_price, proceeds - cost_basis[sell]):
+                trades.append({
+                    'code': codes[j],
+                    'entry_date': entry_date[j],
+                    'exit_date': dates[t],
+                    'exit_price': float(p),
+                    'pnl': float(pnl_value),
+                    'return_pct': float(pnl_value / cost_basis[j] * 100),
+                })
+            shares[sell] = 0
+            cost_basis[sell] = 0
+
+        # 2. 买入当天的选股（权益按卖出后的现金 + 持仓市值计算）
+        picks = [col[code] for code in selections.get(dates[t], []) if code in col][:top_n]
+        picks = np.array([j for j in picks if shares[j] == 0 and tradable[t, j]], dtype=int)
+        if len(picks) > 0:
+            equity = cash + np.nansum(shares * mark[t])
+            exec_price = price[picks] * (1 + slippage)
+            budget = min(equity * position_pct, equity)
+            lots = np.floor(budget / (exec_price * lot_size))
+            value = lots * lot_size * exec_price
+            fees = _commission(value, commission_rate, min_commission)
+            # 按评分顺序用剩余现金买入，买不起的跳过（后面的可能更便宜）
+            buy = np.zeros(len(picks), dtype=bool)
+            remaining = cash
+            for k in np.nonzero(lots > 0)[0]:
+                if value[k] + fees[k] <= remaining:
+                    buy[k] = True
+                    remaining -= value[k] + fees[k]
+            if buy.any():
+                j = picks[buy]
+                shares[j] = lots[buy] * lot_size
+                cost_basis[j] = value[buy] + fees[buy]
+                exit_bar[j] = bar_no[t, j] + hold_days
+                entry_date[j] = dates[t]
+                cash -= (value[buy] + fees[buy]).sum()
+                traded_value += value[buy].sum()
+                total_fees += fees[buy].sum()
+
+        # 3. 收盘估值
+        cash_curve[t] = cash
+        equity_curve[t] = cash + np.nansum(shares * mark[t])
+
+    metrics = compute_metrics(equity_curve, traded_value, total_fees, trades, initial_capital)
+    return {
+        'dates': dates,
+        'equity': equity_curve,
+        'cash': cash_curve,
+        'drawdown': drawdown_curve(equity_curve, initial_capital),
+        'trades': trades,
+        'metrics': metrics,
+    }
+
+def drawdown_curve(equity, initial_capital):
+    """逐日回撤（比例）：相对截至当日的最高权益，初始资金也算一个高点"""
+    peak = np.maximum.accumulate(np.maximum(equity, initial_capital))
+    return 1 - equity / peak
+
+def compute_metrics(equity, traded_value, total_fees, trades, initial_capital,
+                    risk_free_rate=0.0):
+    """由资金曲线计算收益、最大回撤、夏普比率、换手率等指标"""
+    if len(equity) == 0:
+        return {}
+
+    daily_returns = np.diff(equity, prepend=initial_capital) / np.concatenate([[initial_capital], equity[:-1]])
+    drawdown = drawdown_curve(equity, initial_capital)
+
+    excess = daily_returns - risk_free_rate / TRADING_DAYS_PER_YEAR
+    std = excess.std(ddof=1) if len(excess) > 1 else 0.0
+    sharpe = excess.mean() / std * np.sqrt(TRADING_DAYS_PER_YEAR) if std > 0 else 0.0
+
+    years = len(equity) / TRADING_DAYS_PER_YEAR
+    total_return = equity[-1] / initial_capital - 1
+    # 换手率：单边成交额（买卖合计的一半）/ 平均权益
+    turnover = traded_value / 2 / equity.mean()
+    win_trades = sum(1 for trade in trades if trade['pnl'] > 0)
+
+    return {
+        'final_equity': float(equity[-1]),
+        'total_return': float(total_return * 100),
+        'annual_return': float(((1 + total_return) ** (1 / years) - 1) * 100) if years > 0 and total_return > -1 else 0.0,
+        'max_drawdown': float(drawdown.max() * 100),
+        'sharpe': float(sharpe),
+        'turnover': float(turnover),
+        'annual_turnover': float(turnover / years) if years > 0 else 0.0,
+        'total_fees': float(total_fees),
+        'trade_count': len(trades),
+        'win_rate': float(win_trades / len(trades) * 100) if trades else 0.0,
+    }
+
+def run(start_date=None, end_date=None, **params):
+    """读取选股和K线并模拟，返回 simulate() 的结果（没有选股时返回 None）"""
+    selections = load_selections(start_date, end_date)
+    if not selections:
+        return None
+
+    codes = sorted({code for picks in selections.values() for code in picks})
+    dates, close = build_price_matrix(codes, min(selections))
+    return simulate(selections, dates, close, codes, **params)
+
+def save_equity_csv(result, path=EQUITY_CSV):
+    """保存资金曲线"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("date,equity,cash,drawdown\n")
+        for date, equity, cash, drawdown in zip(result['dates'], result['equity'], result['cash'],
+                                                result['drawdown']):
+            f.write(f"{date},{equity:.2f},{cash:.2f},{drawdown * 100:.4f}\n")
+
+def main():
+    global LATEST_TRADE_DATE
+    start_date = sys.argv[1] if len(sys.argv) > 1 else None
+    end_date = sys.argv[2] if len(sys.argv) > 2 else None
+
+    print("=" * 70)
+    print("💼 B1 选股组合资金曲线模拟")
+    print("=" * 70)
+    print(f"初始资金: {INITIAL_CAPITAL:,.0f}  每天买入前{TOP_N}名  持有{HOLD_DAYS}天")
+    print(f"佣金: {COMMISSION_RATE*10000:.1f}‱ (最低{MIN_COMMISSION:.0f}元)  "
+          f"印花税: {STAMP_DUTY_RATE*10000:.1f}‱  滑点: {SLIPPAGE*100:.2f}%")
+
+    LATEST_TRADE_DATE = kline_cache.get_latest_trade_date(BASE_URL)
+
+    start_time = time.time()
+    result = run(start_date, end_date)
+    if result is None:
+        print("❌ 没有选股数据")
+        return
+
+    m = result['metrics']
+    print(f"\n📅 模拟区间: {result['dates'][0]} ~ {result['dates'][-1]} ({len(result['dates'])} 个交易日)")
+    print(f"💰 期末权益: {m['final_equity']:,.2f}")
+    print(f"📈 总收益率: {m['total_return']:+.2f}%  年化: {m['annual_return']:+.2f}%")
+    print(f"📉 最大回撤: {m['max_drawdown']:.2f}%")
+    print(f"📊 夏普比率: {m['sharpe']:.2f}")
+    print(f"🔄 换手率: {m['turnover']:.1f} 倍（年化 {m['annual_turnover']:.1f} 倍）")
+    print(f"💸 交易费用: {m['total_fees']:,.2f}")
+    print(f"🎲 交易笔数: {m['trade_count']}  胜率: {m['win_rate']:.1f}%")
+
+    save_equity_csv(result)
+    print(f"\n💾 资金曲线已保存: {EQUITY_CSV}（耗时 {time.time() - start_time:.2f}秒）")
+    print("=" * 70)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回测用的收盘价查询层
+
+回测对每个 (股票, 选股日) 都要取一次次日收盘价，同一只股票在最近几天被重复选中时，
+以前每次都要重新取整段日K线并转成 DataFrame。这里每次运行内每只股票只取一次K线，
+建好 日期 → (收盘价, 下一交易日) 的索引，之后的查询都是字典查找。
+
+多只股票的查询可以一次提交：先去重，再用 fetch_engine 并发取回所有缺少的股票。
+行情服务没有批量K线接口，“批量”指的是一次并发取回，而不是一个 HTTP 请求。
+"""
+
+import asyncio
+
+import fetch_engine
+import kline_cache
+
+# 批量预取时同时在途的请求数
+PREFETCH_INFLIGHT = 20
+
+
+class PriceLookup:
+    """一次运行内共享的收盘价查询：每只股票只取一次K线"""
+
+    def __init__(self, base_url, until=None):
+        self.base_url = base_url
+        self.until = until
+        self._maps = {}  # {code: {date: (close, next_date)}}，取K线失败时为 None
+
+    def _fetch(self, code):
+        df = kline_cache.get_kline(code, self.base_url, until=self.until)
+        if df is None or len(df) == 0:
+            return None
+
+        dates = df['date'].tolist()
+        closes = df['close'].tolist()
+        next_dates = dates[1:] + [None]
+        return {date: (float(close), next_date)
+                for date, close, next_date in zip(dates, closes, next_dates)}
+
+    def _price_map(self, code):
+        if code not in self._maps:
+            try:
+                self._maps[code] = self._fetch(code)
+            except Exception:
+                self._maps[code] = None
+        return self._maps[code]
+
+    def prefetch(self, codes):
+        """并发取回尚未加载的股票"""
+        missing = [code for code in dict.fromkeys(codes) if code not in self._maps]
+        if not missing:
+            return
+
+        async def run():
+            async for code, price_map in fetch_engine.fetch_stream(
+                    missing, self._fetch, max_inflight=min(PREFETCH_INFLIGHT, len(missing))):
+                self._maps[code] = price_map
+
+        asyncio.run(run())
+
+    def close_on(self, code, date):
+        """指定日期的收盘价，没有该日K线时返回 None"""
+        price_map = self._price_map(code)
+        if not price_map or date not in price_map:
+            return None
+        return price_map[date][0]
+
+    def next_close(self, code, date):
+        """
+        指定日期的下一个交易日收盘价（自动跳过周末和节假日）
+
+        Returns:
+            (price, next_date) 或 None
+        """
+        price_map = self._price_map(code)
+        if not price_map or date not in price_map:
+            return None
+        next_date = price_map[date][1]
+        if next_date is None:
+            return None
+        return price_map[next_date][0], next_date
+
+    def next_closes(self, pairs):
+        """
+        批量查询次日收盘价
+
+        Args:
+            pairs: [(code, date)]
+
+        Returns:
+            {(code, date): (price, next_date) 或 None}
+        """
+        pairs = list(pairs)
+        self.prefetch(code for code, _ in pairs)
+        return {(code, date): self.next_close(code, date) for code, date in pairs}
+
+
+_LOOKUPS = {}
+
+
+def get_lookup(base_url, until=None):
+    """取得本进程内 (base_url, until) 对应的共享查询对象"""
+    key = (base_url, until)
+    if key not in _LOOKUPS:
+        _LOOKUPS[key] = PriceLookup(base_url, until)
+    return _LOOKUPS[key]
@@ -4,81 +4,31 @@
 只运行回测部分，不重新执行选股
 """
 
-import sqlite3
-import requests
-import pandas as pd
 from datetime import datetime, timedelta
 
+import kline_cache
+import price_lookup
+import storage
+
 # 配置
 BASE_URL = "http://localhost:8080"
-DB_FILE = "stocks.db"
+DB_FILE = storage.DEFAULT_DB_FILE
+
+# 最近一个已收盘的交易日（K线缓存以此判断是否需要重新拉取）
+LATEST_TRADE_DATE = None
 
 def init_backtest_table():
     """初始化回测结果表"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS backtest_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                strategy_name TEXT NOT NULL,
-                date TEXT NOT NULL,
-                stock_count INTEGER,
-                valid_count INTEGER,
-                win_count INTEGER,
-                lose_count INTEGER,
-                win_rate REAL,
-                total_return REAL,
-                avg_return REAL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(strategy_name, date)
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        storage.ensure_backtest_results(DB_FILE)
         print("✅ 回测结果表初始化完成")
     except Exception as e:
         print(f"初始化回测表失败: {e}")
 
 def get_next_day_price_simple(code, current_date):
     """获取股票次日收盘价（自动跳过周末）"""
-    try:
-        # 获取K线数据
-        response = requests.get(f"{BASE_URL}/api/kline", params={
-            "code": code,
-            "type": "day"
-        }, timeout=10)
-
-        if response.status_code != 200:
-            return None
-
-        data = response.json()
-        if data['code'] != 0 or not data['data']:
-            return None
-
-        kline_list = data['data']['List']
-        if not kline_list:
-            return None
-
-        # 转换为DataFrame
-        df = pd.DataFrame(kline_list)
-        df['date'] = pd.to_datetime(df['Time']).dt.strftime('%Y-%m-%d')
-
-        # 找到当前日期的索引
-        current_idx = df[df['date'] == current_date].index
-        if len(current_idx) == 0:
-            return None
-
-        current_idx = current_idx[0]
-
-        # 获取下一个交易日的收盘价
-        if current_idx + 1 < len(df):
-            next_day = df.iloc[current_idx + 1]
-            return float(next_day['Close'])
-
-        return None
-    except Exception:
-        return None
+    result = price_lookup.get_lookup(BASE_URL, LATEST_TRADE_DATE).next_close(code, current_date)
+    return result[0] if result else None
 
 def get_next_day_price_with_date(code, current_date):
     """
@@ -87,49 +37,16 @@ def get_next_day_price_with_date(code, current_date):
     Returns:
         (price, date) 或 None
     """
-    try:
-        # 获取K线数据
-        response = requests.get(f"{BASE_URL}/api/kline", params={
-            "code": code,
-            "type": "day"
-        }, timeout=10)
-
-        if response.status_code != 200:
-            return None
-
-        data = response.json()
-        if data['code'] != 0 or not data['data']:
-            return None
-
-        kline_list = data['data']['List']
-        if not kline_list:
-            return None
-
-        # 转换为DataFrame
-        df = pd.DataFrame(kline_list)
-        df['date'] = pd.to_datetime(df['Time']).dt.strftime('%Y-%m-%d')
-
-        # 找到当前日期的索引
-        current_idx = df[df['date'] == current_date].index
-        if len(current_idx) == 0:
-            return None
-
-        current_idx = current_idx[0]
-
-        # 获取下一个交易日的收盘价和日期
-        if current_idx + 1 < len(df):
-            next_day = df.iloc[current_idx + 1]
-            return (float(next_day['Close']), next_day['date'])
-
-        return None
-    except Exception:
-        return None
+    return price_lookup.get_lookup(BASE_URL, LATEST_TRADE_DATE).next_close(code, current_date)
 
 def calculate_daily_pnl_simple(stocks, date):
     """简化版：计算某天选股组合次日的盈亏"""
     if not stocks:
         return None
 
+    # 一次并发取回组合内所有股票的K线（同一次运行内每只股票只取一次）
+    price_lookup.get_lookup(BASE_URL, LATEST_TRADE_DATE).prefetch(stock['code'] for stock in stocks)
+
     total_return = 0
     valid_count = 0
     win_count = 0
@@ -186,11 +103,15 @@ def calculate_daily_pnl_with_sell_date(stocks, select_date):
             'sell_date': '2025-11-29',    # 卖出日期（次日）
             'date': '2025-11-29',         # 用于保存到数据库的日期（等于sell_date）
             ...
+            'trades': [...]               # 逐笔交易，写入 backtest_trades
         }
     """
     if not stocks:
         return None
 
+    # 一次并发取回组合内所有股票的K线（同一次运行内每只股票只取一次）
+    price_lookup.get_lookup(BASE_URL, LATEST_TRADE_DATE).prefetch(stock['code'] for stock in stocks)
+
     total_return = 0
     valid_count = 0
     win_count = 0
@@ -198,6 +119,7 @@ def calculate_daily_pnl_with_sell_date(stocks, select_date):
     actual_sell_date = None
     win_stocks = []
     lose_stocks = []
+    trades = []
 
     for stock in stocks:
         code = stock['code']
@@ -218,6 +140,15 @@ def calculate_daily_pnl_with_sell_date(stocks, select_date):
         pnl = (next_price - buy_price) / buy_price * 100
         total_return += pnl
         valid_count += 1
+        trades.append({
+            'select_date': select_date,
+            'code': code,
+            'name': name,
+            'sell_date': sell_date,
+            'entry_price': buy_price,
+            'exit_price': next_price,
+            'pnl': pnl
+        })
 
         if pnl > 0:
             win_count += 1
@@ -252,7 +183,8 @@ def calculate_daily_pnl_with_sell_date(stocks, select_date):
         'avg_return': avg_return,
         'win_rate': win_rate,
         'win_stocks': win_stocks,
-        'lose_stocks': lose_stocks
+        'lose_stocks': lose_stocks,
+        'trades': trades
     }
 
 def save_backtest_result_simple(result, strategy_name="b1"):
@@ -261,37 +193,8 @@ def save_backtest_result_simple(result, strategy_name="b1"):
         return
 
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-
-        # 构建详细信息JSON
-        import json
-        details = {
-            'win_stocks': result.get('win_stocks', []),
-            'lose_stocks': result.get('lose_stocks', [])
-        }
-        details_json = json.dumps(details, ensure_ascii=False)
-
-        c.execute('''
-            INSERT OR REPLACE INTO backtest_results
-            (strategy_name, date, stock_count, valid_count, win_count, lose_count,
-             win_rate, total_return, avg_return, details)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            strategy_name,
-            result['date'],
-            result['stock_count'],
-            result['valid_count'],
-            result['win_count'],
-            result['lose_count'],
-            result['win_rate'],
-            result['total_return'],
-            result['avg_return'],
-            details_json
-        ))
-
-        conn.commit()
-        conn.close()
+        # 当日汇总和逐笔交易（result['trades']）一起写入
+        storage.save_backtest_results(DB_FILE, [result], strategy_name)
         print(f"✅ 回测结果已保存: {result['date']} 收益{result['avg_return']:+.2f}%")
     except Exception as e:
         print(f"保存回测结果失败: {e}")
@@ -304,6 +207,7 @@ def run_backtest():
 
     例如：11-28选股 → 11-29收盘卖出，结果保存为date=11-29
     """
+    global LATEST_TRADE_DATE
     print("="*70)
     print("🔄 开始计算回测收益...")
     print("="*70)
@@ -311,21 +215,19 @@ def run_backtest():
     # 初始化回测表
     init_backtest_table()
 
+    LATEST_TRADE_DATE = kline_cache.get_latest_trade_date(BASE_URL)
+
     # 获取前几天的日期
     today = datetime.now()
 
     # 获取所有有选股数据的日期
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
+    stock_dates = [row[0] for row in storage.query(DB_FILE, """
         SELECT DISTINCT date
         FROM strategy_results
         WHERE strategy_name = 'b1'
         ORDER BY date DESC
         LIMIT 10
-    """)
-    stock_dates = [row[0] for row in c.fetchall()]
-    conn.close()
+    """)]
 
     print(f"📅 发现选股日期: {stock_dates}")
 
@@ -334,36 +236,11 @@ def run_backtest():
         print(f"\n📅 回测: {select_date} 选股")
 
         # 获取该日期评分前10的股票
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("""
-            SELECT code, name, price, score, j_val, amplitude, vol_ratio, score_detail
-            FROM strategy_results
-            WHERE strategy_name = 'b1' AND date = ?
-            ORDER BY score DESC
-            LIMIT 10
-        """, (select_date,))
-
-        rows = c.fetchall()
-        conn.close()
-
-        if not rows:
+        top_stocks = storage.top_selections(DB_FILE, select_date, 10)
+        if not top_stocks:
             print(f"  ⚠️  无选股数据，跳过")
             continue
 
-        top_stocks = []
-        for row in rows:
-            top_stocks.append({
-                'code': row[0],
-                'name': row[1],
-                'price': row[2],
-                'score': row[3],
-                'j_val': row[4],
-                'amplitude': row[5],
-                'vol_ratio': row[6],
-                'score_detail': row[7]
-            })
-
         print(f"  ✅ 找到 {len(top_stocks)} 只股票")
 
         # 计算次日收益
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全市场扫描的断点续跑
+
+定时任务中途退出（网关抖动、OOM 被杀）后，下一次运行原来要从头扫描全市场。
+扫描时每处理完一只股票就往断点文件追加一行（JSON Lines）：
+- {"code": ..., "status": "done", "result": 命中结果或 null, "trace": 条件判断 trace 或 null}
+- {"code": ..., "status": "failed", "error": 异常描述}
+- {"status": "complete"}：整次运行（含失败重试）正常结束、命中全部写库后追加，见 complete()
+
+断点文件按 数据日期 + 参数哈希 命名（data/scan_checkpoint/<日期>_<哈希>.jsonl），
+同一交易日、同一组策略参数的再次运行读取它：已完成的股票直接沿用结果，
+只扫描剩下的和上次失败的股票；参数变了哈希随之改变，不会沿用旧结果。
+只有未完成的断点才续跑：已标记完成的断点说明上次运行已经正常结束，再次运行时清空重新扫描全市场
+（否则第二次运行只会重扫上次失败的那几只）。
+进程被杀时最后一行可能只写了一半，读取时跳过无法解析的行。
+"""
+
+import hashlib
+import json
+import os
+
+CHECKPOINT_DIR = os.path.join("data", "scan_checkpoint")
+
+
+def params_hash(params):
+    """策略参数的哈希（参数需可 JSON 序列化，其余按 repr）"""
+    text = json.dumps(params, sort_keys=True, ensure_ascii=False, default=repr)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+class ScanCheckpoint:
+    """一次扫描的断点文件：读取已有进度，之后逐只追加"""
+
+    def __init__(self, run_date, params, directory=CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f"{run_date}_{params_hash(params)}.jsonl")
+        self.done = {}       # {code: (result, trace)}，已完成的股票
+        self.failed = set()  # 最近一次处理失败、尚未完成的股票
+
+        os.makedirs(directory, exist_ok=True)
+        # 其他日期或其他参数的断点已经用不上
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".jsonl") and path != self.path:
+                os.remove(path)
+
+        if self._load():
+            # 上次运行已正常结束，不再沿用，清空后重新扫描
+            self.done = {}
+            self.failed = set()
+            self._file = open(self.path, 'w', encoding='utf-8')
+        else:
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        """读取已有进度，返回断点是否已标记完成"""
+        complete = False
+        if not os.path.exists(self.path):
+            return complete
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry['status'] == 'complete':
+                    complete = True
+                    continue
+                code = entry['code']
+                if entry['status'] == 'done':
+                    self.done[code] = (entry.get('result'), entry.get('trace'))
+                    self.failed.discard(code)
+                elif code not in self.done:
+                    self.failed.add(code)
+        return complete
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def pending(self, codes):
+        """codes 中尚未完成的股票（含上次失败的），保持原顺序"""
+        return [code for code in codes if code not in self.done]
+
+    def record_done(self, code, result=None, trace=None):
+        """记录一只已处理完的股票（result 为 None 表示未命中或被跳过）"""
+        self.done[code] = (result, trace)
+        self.failed.discard(code)
+        self._append({'code': code, 'status': 'done', 'result': result, 'trace': trace})
+
+    def record_failed(self, code, error):
+        """记录一只处理失败的股票，再次运行时会重新扫描"""
+        self.failed.add(code)
+        self._append({'code': code, 'status': 'failed', 'error': repr(error)})
+
+    def complete(self):
+        """标记本次运行正常结束：同一交易日再次运行时不再续跑，而是重新扫描"""
+        self._append({'status': 'complete'})
+
+    def close(self):
+        self._file.close()
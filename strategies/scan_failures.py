@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全市场扫描的失败分类
+
+以前取K线和分析时的异常一律变成 None：超时、网关 5xx、返回内容格式不对、
+历史K线不足全都无法区分，偶发的网络问题也从不重试，网关抖一分钟，当天筛选的股票池就悄悄变小。
+这里把每只股票的结果归入以下类别，并按类别计数（FailureLedger，每次运行一份）：
+
+- 跳过（不算失败，不重试）：无数据（接口正常返回、K线列表为空）、历史不足
+- 可重试：超时、连接失败、HTTP 5xx、网关错误、返回格式错误、其他异常 —— 扫描结束后以较低并发统一重试
+  （网关错误：Go 服务端把上游数据源的错误以 HTTP 200 + code != 0 返回，见 http_client.APIError，
+  它是最常见的偶发失败，不能当成“无数据”跳过）
+- 计算出错：同一份数据重算结果相同，本次运行不重试（断点里记为失败，下次运行会重新扫描）
+"""
+
+import json
+import os
+
+import requests
+
+import http_client
+
+TIMEOUT = 'timeout'
+CONNECTION = 'connection'
+HTTP_5XX = 'http_5xx'
+GATEWAY = 'gateway'
+MALFORMED = 'malformed'
+NO_DATA = 'no_data'
+SHORT_HISTORY = 'short_history'
+ANALYSIS = 'analysis'
+OTHER = 'other'
+
+CATEGORY_LABELS = {
+    TIMEOUT: '超时',
+    CONNECTION: '连接失败',
+    HTTP_5XX: 'HTTP 5xx',
+    GATEWAY: '网关错误',
+    MALFORMED: '返回格式错误',
+    OTHER: '其他异常',
+    ANALYSIS: '计算出错',
+    NO_DATA: '无数据',
+    SHORT_HISTORY: '历史不足',
+}
+
+# 不算失败的类别
+SKIP_CATEGORIES = {NO_DATA, SHORT_HISTORY}
+# 扫描结束后重试的类别
+RETRY_CATEGORIES = {TIMEOUT, CONNECTION, HTTP_5XX, GATEWAY, MALFORMED, OTHER}
+
+
+class ScanFailure(Exception):
+    """带类别的扫描失败（取数据阶段抛出）"""
+
+    def __init__(self, category, detail=''):
+        super().__init__(category, detail)
+        self.category = category
+        self.detail = detail
+
+    def __str__(self):
+        return f"{CATEGORY_LABELS.get(self.category, self.category)}: {self.detail}" if self.detail \
+            else CATEGORY_LABELS.get(self.category, self.category)
+
+
+def classify(exc):
+    """取数据阶段的异常归类"""
+    if isinstance(exc, ScanFailure):
+        return exc.category
+    if isinstance(exc, http_client.APIError):
+        return GATEWAY
+    if isinstance(exc, requests.Timeout):
+        return TIMEOUT
+    if isinstance(exc, requests.ConnectionError):
+        return CONNECTION
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else 0
+        return HTTP_5XX if status >= 500 else OTHER
+    if isinstance(exc, (ValueError, KeyError, TypeError, IndexError)):
+        return MALFORMED
+    return OTHER
+
+
+class FailureLedger:
+    """一次运行的失败台账：各类别出现次数、仍未解决的股票、重试恢复的股票数"""
+
+    def __init__(self):
+        self.counts = {}      # {类别: 出现次数}（同一只股票重试失败会重复计数）
+        self.unresolved = {}  # {code: 最近一次失败的类别}
+        self.errors = {}      # {code: 最近一次失败的异常描述}
+        self.recovered = 0    # 失败后重试成功的股票数
+
+    def record(self, code, category, error=None):
+        """记录一次失败或跳过"""
+        self.counts[category] = self.counts.get(category, 0) + 1
+        if category in SKIP_CATEGORIES:
+            self.resolve(code)
+            return
+        self.unresolved[code] = category
+        if error is not None:
+            self.errors[code] = str(error)
+
+    def resolve(self, code):
+        """某只股票本次处理完成（重试成功时计入恢复数）"""
+        if self.unresolved.pop(code, None) is not None:
+            self.errors.pop(code, None)
+            self.recovered += 1
+
+    def retry_codes(self):
+        """需要重试的股票"""
+        return [code for code, category in self.unresolved.items() if category in RETRY_CATEGORIES]
+
+    def failed_codes(self):
+        """仍然失败的股票"""
+        return list(self.unresolved)
+
+    def format_report(self):
+        """各类别计数报告"""
+        still = {}
+        for category in self.unresolved.values():
+            still[category] = still.get(category, 0) + 1
+        lines = [f"{'类别':<12} {'次数':>6} {'仍失败':>6}"]
+        for category, label in CATEGORY_LABELS.items():
+            if category not in self.counts:
+                continue
+            remaining = '-' if category in SKIP_CATEGORIES else still.get(category, 0)
+            lines.append(f"{label:<12} {self.counts[category]:>6} {remaining:>6}")
+        lines.append(f"重试恢复: {self.recovered} 只")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            'counts': self.counts,
+            'recovered': self.recovered,
+            'unresolved': {code: {'category': category, 'error': self.errors.get(code, '')}
+                           for code, category in self.unresolved.items()},
+        }
+
+
+def save_ledger(path, ledger, **extra):
+    """保存本次运行的台账（覆盖上一次）"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dict(extra, **ledger.to_dict()), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+B1 选股评分（100分制）
+
+评分维度：
+1. 超卖程度 (28分) - J值越低，分数越高
+2. 趋势强度 (24分) - 价格偏离多空线越多，趋势越强
+3. 缩量程度 (18分) - 量比越小，缩量越明显
+4. 短期动能 (15分) - 短期趋势线相对多空线偏离度
+5. 振幅收敛 (10分) - 振幅越小，变盘概率越大
+6. 流动性 (5分) - 成交额越高，流动性越好
+
+各维度的分档边界和分数统一写在 SCORE_TIERS 表里。
+score_batch() 对整批候选（或回放历史时的全部股票-交易日）一次查表，
+calculate_score() 对单只股票查同一张表，两者结果完全一致。
+"""
+
+import math
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+SCORE_COMPONENTS = ('oversold', 'trend', 'volume', 'momentum', 'amplitude', 'liquidity')
+
+# 分档表
+# - input: 该维度使用的输入（见 score_inputs()）
+# - bins: 各档边界（升序），points: 各档分数，比 bins 多一个
+# - closed='right': 等于边界时归入低一档（x <= 边界），'left': 归入高一档（x >= 边界）
+# - 分数为 ('linear', 起点分, 终点分) 时，在该档两端边界之间按输入线性插值
+# - 输入为 NaN 时按原判断逻辑落入“其余情况”：closed='right' 为最后一档，'left' 为第一档
+SCORE_TIERS = {
+    'oversold': {
+        'label': '超卖', 'input': 'j', 'closed': 'right',
+        'bins': (0, 13),
+        'points': (28, ('linear', 28, 17), 0),
+    },
+    'trend': {
+        'label': '趋势', 'input': 'trend_deviation', 'closed': 'left',
+        'bins': (0, 1, 3, 5, 7, 10),
+        'points': (0, 7, 11, 14, 17, 21, 24),
+    },
+    'volume': {
+        'label': '缩量', 'input': 'vol_ratio', 'closed': 'right',
+        'bins': (0.3, 0.4, 0.52),
+        'points': (18, 16, 13, 0),
+    },
+    'momentum': {
+        # 第一个边界是最小的正数，即 “> 0”
+        'label': '动能', 'input': 'trend_strength', 'closed': 'left',
+        'bins': (math.ulp(0.0), 1, 3, 5),
+        'points': (0, 6, 9, 12, 15),
+    },
+    'amplitude': {
+        'label': '振幅', 'input': 'amplitude', 'closed': 'right',
+        'bins': (1, 2, 3, 4),
+        'points': (10, 8, 6, 4, 0),
+    },
+    'liquidity': {
+        # 成交额单位：元，1000万 / 5000万 / 1亿 / 2亿 / 5亿
+        'label': '流动性', 'input': 'amount_ma20', 'closed': 'left',
+        'bins': (10000000, 50000000, 100000000, 200000000, 500000000),
+        'points': (0, 1, 2, 3, 4, 5),
+    },
+}
+
+# --- 单只股票 ---
+
+def score_inputs(curr):
+    """由当日指标计算各维度的输入"""
+    return {
+        'j': curr['j'],
+        # 价格相对多空线的偏离度
+        'trend_deviation': (curr['close'] - curr['zx_dk_line']) / curr['zx_dk_line'] * 100,
+        'vol_ratio': curr['volume'] / curr['vol_ma12'] if curr['vol_ma12'] > 0 else 1,
+        # 短期趋势线相对多空线的偏离度
+        'trend_strength': (curr['zx_trend_line'] - curr['zx_dk_line']) / curr['zx_dk_line'] * 100,
+        'amplitude': curr['amplitude'],
+        'amount_ma20': curr['amount_ma20'],
+    }
+
+def _tier(spec, x):
+    if x != x:  # NaN
+        return len(spec['bins']) if spec['closed'] == 'right' else 0
+    if spec['closed'] == 'right':
+        return bisect_left(spec['bins'], x)
+    return bisect_right(spec['bins'], x)
+
+def _linear(spec, k, x):
+    _, start, end = spec['points'][k]
+    lo, hi = spec['bins'][k - 1], spec['bins'][k]
+    return start - ((x - lo) / (hi - lo)) * (start - end)
+
+def score_components(curr):
+    """
+    计算各维度评分（未取整）
+
+    Returns:
+        ({维度名: 分数}, 价格相对多空线的偏离度%)
+    """
+    inputs = score_inputs(curr)
+    components = {}
+    for name in SCORE_COMPONENTS:
+        spec = SCORE_TIERS[name]
+        x = inputs[spec['input']]
+        k = _tier(spec, x)
+        points = spec['points'][k]
+        components[name] = _linear(spec, k, x) if isinstance(points, tuple) else points
+    return components, inputs['trend_deviation']
+
+def format_detail(score_detail):
+    """评分详情字符串，如 超卖:21.23,趋势:14,..."""
+    return ",".join(f"{SCORE_TIERS[name]['label']}:{score_detail[name]}" for name in SCORE_COMPONENTS)
+
+def calculate_score(curr, df=None):
+    """
+    计算股票评分（100分制）
+
+    Returns:
+        (总分, 评分详情字符串, 价格相对多空线的偏离度%)
+    """
+    components, trend_deviation = score_components(curr)
+    total_score = sum(components.values())
+    score_detail = {name: round(value, 2) for name, value in components.items()}
+    return round(total_score, 2), format_detail(score_detail), round(trend_deviation, 2)
+
+# --- 批量 ---
+
+def batch_inputs(close, zx_dk_line, zx_trend_line, j, volume, vol_ma12, amplitude, amount_ma20):
+    """score_inputs() 的数组版本"""
+    close = np.asarray(close, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    vol_ma12 = np.asarray(vol_ma12, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        has_vol_ma = vol_ma12 > 0
+        return {
+            'j': np.asarray(j, dtype=np.float64),
+            'trend_deviation': (close - zx_dk_line) / zx_dk_line * 100,
+            'vol_ratio': np.where(has_vol_ma, volume / np.where(has_vol_ma, vol_ma12, 1), 1.0),
+            'trend_strength': (np.asarray(zx_trend_line, dtype=np.float64) - zx_dk_line) / zx_dk_line * 100,
+            'amplitude': np.asarray(amplitude, dtype=np.float64),
+            'amount_ma20': np.asarray(amount_ma20, dtype=np.float64),
+        }
+
+def score_batch(close, zx_dk_line, zx_trend_line, j, volume, vol_ma12, amplitude, amount_ma20):
+    """
+    一次计算一批股票-交易日的评分
+
+    参数为形状相同的数组（当日收盘价、多空线、趋势线、J值、成交量、12日均量、振幅、20日均成交额）。
+
+    Returns:
+        {维度名: 分数数组, 'total': 总分数组（未取整）, 'trend_deviation': 偏离度数组,
+         'tiers': {维度名: 所在档位数组}}
+    """
+    inputs = batch_inputs(close, zx_dk_line, zx_trend_line, j, volume, vol_ma12, amplitude, amount_ma20)
+
+    result = {'tiers': {}}
+    total = 0
+    for name in SCORE_COMPONENTS:
+        spec = SCORE_TIERS[name]
+        x = inputs[spec['input']]
+        bins = np.asarray(spec['bins'], dtype=np.float64)
+        side = 'left' if spec['closed'] == 'right' else 'right'
+        tiers = np.searchsorted(bins, x, side=side)
+        tiers = np.where(np.isnan(x), len(bins) if spec['closed'] == 'right' else 0, tiers)
+
+        constant = np.array([0.0 if isinstance(p, tuple) else p for p in spec['points']])
+        value = constant[tiers]
+        for k, points in enumerate(spec['points']):
+            if isinstance(points, tuple):
+                in_tier = tiers == k
+                value = np.where(in_tier, _linear(spec, k, np.where(in_tier, x, 0.0)), value)
+
+        result[name] = value
+        result['tiers'][name] = tiers
+        total = total + value
+
+    result['total'] = total
+    result['trend_deviation'] = inputs['trend_deviation']
+    return result
+
+def round_scores(values):
+    """取两位小数，返回 float 列表（指标为 numpy 数值时与 calculate_score() 的取整相同）"""
+    return np.round(np.asarray(values, dtype=np.float64), 2).tolist()
+
+def detail_at(result, k):
+    """score_batch() 结果中第 k 个的评分详情字符串，与 calculate_score() 相同"""
+    score_detail = {}
+    for name in SCORE_COMPONENTS:
+        points = SCORE_TIERS[name]['points'][result['tiers'][name][k]]
+        score_detail[name] = float(np.round(result[name][k], 2)) if isinstance(points, tuple) else points
+    return format_detail(score_detail)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite 存储层
+
+- 每个进程对每个数据库文件只打开一个长连接（connect()），进程退出时关闭；
+  进程池子进程按 pid 区分，不会沿用父进程 fork 过来的连接
+- 其他进程持有写锁时最多等待 BUSY_TIMEOUT 秒，而不是立即报 database is locked
+- WAL 模式：网页服务读库不会阻塞选股写入，写入也不会阻塞读（B1_DB_JOURNAL_MODE=delete 退回回滚日志模式）
+- 批量写入用 executemany，放在一个事务里（write_many()）
+- 结果表的建表语句和索引统一在这里维护（ensure_strategy_results() / ensure_backtest_results()），
+  “某天评分前N名”的查询走 (strategy_name, date, score DESC) 覆盖索引，不再扫全表
+- 回测的每笔交易单独一行存入 backtest_trades（选股日、代码、持有周期唯一），
+  按股票、按月等统计直接用 SQL 聚合（trade_stats()），不再逐行解析 details JSON；
+  backtest_results.details 由交易明细生成，只为网页展示保留
+
+数据库放在 data/stocks.db（DEFAULT_DB_FILE）：WAL 模式下读库的一方需要同时看到
+stocks.db-wal / stocks.db-shm，只挂载 stocks.db 单个文件的容器只能读到最近一次 checkpoint 的数据，
+所以 docker-compose.yml 挂载整个 data/ 目录。原来放在项目根目录的 stocks.db 在第一次打开时
+连同 -wal / -shm 一起移到 data/ 下（_migrate_legacy()）。
+journal_mode 会记录在数据库文件里，每次打开连接都按 JOURNAL_MODE 重新设置。
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DB_FILE = os.path.join("data", "stocks.db")  # 各脚本的 DB_FILE 默认值（相对项目根目录）
+JOURNAL_MODE = os.environ.get("B1_DB_JOURNAL_MODE", "wal")
+BUSY_TIMEOUT = 30  # 等待其他进程释放写锁的秒数
+
+_CONNECTIONS = {}  # {(pid, 数据库绝对路径): 连接}
+_LOCK = threading.RLock()  # 同一进程内各线程共用连接，事务之间互斥
+
+
+def _migrate_legacy(path):
+    """
+    数据库从项目根目录移到 data/ 之后，第一次打开时把旧位置的数据库（连同 -wal / -shm）移过来
+
+    只处理默认位置；path 已存在或旧位置没有数据库时什么都不做。
+    """
+    if os.path.normpath(path) != DEFAULT_DB_FILE or os.path.exists(path):
+        return
+    legacy = os.path.basename(path)
+    if not os.path.exists(legacy):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 主文件最后移动：中途失败时旧位置仍是完整的数据库，下次运行继续迁移
+    for suffix in ('-wal', '-shm', ''):
+        if os.path.exists(legacy + suffix):
+            os.replace(legacy + suffix, path + suffix)
+    print(f"📦 数据库已从 {legacy} 移到 {path}")
+
+
+def connect(path):
+    """取得本进程对 path 的长连接（第一次调用时打开并设置 journal_mode）"""
+    key = (os.getpid(), os.path.abspath(path))
+    with _LOCK:
+        conn = _CONNECTIONS.get(key)
+        if conn is None:
+            _migrate_legacy(path)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+            conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+            if JOURNAL_MODE.lower() == "wal":
+                # WAL 下 NORMAL 不会损坏数据库；回滚日志模式保持默认的 FULL
+                conn.execute("PRAGMA synchronous=NORMAL")
+            _CONNECTIONS[key] = conn
+        return conn
+
+
+def close_all():
+    """关闭本进程打开的所有连接（WAL 模式下关闭最后一个连接时 SQLite 会把 WAL 合并回主文件）"""
+    with _LOCK:
+        for (pid, _), conn in list(_CONNECTIONS.items()):
+            if pid == os.getpid():
+                conn.close()
+        _CONNECTIONS.clear()
+
+
+atexit.register(close_all)
+
+
+@contextmanager
+def transaction(path):
+    """一个写事务：正常结束时提交，异常时回滚"""
+    conn = connect(path)
+    with _LOCK:
+        with conn:
+            yield conn
+
+
+def write_many(path, sql, rows):
+    """一个事务内用 executemany 批量写入，返回写入的行数"""
+    rows = list(rows)
+    if rows:
+        with transaction(path) as conn:
+            conn.executemany(sql, rows)
+    return len(rows)
+
+
+def query(path, sql, params=()):
+    """执行查询，返回全部结果行"""
+    conn = connect(path)
+    with _LOCK:
+        return conn.execute(sql, params).fetchall()
+
+
+# --- 结果表 ---
+
+def ensure_strategy_results(path):
+    """创建选股结果表和索引（已存在时只补索引）"""
+    with transaction(path) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS strategy_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                strategy_name TEXT NOT NULL,
+                code TEXT NOT NULL,
+                name TEXT,
+                price REAL,
+                j_val REAL,
+                amplitude REAL,
+                vol_ratio REAL,
+                score REAL DEFAULT 0,
+                score_detail TEXT,
+                trend_strength REAL,
+                date TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(strategy_name, code, date)
+            )
+        ''')
+        # 覆盖“某天评分前N名”查询用到的所有列，查询只读索引
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_strategy_results_top
+            ON strategy_results (strategy_name, date, score DESC, code,
+                                 name, price, j_val, amplitude, vol_ratio, score_detail)
+        ''')
+
+
+def ensure_backtest_results(path):
+    """创建回测结果表（旧表没有 details 列时补上）和逐笔交易表"""
+    with transaction(path) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS backtest_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                strategy_name TEXT NOT NULL,
+                date TEXT NOT NULL,
+                stock_count INTEGER,
+                valid_count INTEGER,
+                win_count INTEGER,
+                lose_count INTEGER,
+                win_rate REAL,
+                total_return REAL,
+                avg_return REAL,
+                details TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(strategy_name, date)
+            )
+        ''')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(backtest_results)')]
+        if 'details' not in columns:
+            conn.execute('ALTER TABLE backtest_results ADD COLUMN details TEXT')
+
+        # 每笔交易一行：选股日买入（收盘价），持有 horizon 个交易日后收盘卖出
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS backtest_trades (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                strategy_name TEXT NOT NULL,
+                select_date TEXT NOT NULL,
+                code TEXT NOT NULL,
+                horizon INTEGER NOT NULL DEFAULT 1,
+                name TEXT,
+                sell_date TEXT,
+                entry_price REAL,
+                exit_price REAL,
+                pnl REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(strategy_name, select_date, code, horizon)
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_backtest_trades_code
+            ON backtest_trades (strategy_name, code, select_date)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_backtest_trades_sell_date
+            ON backtest_trades (strategy_name, sell_date)
+        ''')
+
+
+STRATEGY_RESULT_COLUMNS = ('code', 'name', 'price', 'j_val', 'amplitude', 'vol_ratio',
+                           'score', 'score_detail', 'trend_strength', 'date')
+
+STRATEGY_RESULTS_INSERT = f'''
+    INSERT OR REPLACE INTO strategy_results
+    (strategy_name, {', '.join(STRATEGY_RESULT_COLUMNS)})
+    VALUES ({', '.join('?' * (len(STRATEGY_RESULT_COLUMNS) + 1))})
+'''
+
+
+def strategy_result_row(res, strategy_name="b1"):
+    """一条选股结果对应 STRATEGY_RESULTS_INSERT 的参数"""
+    return (
+        strategy_name,
+        res['code'],
+        res.get('name', ''),
+        res['price'],
+        res['j_val'],
+        res['amplitude'],
+        res['vol_ratio'],
+        res['score'],
+        res['score_detail'],
+        res['trend_strength'],
+        res['date']
+    )
+
+
+def save_strategy_results(path, results, strategy_name="b1"):
+    """批量写入选股结果（同一股票同一天覆盖），返回写入的条数"""
+    return write_many(path, STRATEGY_RESULTS_INSERT,
+                      [strategy_result_row(res, strategy_name) for res in results])
+
+
+def top_selections(path, date, limit=10, strategy_name="b1"):
+    """
+    某天评分前 limit 名的选股（同分按代码）
+
+    Returns:
+        [{'code', 'name', 'price', 'score', 'j_val', 'amplitude', 'vol_ratio', 'score_detail'}]
+    """
+    rows = query(path, '''
+        SELECT code, name, price, score, j_val, amplitude, vol_ratio, score_detail
+        FROM strategy_results
+        WHERE strategy_name = ? AND date = ?
+        ORDER BY score DESC, code
+        LIMIT ?
+    ''', (strategy_name, date, limit))
+    return [{
+        'code': row[0],
+        'name': row[1],
+        'price': row[2],
+        'score': row[3],
+        'j_val': row[4],
+        'amplitude': row[5],
+        'vol_ratio': row[6],
+        'score_detail': row[7]
+    } for row in rows]
+
+
+def trade_details(trades):
+    """由交易明细生成 backtest_results.details（网页展示用的盈利/亏损股票 JSON）"""
+    details = {'win_stocks': [], 'lose_stocks': []}
+    for t in trades:
+        if t['pnl'] > 0:
+            details['win_stocks'].append({'code': t['code'], 'name': t.get('name', ''), 'pnl': t['pnl']})
+        elif t['pnl'] < 0:
+            details['lose_stocks'].append({'code': t['code'], 'name': t.get('name', ''), 'pnl': t['pnl']})
+    return json.dumps(details, ensure_ascii=False)
+
+
+def save_backtest_results(path, results, strategy_name="b1"):
+    """
+    批量写入回测结果和逐笔交易（同一天覆盖），返回写入的回测结果条数
+
+    results 中每项的 trades 为该日的交易明细
+    [{'select_date', 'code', 'name', 'sell_date', 'entry_price', 'exit_price', 'pnl'}]，
+    可带 'horizon'（默认 1）。重跑某个选股日时先删掉该日旧的交易，
+    所有结果和交易在同一个事务内写入。
+    """
+    results = list(results)
+    rows = []
+    trade_rows = []
+    replaced = set()
+    for r in results:
+        trades = r.get('trades', [])
+        rows.append((
+            strategy_name,
+            r['date'],
+            r['stock_count'],
+            r['valid_count'],
+            r['win_count'],
+            r['lose_count'],
+            r['win_rate'],
+            r['total_return'],
+            r['avg_return'],
+            trade_details(trades)
+        ))
+        for t in trades:
+            horizon = t.get('horizon', 1)
+            replaced.add((t['select_date'], horizon))
+            trade_rows.append((
+                strategy_name,
+                t['select_date'],
+                t['code'],
+                horizon,
+                t.get('name', ''),
+                t['sell_date'],
+                t['entry_price'],
+                t['exit_price'],
+                t['pnl']
+            ))
+
+    if rows:
+        with transaction(path) as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO backtest_results
+                (strategy_name, date, stock_count, valid_count, win_count, lose_count,
+                 win_rate, total_return, avg_return, details)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.executemany('''
+                DELETE FROM backtest_trades
+                WHERE strategy_name = ? AND select_date = ? AND horizon = ?
+            ''', [(strategy_name,) + key for key in sorted(replaced)])
+            conn.executemany('''
+                INSERT INTO backtest_trades
+                (strategy_name, select_date, code, horizon, name, sell_date,
+                 entry_price, exit_price, pnl)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', trade_rows)
+    return len(rows)
+
+
+# trade_stats() 支持的分组方式：{名称: 分组表达式}
+TRADE_GROUPS = {
+    'code': 'code',
+    'date': 'select_date',
+    'month': 'substr(select_date, 1, 7)',
+    'year': 'substr(select_date, 1, 4)',
+}
+
+
+def trade_stats(path, group_by='code', strategy_name="b1", horizon=1, start_date=None, end_date=None):
+    """
+    按股票 / 选股日 / 月 / 年汇总逐笔交易
+
+    Args:
+        group_by: TRADE_GROUPS 中的分组名
+        start_date, end_date: 选股日期范围（含两端），None 表示不限
+
+    Returns:
+        [{'key', 'count', 'win_count', 'lose_count', 'win_rate',
+          'avg_pnl', 'total_pnl', 'best_pnl', 'worst_pnl'}]，按 key 升序
+    """
+    key = TRADE_GROUPS[group_by]
+    rows = query(path, f'''
+        SELECT {key} AS key, COUNT(*), SUM(pnl > 0), SUM(pnl < 0),
+               AVG(pnl), SUM(pnl), MAX(pnl), MIN(pnl)
+        FROM backtest_trades
+        WHERE strategy_name = ? AND horizon = ?
+          AND select_date >= ? AND select_date <= ?
+        GROUP BY key
+        ORDER BY key
+    ''', (strategy_name, horizon, start_date or '', end_date or '9999'))
+    return [{
+        'key': row[0],
+        'count': row[1],
+        'win_count': row[2],
+        'lose_count': row[3],
+        'win_rate': row[2] / row[1] * 100,
+        'avg_pnl': row[4],
+        'total_pnl': row[5],
+        'best_pnl': row[6],
+        'worst_pnl': row[7]
+    } for row in rows]
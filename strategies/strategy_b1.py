@@ -1,51 +1,86 @@
-import requests
 import pandas as pd
 import numpy as np
 import time
-import sqlite3
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import functools
 from datetime import datetime
 
+import http_client
+import conditions
+import db_writer
+import indicator_state
+import kline_cache
+import panel
+import pipeline
+import price_lookup
+import scan_checkpoint
+import scan_failures
+import storage
+from scoring import SCORE_TIERS, calculate_score
+
 # 配置
 BASE_URL = "http://localhost:8080"
-MAX_WORKERS = 10  # 并发线程数
-DB_FILE = "stocks.db" # 数据库文件
+MAX_INFLIGHT = int(os.environ.get("B1_MAX_INFLIGHT", 100))  # 同时在途的K线请求数
+ANALYZE_WORKERS = int(os.environ.get("B1_ANALYZE_WORKERS", os.cpu_count() or 1))  # 指标计算进程数
+DB_FILE = storage.DEFAULT_DB_FILE  # 数据库文件（data/stocks.db）
+INCREMENTAL_INDICATORS = os.environ.get("B1_INCREMENTAL", "1") != "0"  # 每日选股使用增量指标状态
+WRITE_BATCH_SIZE = 50        # 扫描中每攒够这么多条命中写一次库
+WRITE_FLUSH_INTERVAL = 1.0   # 命中不足一批时最多等待的秒数
+CHECKPOINT_ENABLED = os.environ.get("B1_CHECKPOINT", "1") != "0"  # 断点续跑（见 scan_checkpoint.py）
+RETRY_INFLIGHT = int(os.environ.get("B1_RETRY_INFLIGHT", 10))  # 扫描结束后重试失败股票时的在途请求数
+RETRY_ROUNDS = 2    # 重试轮数
+RETRY_DELAY = 5     # 每轮重试前等待的秒数（让网关从抖动中恢复）
 
 # 全局股票名称缓存
 STOCK_NAMES_CACHE = {}
 
+# 最近一个已收盘的交易日（K线缓存以此判断是否需要重新拉取）
+LATEST_TRADE_DATE = None
+
 # 策略参数
 M1 = 14
 M2 = 28
 M3 = 57
 M4 = 114
+J_MAX = 13               # J值上限
+AMPLITUDE_MAX = 4        # 当日振幅上限（%）
+VOLUME_RATIO_MAX = 0.52  # 当日成交量 / 12日均量 上限
+GAP_DAYS = 40            # 跳空缺口回看天数
+STAGNANT_DAYS = 40       # 高位放量滞涨回看天数
+STAGNANT_MA_PERIOD = 20  # 高位放量滞涨的均线 / 均量周期
+STAGNANT_VOLUME = 1.5    # 放量倍数
+STAGNANT_UP = 0.01       # 弱阳线涨幅上限
+
+# --- 尾部窗口模式 ---
+# 每日选股只看最后一根K线的指标和过去40天的行情，没必要在全部历史上计算指标。
+# 尾部窗口只保留最近 TAIL_BARS 根K线：
+# - MA14/28/57/114、KDJ 的9日高低点、vol_ma12、amount_ma20 是有限窗口，窗口落在尾部内即与全量计算相同
+#   （只差滚动求和的浮点舍入，约 1e-13）；
+# - EMA（adjust=False）是无限递推，以尾部第一根K线为初值。截断前历史对最后一根K线的残余影响：
+#   单重EMA为 (1-α)^n，双重EMA（趋势线 EMA(EMA(C,10),10)、D=EMA(K)）为 (1+nα)(1-α)^n，n 为递推步数。
+#   取 n 使残余权重 ≤ TAIL_TOLERANCE，则 ema10/趋势线的误差 ≤ TAIL_TOLERANCE × 收盘价历史极差，
+#   K/D 的误差 ≤ TAIL_TOLERANCE × 100，J = 3K - 2D 的误差 ≤ TAIL_TOLERANCE × 500；
+# - 过去40天跳空、40天高位放量滞涨（MA20）的判断需要最近 40 + 20 根K线。
+TAIL_TOLERANCE = 1e-9
+
+def ewm_warmup_bars(alpha, tolerance=TAIL_TOLERANCE):
+    """双重EMA的残余权重 (1+nα)(1-α)^n 不超过 tolerance 所需的递推步数 n"""
+    n = 0
+    while (1 + n * alpha) * (1 - alpha) ** n > tolerance:
+        n += 1
+    return n
+
+TAIL_BARS = max(
+    M4,                                    # 知行多空线最长均线
+    ewm_warmup_bars(2 / 11) + 1,           # EMA10 / 趋势线（span=10）
+    8 + ewm_warmup_bars(1 / 3) + 1,        # RSV 从第9根K线开始有值，K/D（com=2）
+    40 + 20,                               # 40天过滤条件 + MA20
+)
 
 def init_db():
     """初始化数据库"""
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    # 创建策略结果表 - 添加评分字段
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS strategy_results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            strategy_name TEXT NOT NULL,
-            code TEXT NOT NULL,
-            name TEXT,
-            price REAL,
-            j_val REAL,
-            amplitude REAL,
-            vol_ratio REAL,
-            score REAL DEFAULT 0,
-            score_detail TEXT,
-            trend_strength REAL,
-            date TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(strategy_name, code, date)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    storage.ensure_strategy_results(DB_FILE)
     print(f"📦 数据库 {DB_FILE} 初始化完成")
 
 def load_stock_names():
@@ -53,180 +88,31 @@ def load_stock_names():
     global STOCK_NAMES_CACHE
     try:
         print("📥 正在批量加载股票名称...")
-        response = requests.get(f"{BASE_URL}/api/stock-names", timeout=30)
-        response.raise_for_status()
-        data = response.json()
-        if data['code'] == 0:
-            STOCK_NAMES_CACHE = data['data']['data']
-            print(f"✅ 成功加载 {len(STOCK_NAMES_CACHE)} 只股票名称")
-            return True
-        else:
-            print(f"❌ 加载股票名称失败: {data.get('msg', '未知错误')}")
-            return False
+        data = http_client.get_json(BASE_URL, "/api/stock-names")
+        STOCK_NAMES_CACHE = data['data']
+        print(f"✅ 成功加载 {len(STOCK_NAMES_CACHE)} 只股票名称")
+        return True
     except Exception as e:
         print(f"❌ 批量加载股票名称失败: {e}")
         return False
 
 
-def calculate_score(curr, df):
-    """
-    计算股票评分（100分制）
-
-    评分维度：
-    1. 超卖程度 (28分) - J值越低，分数越高
-    2. 趋势强度 (24分) - 价格偏离多空线越多，趋势越强
-    3. 缩量程度 (18分) - 量比越小，缩量越明显
-    4. 短期动能 (15分) - 短期趋势线相对多空线偏离度
-    5. 振幅收敛 (10分) - 振幅越小，变盘概率越大
-    6. 流动性 (5分) - 成交额越高，流动性越好
-    """
-    score_detail = {}
-    total_score = 0
-
-    # 1. 超卖程度评分 (28分)
-    j_val = curr['j']
-    if j_val <= 0:
-        score_oversold = 28
-    elif j_val <= 13:
-        score_oversold = 28 - (j_val / 13) * 11  # 线性递减
-    else:
-        score_oversold = 0
-    score_detail['oversold'] = round(score_oversold, 2)
-    total_score += score_oversold
-
-    # 2. 趋势强度评分 (24分)
-    # 计算价格相对多空线的偏离度
-    trend_deviation = (curr['close'] - curr['zx_dk_line']) / curr['zx_dk_line'] * 100
-    if trend_deviation >= 10:
-        score_trend = 24
-    elif trend_deviation >= 7:
-        score_trend = 21
-    elif trend_deviation >= 5:
-        score_trend = 17
-    elif trend_deviation >= 3:
-        score_trend = 14
-    elif trend_deviation >= 1:
-        score_trend = 11
-    elif trend_deviation >= 0:
-        score_trend = 7
-    else:
-        score_trend = 0
-    score_detail['trend'] = round(score_trend, 2)
-    total_score += score_trend
-
-    # 3. 缩量程度评分 (18分)
-    vol_ratio = curr['volume'] / curr['vol_ma12'] if curr['vol_ma12'] > 0 else 1
-    if vol_ratio <= 0.3:
-        score_volume = 18
-    elif vol_ratio <= 0.4:
-        score_volume = 16
-    elif vol_ratio <= 0.52:
-        score_volume = 13
-    else:
-        score_volume = 0
-    score_detail['volume'] = round(score_volume, 2)
-    total_score += score_volume
-
-    # 4. 短期动能评分 (15分)
-    # 短期趋势线相对多空线的偏离度
-    trend_strength = (curr['zx_trend_line'] - curr['zx_dk_line']) / curr['zx_dk_line'] * 100
-    if trend_strength >= 5:
-        score_momentum = 15
-    elif trend_strength >= 3:
-        score_momentum = 12
-    elif trend_strength >= 1:
-        score_momentum = 9
-    elif trend_strength > 0:
-        score_momentum = 6
-    else:
-        score_momentum = 0
-    score_detail['momentum'] = round(score_momentum, 2)
-    total_score += score_momentum
-
-    # 5. 振幅收敛评分 (10分)
-    amplitude = curr['amplitude']
-    if amplitude <= 1:
-        score_amplitude = 10
-    elif amplitude <= 2:
-        score_amplitude = 8
-    elif amplitude <= 3:
-        score_amplitude = 6
-    elif amplitude <= 4:
-        score_amplitude = 4
-    else:
-        score_amplitude = 0
-    score_detail['amplitude'] = round(score_amplitude, 2)
-    total_score += score_amplitude
-
-    # 6. 流动性评分 (5分)
-    # 基于最近20天平均成交额
-    avg_amount = curr['amount_ma20'] if curr['amount_ma20'] > 0 else 0
-    # 成交额单位：元，设定分级标准
-    if avg_amount >= 500000000:  # 5亿以上
-        score_liquidity = 5
-    elif avg_amount >= 200000000:  # 2-5亿
-        score_liquidity = 4
-    elif avg_amount >= 100000000:  # 1-2亿
-        score_liquidity = 3
-    elif avg_amount >= 50000000:  # 5000万-1亿
-        score_liquidity = 2
-    elif avg_amount >= 10000000:  # 1000万-5000万
-        score_liquidity = 1
-    else:  # 1000万以下
-        score_liquidity = 0
-    score_detail['liquidity'] = round(score_liquidity, 2)
-    total_score += score_liquidity
-
-    # 构建评分详情字符串
-    detail_str = f"超卖:{score_detail['oversold']},趋势:{score_detail['trend']},缩量:{score_detail['volume']},动能:{score_detail['momentum']},振幅:{score_detail['amplitude']},流动性:{score_detail['liquidity']}"
-
-    return round(total_score, 2), detail_str, round(trend_deviation, 2)
-
 def save_to_db(results, strategy_name="b1"):
-    """保存结果到数据库"""
+    """保存结果到数据库（一个事务内批量写入）"""
     if not results:
         return
 
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-
-    count = 0
-    for res in results:
-        try:
-            c.execute('''
-                INSERT OR REPLACE INTO strategy_results
-                (strategy_name, code, name, price, j_val, amplitude, vol_ratio, score, score_detail, trend_strength, date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                strategy_name,
-                res['code'],
-                res.get('name', ''),
-                res['price'],
-                res['j_val'],
-                res['amplitude'],
-                res['vol_ratio'],
-                res['score'],
-                res['score_detail'],
-                res['trend_strength'],
-                res['date']
-            ))
-            count += 1
-        except Exception as e:
-            print(f"保存 {res['code']} 失败: {e}")
-
-    conn.commit()
-    conn.close()
+    try:
+        count = storage.save_strategy_results(DB_FILE, results, strategy_name)
+    except Exception as e:
+        print(f"❌ 保存选股结果失败: {e}")
+        return
     print(f"💾 已保存 {count} 条记录到数据库")
 
 def get_all_codes():
     """获取全市场股票代码"""
     try:
-        response = requests.get(f"{BASE_URL}/api/stock-codes")
-        response.raise_for_status()
-        data = response.json()
-        if data['code'] == 0:
-            return data['data']['list']
-        return []
+        return http_client.get_json(BASE_URL, "/api/stock-codes")['list']
     except Exception as e:
         print(f"获取股票列表失败: {e}")
         return []
@@ -241,7 +127,7 @@ def get_stock_name(code):
     try:
         # 去掉市场前缀 (sh/sz)
         clean_code = code[2:] if code.startswith(('sh', 'sz')) else code
-        response = requests.get(f"{BASE_URL}/api/search?keyword={clean_code}", timeout=5)
+        response = http_client.get(BASE_URL, "/api/search", params={"keyword": clean_code})
         response.raise_for_status()
         data = response.json()
         if data['code'] == 0 and len(data['data']) > 0:
@@ -255,49 +141,48 @@ def get_stock_name(code):
         return ''
 
 def get_kline_data(code):
-    """获取单只股票K线数据"""
+    """
+    获取单只股票K线数据（优先读本地缓存，缺失时请求HTTP）
+
+    Raises:
+        scan_failures.ScanFailure: 没有数据、历史不足，或请求/解析出错（按超时、5xx、网关错误、格式错误等归类）
+    """
+    # 获取日K线，默认是前复权
     try:
-        # 获取日K线，默认是前复权
-        response = requests.get(f"{BASE_URL}/api/kline", params={
-            "code": code,
-            "type": "day"
-        }, timeout=10)
+        df = kline_cache.get_kline(code, BASE_URL, until=LATEST_TRADE_DATE)
+    except Exception as e:
+        raise scan_failures.ScanFailure(scan_failures.classify(e), repr(e)) from e
+    if df is None:
+        raise scan_failures.ScanFailure(scan_failures.NO_DATA)
+    if len(df) < M4 + 5:
+        raise scan_failures.ScanFailure(scan_failures.SHORT_HISTORY, f"{len(df)} 根K线")
 
-        if response.status_code != 200:
-            return None
+    # 每日选股只需要尾部窗口，传给计算进程的数据也随之变小
+    return tail_window(df)
 
-        data = response.json()
-        if data['code'] != 0 or not data['data']:
-            return None
-
-        kline_list = data['data']['List']
-        if not kline_list or len(kline_list) < M4 + 5:
-            return None
-
-        # 转换为DataFrame
-        df = pd.DataFrame(kline_list)
-        df = df.rename(columns={
-            'Time': 'date',
-            'Open': 'open',
-            'High': 'high',
-            'Low': 'low',
-            'Close': 'close',
-            'Volume': 'volume',
-            'Amount': 'amount',
-            'Last': 'pre_close'
-        })
+def tail_window(df):
+    """取最近 TAIL_BARS 根K线（尾部窗口模式的输入）"""
+    return df.iloc[-TAIL_BARS:].copy()
 
-        # 确保数值类型
-        numeric_cols = ['open', 'high', 'low', 'close', 'volume', 'amount', 'pre_close']
-        for col in numeric_cols:
-            df[col] = pd.to_numeric(df[col])
+def calculate_indicators(df, tail=False, code=None):
+    """
+    计算技术指标
 
-        return df
-    except Exception:
-        return None
+    Args:
+        df: K线数据
+        tail: 为 True 时只在最近 TAIL_BARS 根K线上计算并返回这一段，
+              最后一根K线的指标与全量计算的误差见 TAIL_TOLERANCE 的说明
+        code: 传入时使用增量模式：读取该股票保存的递推状态（indicator_state），
+              只用新增的K线推进并保存，返回只含最后一根K线的一行
+    """
+    if code is not None:
+        values = indicator_state.update(code, df, (M1, M2, M3, M4))
+        # 一次构造这一行（逐列赋值给 DataFrame 加列的开销比推进状态本身还大）
+        return pd.DataFrame([dict(df.iloc[-1].to_dict(), **values)], index=df.index[-1:])
+
+    if tail:
+        df = tail_window(df)
 
-def calculate_indicators(df):
-    """计算技术指标"""
     # 1. 计算知行多空线
     df['ma_m1'] = df['close'].rolling(window=M1).mean()
     df['ma_m2'] = df['close'].rolling(window=M2).mean()
@@ -347,25 +232,8 @@ def has_gap_in_past_days(df, days=40):
     if df is None or len(df) < 2:
         return False
 
-    # 取过去N天的数据（最后N行）
-    # 由于我们要检查相邻K线，所以需要 days+1 行数据
-    start_idx = max(0, len(df) - days - 1)
-    check_df = df.iloc[start_idx:]
-
-    # 遍历检查相邻K线之间的跳空
-    for i in range(1, len(check_df)):
-        curr = check_df.iloc[i]
-        prev = check_df.iloc[i-1]
-
-        # 向上跳空：当日最低价 > 前日最高价
-        if curr['low'] > prev['high']:
-            return True
-
-        # 向下跳空：当日最高价 < 前日最低价
-        if curr['high'] < prev['low']:
-            return True
-
-    return False
+    # 相邻K线逐对比较，取最后 days+1 根K线之间的 days 个比较结果
+    return bool(panel.has_gap(df['high'].to_numpy(), df['low'].to_numpy(), days=days))
 
 def has_top_volume_stagnant_in_past_days(df, days=40, ma_period=20,
                                          volume_threshold=1.5,
@@ -400,111 +268,180 @@ def has_top_volume_stagnant_in_past_days(df, days=40, ma_period=20,
     if 'vol_ma20' not in df.columns:
         df['vol_ma20'] = df['volume'].rolling(window=ma_period).mean()
 
-    # 取过去N天的数据
-    start_idx = max(0, len(df) - days)
-    check_df = df.iloc[start_idx:]
-
-    # 遍历检查是否出现"高位放量但滞涨"
-    for i in range(len(check_df)):
-        row = check_df.iloc[i]
-
-        # 检查均线值是否有效
-        if pd.isna(row['ma20']) or pd.isna(row['vol_ma20']):
-            continue
-
-        # 条件1：高位（close > MA20）
-        is_high_price = row['close'] > row['ma20']
-
-        # 条件2：放量（volume > vol_ma20 × threshold）
-        is_high_volume = row['volume'] > row['vol_ma20'] * volume_threshold
-
-        # 条件3：滞涨或阴线
-        #   ├─ 阴线：close < open
-        #   ├─ 弱阳线：close > open 且 (close-open)/open <= threshold
-        is_stagnant = (
-            row['close'] < row['open'] or  # 阴线
-            (row['close'] > row['open'] and
-             (row['close'] - row['open']) / row['open'] < up_strength_threshold)
-        )
-
-        # 三个条件同时满足 → 检测到危险信号
-        if is_high_price and is_high_volume and is_stagnant:
-            return True
-
-    return False
+    # 逐根标记后取过去N天的结果
+    flags = panel.stagnant_flags(df['open'].to_numpy(), df['close'].to_numpy(),
+                                 df['volume'].to_numpy(), df['ma20'].to_numpy(),
+                                 df['vol_ma20'].to_numpy(),
+                                 volume_threshold=volume_threshold,
+                                 up_strength_threshold=up_strength_threshold)
+    return bool(panel.window_any(flags, days))
 
 def analyze_stock(code):
-    """分析单只股票"""
+    """分析单只股票（取不到数据或出错时抛出异常，见 get_kline_data()）"""
     df = get_kline_data(code)
-    if df is None:
-        return None
+    return analyze_kline(code, df)
 
-    try:
-        df = calculate_indicators(df)
-
-        # 获取最新一行数据（当日）
-        curr = df.iloc[-1]
-
-        # 检查数据是否有效
-        if np.isnan(curr['zx_dk_line']) or np.isnan(curr['zx_trend_line']) or np.isnan(curr['j']):
-            return None
-
-        # --- 策略条件判断 ---
+def analyze_kline(code, df):
+    """对已获取的K线数据执行策略判断"""
+    res = evaluate_kline(code, df)
+    if res is None:
+        return None
+    return attach_stock_name(res)
 
-        # 1. 股价高于当日知行多空线价格
-        cond1 = curr['close'] > curr['zx_dk_line']
+def attach_stock_name(res):
+    """补充股票名称，并剔除ST股票（特别处理股票，退市风险高）"""
+    name = get_stock_name(res['code'])
+    if name and ('ST' in name or '*ST' in name or 'S*' in name):
+        return None
 
-        # 2. 当前日 KDJ 里面的 J值 < 13
-        cond2 = curr['j'] < 13
+    res['name'] = name
+    return res
 
-        # 3. 知行短期趋势线价格大于知行多空线价格
-        cond3 = curr['zx_trend_line'] > curr['zx_dk_line']
+# --- 策略条件（按需计算特征，按成本和选择性排序后短路判断） ---
 
-        # 4. 当日股价振幅小于4%
-        cond4 = curr['amplitude'] < 4
+def _feature_last(df, features):
+    """最新一根K线的原始行情"""
+    return df.iloc[-1]
 
-        # 5. 当日交易量小于最近12天交易量均量的52%
-        cond5 = curr['volume'] < (curr['vol_ma12'] * 0.52)
+def _feature_amplitude(df, features):
+    """当日振幅（只用最后一根K线）"""
+    last = features['last']
+    return (last['high'] - last['low']) / last['pre_close'] * 100
 
-        # 6. 过去40天无跳空缺口（避免有缺口的股票）
-        cond6 = not has_gap_in_past_days(df, days=40)
+def _feature_vol_ma12(df, features):
+    """当日的12日成交量均值"""
+    return df['volume'].rolling(window=12).mean().iloc[-1]
 
-        # 7. 过去40天无高位放量但滞涨的现象（避免见顶股票）
-        cond7 = not has_top_volume_stagnant_in_past_days(df, days=40, ma_period=20,
-                                                         volume_threshold=1.5,
-                                                         up_strength_threshold=0.01)
+def _feature_curr(df, features):
+    """
+    计算全部指标后的最新一行
 
-        if cond1 and cond2 and cond3 and cond4 and cond5 and cond6 and cond7:
-            # 获取股票名称
-            name = get_stock_name(code)
+    增量模式下推进保存的状态（evaluate_kline_traced() 对每只股票都会先计算这一特征）；
+    状态需要重建时只有尾部窗口可用，重建结果与尾部窗口模式相同（误差见 TAIL_TOLERANCE），
+    之后每天推进误差继续衰减。
+    """
+    if INCREMENTAL_INDICATORS and features.code:
+        return calculate_indicators(df, code=features.code).iloc[-1]
+    return calculate_indicators(df, tail=True).iloc[-1]
+
+B1_FEATURES = {
+    'last': _feature_last,
+    'amplitude': _feature_amplitude,
+    'vol_ma12': _feature_vol_ma12,
+    'curr': _feature_curr,
+}
+
+# 声明顺序即没有统计数据时的默认判断顺序：先判断只需要最后一根K线的廉价条件
+B1_CONDITIONS = {
+    # 4. 当日股价振幅小于4%
+    'amplitude': lambda f: f['amplitude'] < AMPLITUDE_MAX,
+    # 5. 当日交易量小于最近12天交易量均量的52%
+    'volume': lambda f: f['last']['volume'] < f['vol_ma12'] * VOLUME_RATIO_MAX,
+    # 2. 当前日 KDJ 里面的 J值 < 13
+    'j': lambda f: f['curr']['j'] < J_MAX,
+    # 1. 股价高于当日知行多空线价格
+    'close_above_dk': lambda f: f['curr']['close'] > f['curr']['zx_dk_line'],
+    # 3. 知行短期趋势线价格大于知行多空线价格
+    'trend_above_dk': lambda f: f['curr']['zx_trend_line'] > f['curr']['zx_dk_line'],
+    # 6. 过去40天无跳空缺口（避免有缺口的股票）
+    'no_gap': lambda f: not has_gap_in_past_days(f.df, days=GAP_DAYS),
+    # 7. 过去40天无高位放量但滞涨的现象（避免见顶股票）
+    'no_stagnant': lambda f: not has_top_volume_stagnant_in_past_days(
+        f.df, days=STAGNANT_DAYS, ma_period=STAGNANT_MA_PERIOD,
+        volume_threshold=STAGNANT_VOLUME, up_strength_threshold=STAGNANT_UP),
+}
+
+# 条件统计文件：保存上次运行各条件的通过率和耗时，用于调整判断顺序
+CONDITION_STATS_FILE = os.path.join("data", "b1_condition_stats.json")
+# 本次运行的失败分类台账（见 scan_failures.py）
+FAILURE_LEDGER_FILE = os.path.join("data", "b1_scan_failures.json")
+# 增量模式下每只股票都会先计算 curr（推进递推状态，见 evaluate_kline_traced()），
+# 短路省不下这部分计算，排序时不再计入用到 curr 的条件
+CONDITION_ORDER = conditions.order_conditions(list(B1_CONDITIONS),
+                                              conditions.load_stats(CONDITION_STATS_FILE),
+                                              prepaid=('curr',) if INCREMENTAL_INDICATORS else ())
+
+def evaluate_kline(code, df):
+    """
+    计算指标并判断7个策略条件，命中时返回带评分的结果（name 留空）
 
-            # 剔除ST股票（特别处理股票，退市风险高）
-            if name and ('ST' in name or '*ST' in name or 'S*' in name):
-                return None
+    不访问股票名称等全局状态，可在进程池中执行；增量模式下会读写该股票的递推状态文件
+    data/indicator_state/<code>.npz（每只股票只由一个进程处理，文件之间互不冲突）。
+    """
+    return evaluate_kline_traced(code, df)[0]
 
-            # 计算评分
-            score, score_detail, trend_strength = calculate_score(curr, df)
+def evaluate_kline_traced(code, df, persist_state=None):
+    """
+    同 evaluate_kline，额外返回条件判断 trace，供汇总各条件通过率
 
-            # 格式化日期
-            date_str = curr['date'].split('T')[0] if 'T' in curr['date'] else curr['date']
+    persist_state: 是否读写该股票的递推状态，默认看本进程是否确定了最近交易日（LATEST_TRADE_DATE）。
+                   不确定时最后一根K线可能是盘中未收盘的K线，不能推进进保存的状态
+                   （之后收盘价碰巧相同就不会被发现），这时只用传入的K线在内存中重算（同尾部窗口模式），
+                   与 kline_cache 不缓存未收盘K线的做法一致。在进程池中执行时由调用方显式传入。
 
-            return {
-                'code': code,
-                'name': name,
-                'price': float(curr['close']),
-                'j_val': float(curr['j']),
-                'amplitude': float(curr['amplitude']),
-                'vol_ratio': float(curr['volume'] / curr['vol_ma12']) if curr['vol_ma12'] > 0 else 0,
-                'score': score,
-                'score_detail': score_detail,
-                'trend_strength': trend_strength,
-                'date': date_str
-            }
+    计算出错时抛出异常（在进程池中执行时由 pipeline 交回扫描循环记为失败，稍后重试）
+    """
+    if persist_state is None:
+        persist_state = LATEST_TRADE_DATE is not None
+    state_code = code if INCREMENTAL_INDICATORS and persist_state else None
+    features = conditions.LazyFeatures(B1_FEATURES, df, state_code)
+    if state_code:
+        # 每只扫描到的股票都推进并保存递推状态：只在通过前面条件、用到 curr 的股票上推进的话，
+        # 其余股票的状态会落在尾部窗口之外，下次被选中时只能从头重建
+        features['curr']
+    passed, trace = conditions.evaluate(B1_CONDITIONS, CONDITION_ORDER, features)
+    if not passed:
+        return None, trace
+
+    # 获取最新一行数据（当日）
+    curr = features['curr']
+
+    # 检查数据是否有效
+    if np.isnan(curr['zx_dk_line']) or np.isnan(curr['zx_trend_line']) or np.isnan(curr['j']):
+        return None, trace
+
+    # 计算评分
+    score, score_detail, trend_strength = calculate_score(curr, df)
+
+    # 格式化日期
+    date_str = curr['date'].split('T')[0] if 'T' in curr['date'] else curr['date']
 
-    except Exception as e:
-        pass
+    return {
+        'code': code,
+        'name': '',
+        'price': float(curr['close']),
+        'j_val': float(curr['j']),
+        'amplitude': float(curr['amplitude']),
+        'vol_ratio': float(curr['volume'] / curr['vol_ma12']) if curr['vol_ma12'] > 0 else 0,
+        'score': score,
+        'score_detail': score_detail,
+        'trend_strength': trend_strength,
+        'date': date_str
+    }, trace
+
+def scan_params():
+    """
+    影响选股结果的参数，断点按其哈希区分（参数改了就不沿用旧断点）
 
-    return None
+    条件的阈值都取自上面的模块常量；改动条件本身的逻辑时要把新阈值也提成常量并加到这里。
+    """
+    return {
+        'periods': (M1, M2, M3, M4),
+        'incremental': INCREMENTAL_INDICATORS,
+        'tail_bars': TAIL_BARS,
+        'conditions': sorted(B1_CONDITIONS),
+        'thresholds': {
+            'j_max': J_MAX,
+            'amplitude_max': AMPLITUDE_MAX,
+            'volume_ratio': VOLUME_RATIO_MAX,
+            'gap_days': GAP_DAYS,
+            'stagnant_days': STAGNANT_DAYS,
+            'stagnant_ma_period': STAGNANT_MA_PERIOD,
+            'stagnant_volume': STAGNANT_VOLUME,
+            'stagnant_up': STAGNANT_UP,
+        },
+        'score_tiers': SCORE_TIERS,
+    }
 
 def get_score_level(score):
     """根据评分返回星级"""
@@ -519,11 +456,111 @@ def get_score_level(score):
     else:
         return "⭐"
 
+async def scan_market(codes, writer=None, checkpoint=None, results=None, stats=None, ledger=None,
+                      max_inflight=MAX_INFLIGHT):
+    """
+    异步抓取全市场K线，每到达一只立即交给进程池分析
+
+    writer 不为 None 时，每个命中立即提交给后台写库线程（db_writer.BatchWriter），
+    扫描过程中就陆续写入 strategy_results；checkpoint 不为 None 时逐只记录进度。
+    命中、统计和失败分类追加到传入的 results / stats / ledger 中（默认新建）。
+
+    Returns:
+        (results, stats, ledger)：命中列表、各条件的通过率统计、失败台账（scan_failures.FailureLedger）
+    """
+    results = [] if results is None else results
+    stats = {} if stats is None else stats
+    ledger = scan_failures.FailureLedger() if ledger is None else ledger
+    processed = 0
+    total = len(codes)
+
+    # 最近交易日只在本进程中确定，计算进程里看不到，显式传给 evaluate_kline_traced()
+    analyze = functools.partial(evaluate_kline_traced, persist_state=LATEST_TRADE_DATE is not None)
+    async for code, traced in pipeline.analyze_stream(codes, get_kline_data, analyze,
+                                                      max_inflight=max_inflight,
+                                                      workers=ANALYZE_WORKERS,
+                                                      return_exceptions=True):
+        processed += 1
+        if processed % 100 == 0:
+            print(f"进度: {processed}/{total} ({(processed/total*100):.1f}%) - 命中: {len(results)}")
+
+        if isinstance(traced, Exception):
+            # 取数据阶段的异常已归类，其余是计算出错
+            category = traced.category if isinstance(traced, scan_failures.ScanFailure) \
+                else scan_failures.ANALYSIS
+            ledger.record(code, category, traced)
+            if checkpoint is not None:
+                if category in scan_failures.SKIP_CATEGORIES:
+                    checkpoint.record_done(code)
+                else:
+                    checkpoint.record_failed(code, traced)
+            continue
+
+        res, trace = traced
+        ledger.resolve(code)
+        conditions.record(stats, trace)
+        if res is not None:
+            res = attach_stock_name(res)
+        if checkpoint is not None:
+            checkpoint.record_done(code, res, trace)
+
+        if res:
+            results.append(res)
+            if writer is not None:
+                writer.put(storage.strategy_result_row(res))
+            stars = get_score_level(res['score'])
+            print(f"✅ 发现目标: {res['code']} - 价格:{res['price']:.2f} 评分:{res['score']:.1f} {stars}")
+
+    return results, stats, ledger
+
+def restore_checkpoint(checkpoint, writer):
+    """
+    沿用断点中已完成股票的结果
+
+    命中重新提交写库（INSERT OR REPLACE，上次中断前可能还没写进去）
+
+    Returns:
+        (results, stats)
+    """
+    results = []
+    stats = {}
+    for res, trace in checkpoint.done.values():
+        if trace is not None:
+            conditions.record(stats, trace)
+        if res:
+            results.append(res)
+            writer.put(storage.strategy_result_row(res))
+    return results, stats
+
+def retry_failures(ledger, writer=None, checkpoint=None, results=None, stats=None):
+    """
+    超时、5xx、网关错误等可重试的失败放到最后，降低并发统一重试（最多 RETRY_ROUNDS 轮）
+
+    结果追加到 results / stats / ledger 中，重试成功的股票计入 ledger.recovered
+    """
+    for round_no in range(1, RETRY_ROUNDS + 1):
+        retry_codes = ledger.retry_codes()
+        if not retry_codes:
+            break
+        print(f"🔁 第 {round_no} 轮重试 {len(retry_codes)} 只股票"
+              f"（{RETRY_DELAY}秒后开始，在途请求上限 {RETRY_INFLIGHT}）...")
+        time.sleep(RETRY_DELAY)
+        asyncio.run(scan_market(retry_codes, writer, checkpoint, results, stats, ledger,
+                                max_inflight=RETRY_INFLIGHT))
+
 def main():
+    global LATEST_TRADE_DATE
     print("🚀 开始执行 B1 选股策略（含量化评分）...")
     print(f"📅 运行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     init_db()
 
+    # 连接池大小与在途请求数一致，每个请求都能复用 keep-alive 连接
+    http_client.configure(pool_size=MAX_INFLIGHT)
+
+    # 确定最近交易日，已同步到该日的股票直接读本地K线缓存
+    LATEST_TRADE_DATE = kline_cache.get_latest_trade_date(BASE_URL)
+    print(f"📅 最近交易日: {LATEST_TRADE_DATE or '未知（不使用缓存）'}")
+
     # 0. 批量加载股票名称（性能优化）
     load_stock_names()
 
@@ -534,27 +571,41 @@ def main():
     # 测试模式：只跑前100只
     # codes = codes[:100]
 
-    results = []
-    processed = 0
     total = len(codes)
 
-    print("⚡️ 开始并发分析...")
+    print(f"⚡️ 开始并发分析（在途请求上限 {MAX_INFLIGHT}，计算进程 {ANALYZE_WORKERS}）...")
     start_time = time.time()
 
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_code = {executor.submit(analyze_stock, code): code for code in codes}
-
-        for future in as_completed(future_to_code):
-            code = future_to_code[future]
-            processed += 1
-            if processed % 100 == 0:
-                print(f"进度: {processed}/{total} ({(processed/total*100):.1f}%) - 命中: {len(results)}")
-
-            res = future.result()
-            if res:
-                results.append(res)
-                stars = get_score_level(res['score'])
-                print(f"✅ 发现目标: {res['code']} - 价格:{res['price']:.2f} 评分:{res['score']:.1f} {stars}")
+    # 命中边扫描边写库，close() 等待全部写完
+    writer = db_writer.BatchWriter(DB_FILE, storage.STRATEGY_RESULTS_INSERT,
+                                   batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL)
+    checkpoint = None
+    try:
+        results, condition_stats = [], {}
+        pending = codes
+        if CHECKPOINT_ENABLED:
+            run_date = LATEST_TRADE_DATE or datetime.now().strftime('%Y-%m-%d')
+            checkpoint = scan_checkpoint.ScanCheckpoint(run_date, scan_params())
+            results, condition_stats = restore_checkpoint(checkpoint, writer)
+            pending = checkpoint.pending(codes)
+            if len(pending) < total:
+                print(f"♻️  从断点继续: 已完成 {total - len(pending)} 只（命中 {len(results)}），"
+                      f"剩余 {len(pending)} 只")
+
+        results, condition_stats, ledger = asyncio.run(
+            scan_market(pending, writer, checkpoint, results, condition_stats))
+
+        retry_failures(ledger, writer, checkpoint, results, condition_stats)
+
+        # 命中全部写进库后才把断点标记为完成：之后同一交易日再运行会重新扫描全市场；
+        # 中途退出或有命中没写进库时断点保持未完成，下次运行续跑（沿用的命中会重新提交写库）
+        writer.close()
+        if checkpoint is not None and not writer.failed:
+            checkpoint.complete()
+    finally:
+        writer.close()
+        if checkpoint is not None:
+            checkpoint.close()
 
     end_time = time.time()
     duration = end_time - start_time
@@ -563,15 +614,35 @@ def main():
     print(f"🎉 选股完成！耗时: {duration:.2f}秒")
     print(f"共扫描: {total} 只")
     print(f"命中: {len(results)} 只")
+    failed = ledger.failed_codes()
+    if failed:
+        print(f"⚠️  重试后仍失败: {len(failed)} 只 ({', '.join(failed[:10])}{' ...' if len(failed) > 10 else ''})")
+    print(f"💾 已保存 {writer.written} 条记录到数据库")
+    if writer.failed:
+        print(f"❌ {writer.failed} 条记录写库失败")
+    if kline_cache.ADJUSTED_CODES:
+        print(f"复权变化重新拉取: {len(kline_cache.ADJUSTED_CODES)} 只")
     print("="*70)
 
+    # 各条件通过率（下次运行按耗时/淘汰率调整判断顺序）
+    if condition_stats:
+        print("📐 条件通过率:")
+        print(conditions.format_report(condition_stats, CONDITION_ORDER))
+        conditions.save_stats(CONDITION_STATS_FILE,
+                              conditions.merge_stats(conditions.load_stats(CONDITION_STATS_FILE),
+                                                     condition_stats))
+
+    # 失败分类（只统计本次运行实际扫描的股票，断点中沿用的不计）
+    if ledger.counts:
+        print("📉 失败分类:")
+        print(ledger.format_report())
+    scan_failures.save_ledger(FAILURE_LEDGER_FILE, ledger, run_date=LATEST_TRADE_DATE,
+                              run_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
     if results:
         # 按评分降序排序
         results.sort(key=lambda x: x['score'], reverse=True)
 
-        # 保存到数据库
-        save_to_db(results)
-
         # 转换为DataFrame展示
         res_df = pd.DataFrame(results)
         print("\n📋 选股结果（按评分降序）:")
@@ -620,36 +691,11 @@ def run_previous_day_backtest():
             print(f"\n📅 尝试回测日期: {prev_date}")
 
             # 获取该日期评分前10的股票
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("""
-                SELECT code, name, price, score, j_val, amplitude, vol_ratio, score_detail
-                FROM strategy_results
-                WHERE strategy_name = 'b1' AND date = ?
-                ORDER BY score DESC
-                LIMIT 10
-            """, (prev_date,))
-
-            rows = c.fetchall()
-            conn.close()
-
-            if not rows:
+            top_stocks = storage.top_selections(DB_FILE, prev_date, 10)
+            if not top_stocks:
                 print(f"  ⚠️  {prev_date} 无选股数据，跳过")
                 continue
 
-            top_stocks = []
-            for row in rows:
-                top_stocks.append({
-                    'code': row[0],
-                    'name': row[1],
-                    'price': row[2],
-                    'score': row[3],
-                    'j_val': row[4],
-                    'amplitude': row[5],
-                    'vol_ratio': row[6],
-                    'score_detail': row[7]
-                })
-
             print(f"  ✅ 找到 {len(top_stocks)} 只股票")
 
             # 计算次日收益
@@ -678,6 +724,9 @@ def calculate_daily_pnl_simple(stocks, date):
     if not stocks:
         return None
 
+    # 一次并发取回组合内所有股票的K线（同一次运行内每只股票只取一次）
+    price_lookup.get_lookup(BASE_URL, LATEST_TRADE_DATE).prefetch(stock['code'] for stock in stocks)
+
     total_return = 0
     valid_count = 0
     win_count = 0
@@ -686,22 +735,33 @@ def calculate_daily_pnl_simple(stocks, date):
     # 保存详细信息
     win_stocks = []  # 盈利股票
     lose_stocks = []  # 亏损股票
+    trades = []  # 逐笔交易
 
     for stock in stocks:
         code = stock['code']
         name = stock.get('name', '')
         buy_price = stock['price']
 
-        # 获取次日收盘价
-        next_price = get_next_day_price_simple(code, date)
+        # 获取次日收盘价和实际日期
+        next_close = get_next_day_price_with_date(code, date)
 
-        if next_price is None:
+        if next_close is None:
             continue
+        next_price, sell_date = next_close
 
         # 计算收益率
         pnl = (next_price - buy_price) / buy_price * 100
         total_return += pnl
         valid_count += 1
+        trades.append({
+            'select_date': date,
+            'code': code,
+            'name': name,
+            'sell_date': sell_date,
+            'entry_price': buy_price,
+            'exit_price': next_price,
+            'pnl': pnl
+        })
 
         if pnl > 0:
             win_count += 1
@@ -724,14 +784,6 @@ def calculate_daily_pnl_simple(stocks, date):
     avg_return = total_return / valid_count
     win_rate = win_count / valid_count * 100 if valid_count > 0 else 0
 
-    # 生成详细信息JSON
-    import json
-    details = {
-        'win_stocks': win_stocks,
-        'lose_stocks': lose_stocks
-    }
-    details_json = json.dumps(details, ensure_ascii=False)
-
     return {
         'date': date,
         'stock_count': len(stocks),
@@ -741,81 +793,24 @@ def calculate_daily_pnl_simple(stocks, date):
         'total_return': total_return,
         'avg_return': avg_return,
         'win_rate': win_rate,
-        'details': details_json
+        'win_stocks': win_stocks,
+        'lose_stocks': lose_stocks,
+        'trades': trades
     }
 
-def get_next_day_price_simple(code, current_date):
-    """获取股票次日收盘价（自动跳过周末）"""
-    try:
-        # 获取K线数据
-        response = requests.get(f"{BASE_URL}/api/kline", params={
-            "code": code,
-            "type": "day"
-        }, timeout=10)
-
-        if response.status_code != 200:
-            return None
-
-        data = response.json()
-        if data['code'] != 0 or not data['data']:
-            return None
-
-        kline_list = data['data']['List']
-        if not kline_list:
-            return None
-
-        # 转换为DataFrame
-        df = pd.DataFrame(kline_list)
-        df['date'] = pd.to_datetime(df['Time']).dt.strftime('%Y-%m-%d')
-
-        # 找到当前日期的索引
-        current_idx = df[df['date'] == current_date].index
-        if len(current_idx) == 0:
-            return None
-
-        current_idx = current_idx[0]
-
-        # 获取下一个交易日的收盘价
-        if current_idx + 1 < len(df):
-            next_day = df.iloc[current_idx + 1]
-            return float(next_day['Close'])
+def get_next_day_price_with_date(code, current_date):
+    """
+    获取股票次日收盘价和实际日期（自动跳过周末）
 
-        return None
-    except Exception:
-        return None
+    Returns:
+        (price, date) 或 None
+    """
+    return price_lookup.get_lookup(BASE_URL, LATEST_TRADE_DATE).next_close(code, current_date)
 
 def init_backtest_table():
     """初始化回测结果表"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS backtest_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                strategy_name TEXT NOT NULL,
-                date TEXT NOT NULL,
-                stock_count INTEGER,
-                valid_count INTEGER,
-                win_count INTEGER,
-                lose_count INTEGER,
-                win_rate REAL,
-                total_return REAL,
-                avg_return REAL,
-                details TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(strategy_name, date)
-            )
-        ''')
-
-        # 检查是否需要添加details列（如果表已存在但没有details列）
-        try:
-            c.execute('SELECT details FROM backtest_results LIMIT 1')
-        except:
-            # details列不存在，添加它
-            c.execute('ALTER TABLE backtest_results ADD COLUMN details TEXT')
-
-        conn.commit()
-        conn.close()
+        storage.ensure_backtest_results(DB_FILE)
     except Exception as e:
         print(f"初始化回测表失败: {e}")
 
@@ -825,37 +820,8 @@ def save_backtest_result_simple(result, strategy_name="b1"):
         return
 
     try:
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-
-        # 构建详细信息JSON
-        import json
-        details = {
-            'win_stocks': result.get('win_stocks', []),
-            'lose_stocks': result.get('lose_stocks', [])
-        }
-        details_json = json.dumps(details, ensure_ascii=False)
-
-        c.execute('''
-            INSERT OR REPLACE INTO backtest_results
-            (strategy_name, date, stock_count, valid_count, win_count, lose_count,
-             win_rate, total_return, avg_return, details)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            strategy_name,
-            result['date'],
-            result['stock_count'],
-            result['valid_count'],
-            result['win_count'],
-            result['lose_count'],
-            result['win_rate'],
-            result['total_return'],
-            result['avg_return'],
-            details_json
-        ))
-
-        conn.commit()
-        conn.close()
+        # 当日汇总和逐笔交易（result['trades']）一起写入
+        storage.save_backtest_results(DB_FILE, [result], strategy_name)
     except Exception as e:
         print(f"保存回测结果失败: {e}")
 
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+条件排序（conditions.order_conditions）的测试
+
+运行：cd strategies && python -m pytest -q test_conditions.py
+"""
+
+import conditions
+
+# cheap 自身便宜但很少淘汰；dk 自身便宜、淘汰率高，但要用昂贵的 curr 特征
+STATS = {
+    'conditions': {
+        'cheap': {'evaluated': 100, 'passed': 90, 'seconds': 0.01, 'uses': ['last']},
+        'dk': {'evaluated': 100, 'passed': 20, 'seconds': 0.01, 'uses': ['curr']},
+    },
+    'features': {
+        'last': {'computed': 100, 'seconds': 0.01},
+        'curr': {'computed': 100, 'seconds': 1.0},
+    },
+}
+
+
+def test_feature_cost_counts_toward_condition():
+    assert conditions.order_conditions(['dk', 'cheap'], STATS) == ['cheap', 'dk']
+
+
+def test_prepaid_feature_is_free():
+    """总会先算的特征不计入成本：淘汰率高的 dk 排到前面"""
+    assert conditions.order_conditions(['cheap', 'dk'], STATS, prepaid=('curr',)) == ['dk', 'cheap']
+
+
+def test_missing_stats_keeps_declared_order():
+    stats = {'conditions': {'cheap': STATS['conditions']['cheap']}, 'features': STATS['features']}
+    assert conditions.order_conditions(['dk', 'cheap'], stats, prepaid=('curr',)) == ['dk', 'cheap']
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台批量写库线程（db_writer.BatchWriter）的测试
+
+- 偶发的写库失败在下一次重试时写入，不丢行
+- 持续失败时重试 max_retries 次后丢弃，丢弃的行数记在 failed 里，close() 不会一直等下去
+
+用假的 storage.write_many，不依赖真实数据库。
+运行：cd strategies && python -m pytest -q test_db_writer.py
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+import db_writer
+
+
+class FakeStorage:
+    """前 fail_times 次写入抛出 database is locked，之后正常写入"""
+
+    def __init__(self, fail_times=0):
+        self.fail_times = fail_times
+        self.calls = 0
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def write_many(self, path, sql, rows):
+        with self.lock:
+            self.calls += 1
+            if self.calls <= self.fail_times:
+                raise sqlite3.OperationalError('database is locked')
+            self.rows.extend(rows)
+            return len(rows)
+
+
+@pytest.fixture
+def fake_storage(monkeypatch):
+    def install(fail_times=0):
+        fake = FakeStorage(fail_times)
+        monkeypatch.setattr(db_writer.storage, 'write_many', fake.write_many)
+        return fake
+    return install
+
+
+def test_writes_all_rows(fake_storage):
+    fake = fake_storage()
+    writer = db_writer.BatchWriter('x.db', 'INSERT', batch_size=10, flush_interval=0.01)
+    for i in range(95):
+        writer.put((i,))
+    assert writer.close() == 95
+    assert sorted(fake.rows) == [(i,) for i in range(95)]
+    assert writer.failed == 0
+
+
+def test_transient_failure_is_retried(fake_storage):
+    fake = fake_storage(fail_times=2)
+    writer = db_writer.BatchWriter('x.db', 'INSERT', batch_size=5, flush_interval=0.01, max_retries=3)
+    for i in range(20):
+        writer.put((i,))
+    writer.close()
+    assert sorted(fake.rows) == [(i,) for i in range(20)]
+    assert writer.failed == 0 and writer.error is None
+
+
+def test_persistent_failure_drops_after_max_retries(fake_storage):
+    fake = fake_storage(fail_times=10 ** 6)
+    writer = db_writer.BatchWriter('x.db', 'INSERT', batch_size=5, flush_interval=0.01, max_retries=3)
+    for i in range(20):
+        writer.put((i,))
+    assert writer.close() == 0
+    assert writer.failed == 20
+    assert isinstance(writer.error, sqlite3.OperationalError)
+    # 每批行最多尝试 max_retries 次，失败后不会每来一行就重试一次
+    assert fake.calls <= 20 // 5 * 3 + 3
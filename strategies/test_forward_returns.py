@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+选股多周期远期收益（forward_returns）的测试
+
+- 卖出K线已到的周期算出收益，还可能等到的周期留待下次
+- 永远算不出来的选股记为 unavailable，不会一直停在待计算里：
+  K线中没有选股日、退市或长期停牌（超过 MAX_WAIT_DAYS 仍没有卖出K线）、接口没有该股票的数据
+
+运行：cd strategies && python -m pytest -q test_forward_returns.py
+"""
+
+import pandas as pd
+import pytest
+
+import forward_returns as fr
+
+HORIZONS = (1, 3)
+
+
+def kline(dates, closes):
+    return pd.DataFrame({'date': dates, 'close': closes})
+
+
+def by_key(rows):
+    return {(row[0], row[1]): row for row in rows}
+
+
+def test_ready_and_pending_horizons():
+    df = kline(['2025-07-01', '2025-07-02', '2025-07-03'], [10.0, 11.0, 12.0])
+    rows = by_key(fr.compute_forward_returns(df, ['2025-07-01'], HORIZONS, as_of='2025-07-03'))
+    assert rows[('2025-07-01', 1)][2:] == (10.0, '2025-07-02', 11.0, pytest.approx(10.0), fr.STATUS_OK)
+    assert ('2025-07-01', 3) not in rows  # 第3根K线还没到，下次再算
+
+
+def test_missing_selection_date_is_unavailable():
+    df = kline(['2025-07-01', '2025-07-03', '2025-07-04'], [10.0, 11.0, 12.0])
+    rows = fr.compute_forward_returns(df, ['2025-07-02'], HORIZONS, as_of='2025-07-04')
+    assert sorted(row[1] for row in rows) == [1, 3]
+    assert all(row[-1] == fr.STATUS_UNAVAILABLE and row[5] is None for row in rows)
+
+
+def test_delisted_after_selection_is_unavailable_once_expired():
+    df = kline(['2025-03-03', '2025-03-04'], [10.0, 9.0])
+    recent = by_key(fr.compute_forward_returns(df, ['2025-03-03'], HORIZONS, as_of='2025-03-20'))
+    assert recent[('2025-03-03', 1)][-1] == fr.STATUS_OK
+    assert ('2025-03-03', 3) not in recent
+
+    later = by_key(fr.compute_forward_returns(df, ['2025-03-03'], HORIZONS, as_of='2025-07-01'))
+    assert later[('2025-03-03', 3)][-1] == fr.STATUS_UNAVAILABLE
+    assert later[('2025-03-03', 3)][2] == 10.0
+
+
+def test_selection_after_last_bar_waits_until_expired():
+    df = kline(['2025-07-01'], [10.0])
+    assert fr.compute_forward_returns(df, ['2025-07-02'], HORIZONS, as_of='2025-07-02') == []
+    rows = fr.compute_forward_returns(df, ['2025-07-02'], HORIZONS, as_of='2025-12-01')
+    assert {row[-1] for row in rows} == {fr.STATUS_UNAVAILABLE}
+
+
+def test_no_kline_data():
+    assert fr.compute_forward_returns(None, ['2025-07-01'], HORIZONS, as_of='2025-07-10') == []
+    rows = fr.compute_forward_returns(None, ['2025-01-02'], HORIZONS, as_of='2025-07-10')
+    assert len(rows) == len(HORIZONS) and rows[0][-1] == fr.STATUS_UNAVAILABLE
+
+
+def test_unavailable_is_terminal(monkeypatch, tmp_path):
+    monkeypatch.setattr(fr, 'DB_FILE', str(tmp_path / 'stocks.db'))
+    fr.storage.ensure_strategy_results(fr.DB_FILE)
+    fr.storage.write_many(fr.DB_FILE, 'INSERT INTO strategy_results (strategy_name, code, date, score) '
+                                      'VALUES (?, ?, ?, ?)', [('b1', 'sz000001', '2025-01-02', 80.0)])
+    fr.init_forward_returns_table()
+    assert fr.get_pending_selections() == {'sz000001': ['2025-01-02']}
+
+    rows = fr.compute_forward_returns(None, ['2025-01-02'], as_of='2025-07-10')
+    fr.save_forward_returns([('sz000001',) + row for row in rows])
+    assert fr.get_pending_selections() == {}
+    assert fr.summarize()['all'] == {}
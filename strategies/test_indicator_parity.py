@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+指标计算的一致性测试
+
+尾部窗口、全市场面板、向量化过滤条件都是对原来逐只、逐行计算的改写，结果必须与之一致：
+- calculate_indicators(df, tail=True) 的最后一根K线与全量计算的误差在 TAIL_TOLERANCE 说明的范围内
+- panel.compute_indicators() 与逐只 calculate_indicators() 相同
+- 向量化的跳空 / 高位放量滞涨判断与原来的逐行循环实现相同
+
+用合成的长K线序列（随机游走，夹杂跳空和放量K线）测试，不依赖网络和本地缓存。
+运行：cd strategies && python -m pytest -q test_indicator_parity.py
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import panel
+import strategy_b1 as b1
+
+INDICATOR_COLUMNS = ['ma_m1', 'ma_m2', 'ma_m3', 'ma_m4', 'zx_dk_line', 'ema10', 'zx_trend_line',
+                     'rsv', 'k', 'd', 'j', 'amplitude', 'vol_ma12', 'amount_ma20']
+
+# 有限窗口指标只差滚动求和的浮点舍入
+ROUNDING = 1e-9
+
+
+def make_kline(length, seed):
+    """合成一段日K线：对数随机游走，约 2% 的K线跳空，约 5% 的K线放量"""
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, length)))
+    pre_close = np.r_[close[0], close[:-1]]
+    gap = rng.random(length) < 0.02
+    open_ = pre_close * (1 + rng.normal(0, 0.01, length) + np.where(gap, rng.choice([-0.06, 0.06], length), 0))
+    high = np.maximum(open_, close) * (1 + rng.random(length) * 0.02)
+    low = np.minimum(open_, close) * (1 - rng.random(length) * 0.02)
+    volume = rng.lognormal(12, 0.3, length) * np.where(rng.random(length) < 0.05, 3, 1)
+    return pd.DataFrame({
+        'date': pd.bdate_range('2015-01-05', periods=length).strftime('%Y-%m-%d'),
+        'open': open_, 'high': high, 'low': low, 'close': close,
+        'volume': volume, 'amount': volume * close, 'pre_close': pre_close,
+    })
+
+
+KLINES = [make_kline(length, seed) for seed, length in enumerate([300, 800, 2500, 2500, 5000])]
+
+
+# --- 原来的逐行循环实现（改为向量化之前的版本），作为过滤条件的参照 ---
+
+def reference_has_gap(df, days=40):
+    if df is None or len(df) < 2:
+        return False
+    check_df = df.iloc[max(0, len(df) - days - 1):]
+    for i in range(1, len(check_df)):
+        curr = check_df.iloc[i]
+        prev = check_df.iloc[i - 1]
+        if curr['low'] > prev['high'] or curr['high'] < prev['low']:
+            return True
+    return False
+
+
+def reference_has_top_volume_stagnant(df, days=40, ma_period=20,
+                                      volume_threshold=1.5, up_strength_threshold=0.01):
+    if df is None or len(df) < ma_period + 1:
+        return False
+    ma20 = df['close'].rolling(window=ma_period).mean()
+    vol_ma20 = df['volume'].rolling(window=ma_period).mean()
+    for i in range(max(0, len(df) - days), len(df)):
+        row = df.iloc[i]
+        if pd.isna(ma20.iloc[i]) or pd.isna(vol_ma20.iloc[i]):
+            continue
+        is_high_price = row['close'] > ma20.iloc[i]
+        is_high_volume = row['volume'] > vol_ma20.iloc[i] * volume_threshold
+        is_stagnant = (row['close'] < row['open'] or
+                       (row['close'] > row['open'] and
+                        (row['close'] - row['open']) / row['open'] < up_strength_threshold))
+        if is_high_price and is_high_volume and is_stagnant:
+            return True
+    return False
+
+
+# --- 尾部窗口 vs 全量 ---
+
+@pytest.mark.parametrize('df', KLINES, ids=lambda df: f"{len(df)}bars")
+def test_tail_matches_full(df):
+    full = b1.calculate_indicators(df.copy()).iloc[-1]
+    tail = b1.calculate_indicators(df.copy(), tail=True).iloc[-1]
+
+    price_range = df['close'].max() - df['close'].min()
+    bounds = {
+        'ema10': b1.TAIL_TOLERANCE * price_range,
+        'zx_trend_line': b1.TAIL_TOLERANCE * price_range,
+        'k': b1.TAIL_TOLERANCE * 100,
+        'd': b1.TAIL_TOLERANCE * 100,
+        'j': b1.TAIL_TOLERANCE * 500,
+    }
+    for column in INDICATOR_COLUMNS:
+        bound = bounds.get(column, 0) + ROUNDING * max(1.0, abs(full[column]))
+        assert abs(tail[column] - full[column]) <= bound, column
+
+
+def test_tail_window_length():
+    df = KLINES[-1]
+    assert len(b1.calculate_indicators(df.copy(), tail=True)) == b1.TAIL_BARS
+
+
+# --- 全市场面板 vs 逐只计算 ---
+
+def test_panel_matches_per_stock():
+    frames = {f"sz{i:06d}": df for i, df in enumerate(KLINES)}
+    p = panel.build_panel(frames)
+    ind = panel.compute_indicators(p, (b1.M1, b1.M2, b1.M3, b1.M4))
+    length = p['close'].shape[1]
+
+    for row, df in enumerate(frames.values()):
+        expected = b1.calculate_indicators(df.copy())
+        start = length - len(df)
+        assert (p['dates'][row, start:] == df['date'].to_numpy()).all()
+        assert np.isnan(p['close'][row, :start]).all()
+        for column in INDICATOR_COLUMNS:
+            np.testing.assert_allclose(ind[column][row, start:], expected[column].to_numpy(),
+                                       rtol=ROUNDING, atol=ROUNDING, equal_nan=True,
+                                       err_msg=column)
+
+
+# --- 向量化过滤条件 vs 逐行循环 ---
+
+# 每段K线取若干截止位置，覆盖历史不足、刚够、很长的情况
+CUTOFFS = [(df, end) for df in KLINES[:3] for end in range(2, len(df) + 1, 7)]
+
+
+def test_filters_have_both_outcomes():
+    """合成数据要同时出现命中和不命中，否则一致性测试没有意义"""
+    gaps = {reference_has_gap(df.iloc[:end]) for df, end in CUTOFFS}
+    stagnant = {reference_has_top_volume_stagnant(df.iloc[:end]) for df, end in CUTOFFS}
+    assert gaps == {True, False}
+    assert stagnant == {True, False}
+
+
+def test_has_gap_matches_loop():
+    for df, end in CUTOFFS:
+        window = df.iloc[:end]
+        assert b1.has_gap_in_past_days(window.copy()) == reference_has_gap(window), end
+
+
+def test_has_top_volume_stagnant_matches_loop():
+    for df, end in CUTOFFS:
+        window = df.iloc[:end]
+        assert (b1.has_top_volume_stagnant_in_past_days(window.copy()) ==
+                reference_has_top_volume_stagnant(window)), end
+
+
+def test_asof_filters_match_loop():
+    """panel 的逐根K线（as-of）判断与每个截止位置单独调用逐行循环相同"""
+    for df in KLINES[:3]:
+        gap = panel.has_gap_asof(df['high'].to_numpy(), df['low'].to_numpy())
+        stagnant = panel.has_top_volume_stagnant_asof(df['open'].to_numpy(), df['close'].to_numpy(),
+                                                      df['volume'].to_numpy())
+        for end in range(2, len(df) + 1, 7):
+            window = df.iloc[:end]
+            assert gap[end - 1] == reference_has_gap(window), end
+            assert stagnant[end - 1] == reference_has_top_volume_stagnant(window), end
+
+
+def test_panel_filters_match_loop():
+    """面板上一次判断所有股票（右对齐，左侧 NaN）与逐只循环相同"""
+    frames = {f"sz{i:06d}": df for i, df in enumerate(KLINES)}
+    p = panel.build_panel(frames)
+    gap = panel.has_gap(p['high'], p['low'])
+    stagnant = panel.has_top_volume_stagnant(p['open'], p['close'], p['volume'])
+    for row, df in enumerate(frames.values()):
+        assert gap[row] == reference_has_gap(df)
+        assert stagnant[row] == reference_has_top_volume_stagnant(df)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量指标状态（indicator_state）的一致性测试
+
+- 每天推进一根K线得到的指标与在同一段K线上全量计算 calculate_indicators() 相同
+- 复权变化（历史收盘价被改写）、状态日期不在传入K线中时从头重建，结果仍与全量计算相同
+- 最近交易日未知（最后一根K线可能未收盘）时不读写状态文件
+
+状态文件写在临时目录，合成K线同 test_indicator_parity.py。
+运行：cd strategies && python -m pytest -q test_indicator_state.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import indicator_state
+import strategy_b1 as b1
+from test_indicator_parity import ROUNDING, make_kline
+
+MA_PERIODS = (b1.M1, b1.M2, b1.M3, b1.M4)
+CODE = 'sz000001'
+
+
+@pytest.fixture(autouse=True)
+def state_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(indicator_state, 'STATE_DIR', str(tmp_path))
+    return tmp_path
+
+
+def assert_matches_full(values, df):
+    expected = b1.calculate_indicators(df.copy()).iloc[-1]
+    for name, value in values.items():
+        assert value == pytest.approx(expected[name], rel=ROUNDING, abs=ROUNDING, nan_ok=True), name
+
+
+def test_daily_advance_matches_full():
+    df = make_kline(700, seed=11)
+    indicator_state.update(CODE, df.iloc[:300], MA_PERIODS)
+    for end in range(301, len(df) + 1):
+        values = indicator_state.update(CODE, df.iloc[:end], MA_PERIODS)
+        if end % 50 == 0 or end == len(df):
+            assert_matches_full(values, df.iloc[:end])
+    assert indicator_state.load_state(CODE)['date'] == df['date'].iloc[-1]
+
+
+def test_advance_several_bars_at_once():
+    """停了几天没跑：一次推进多根新K线"""
+    df = make_kline(500, seed=12)
+    indicator_state.update(CODE, df.iloc[:300], MA_PERIODS)
+    values = indicator_state.update(CODE, df.iloc[:317], MA_PERIODS)
+    assert_matches_full(values, df.iloc[:317])
+
+
+def test_adjustment_rebuilds():
+    """前复权基准变化：历史价格整体缩放，保存的收盘价对不上，必须重建"""
+    df = make_kline(500, seed=13)
+    indicator_state.update(CODE, df.iloc[:400], MA_PERIODS)
+
+    adjusted = df.copy()
+    for field in ('open', 'high', 'low', 'close', 'pre_close'):
+        adjusted[field] *= 0.9
+    values = indicator_state.update(CODE, adjusted.iloc[:401], MA_PERIODS)
+    assert_matches_full(values, adjusted.iloc[:401])
+
+
+def test_state_date_outside_window_rebuilds():
+    """状态日期早于传入的尾部窗口：从传入的K线重建，与尾部窗口模式相同"""
+    df = make_kline(1500, seed=14)
+    indicator_state.update(CODE, df.iloc[:300], MA_PERIODS)
+
+    window = b1.tail_window(df)
+    values = indicator_state.update(CODE, window, MA_PERIODS)
+    expected = b1.calculate_indicators(df.copy(), tail=True).iloc[-1]
+    for name, value in values.items():
+        assert value == pytest.approx(expected[name], rel=ROUNDING, abs=ROUNDING, nan_ok=True), name
+
+
+def test_corrupt_state_rebuilds(state_dir):
+    df = make_kline(400, seed=15)
+    with open(os.path.join(state_dir, f"{CODE}.npz"), 'wb') as f:
+        f.write(b'not a npz file')
+    values = indicator_state.update(CODE, df, MA_PERIODS)
+    assert_matches_full(values, df)
+
+
+def test_unknown_trade_date_does_not_persist(monkeypatch, state_dir):
+    """最近交易日未知时最后一根K线可能未收盘，不推进保存的状态"""
+    monkeypatch.setattr(b1, 'INCREMENTAL_INDICATORS', True)
+    df = b1.tail_window(make_kline(600, seed=16))
+
+    b1.evaluate_kline_traced(CODE, df.copy(), persist_state=False)
+    assert not os.listdir(state_dir)
+
+    monkeypatch.setattr(b1, 'LATEST_TRADE_DATE', None)
+    b1.evaluate_kline_traced(CODE, df.copy())
+    assert not os.listdir(state_dir)
+
+    b1.evaluate_kline_traced(CODE, df.copy(), persist_state=True)
+    assert os.listdir(state_dir) == [f"{CODE}.npz"]
+    assert indicator_state.load_state(CODE)['date'] == df['date'].iloc[-1]
+
+
+def test_incremental_row_matches_tail():
+    """calculate_indicators(code=...) 返回的一行与尾部窗口模式一致（含原始行情列）"""
+    df = b1.tail_window(make_kline(900, seed=17))
+    row = b1.calculate_indicators(df.copy(), code=CODE).iloc[-1]
+    expected = b1.calculate_indicators(df.copy(), tail=True).iloc[-1]
+    assert row['date'] == expected['date']
+    for name in ['close', 'volume', 'zx_dk_line', 'zx_trend_line', 'j', 'vol_ma12', 'amount_ma20']:
+        assert row[name] == pytest.approx(expected[name], rel=ROUNDING, abs=ROUNDING), name
+    assert np.isfinite(row['j'])
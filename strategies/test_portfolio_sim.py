@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+组合资金曲线模拟（portfolio_sim）的测试
+
+- 剩余现金买不起某一只选股时跳过它，继续买后面更便宜的
+- 保存的资金曲线回撤与汇总指标的最大回撤口径一致（高点含初始资金）
+
+用合成的收盘价矩阵，不依赖K线缓存和数据库。
+运行：cd strategies && python -m pytest -q test_portfolio_sim.py
+"""
+
+import numpy as np
+import pytest
+
+import portfolio_sim
+
+DATES = np.array(['2025-07-01', '2025-07-02', '2025-07-03'])
+CODES = ['sz000001', 'sz000002', 'sz000003']
+NO_COSTS = dict(commission_rate=0.0, min_commission=0.0, stamp_duty_rate=0.0, slippage=0.0)
+
+
+def test_unaffordable_pick_is_skipped():
+    # 每只预算 6000：买入第一只 5500 后剩 4500，第二只一手 5900 买不起，第三只一手 4000 仍可买入
+    close = np.array([[55.0, 59.0, 40.0]] * 3)
+    selections = {'2025-07-01': CODES}
+    result = portfolio_sim.simulate(selections, DATES, close, CODES, initial_capital=10_000,
+                                    top_n=3, position_pct=0.6, **NO_COSTS)
+    assert [trade['code'] for trade in result['trades']] == ['sz000001', 'sz000003']
+    assert result['cash'][0] == pytest.approx(500.0)
+
+
+def test_saved_drawdown_matches_metrics(tmp_path):
+    # 第一天买入就因费用低于初始资金：高点是初始资金，第一天已有回撤
+    close = np.array([[10.0, 20.0, 30.0], [9.0, 20.0, 30.0], [9.5, 20.0, 30.0]])
+    selections = {'2025-07-01': ['sz000001']}
+    result = portfolio_sim.simulate(selections, DATES, close, CODES, initial_capital=100_000,
+                                    top_n=1, hold_days=2)
+    assert result['equity'][0] < 100_000
+    assert result['drawdown'][0] > 0
+    assert result['metrics']['max_drawdown'] == pytest.approx(result['drawdown'].max() * 100)
+
+    path = tmp_path / 'equity.csv'
+    portfolio_sim.save_equity_csv(result, str(path))
+    saved = np.loadtxt(path, delimiter=',', skiprows=1, usecols=3)
+    assert saved.max() == pytest.approx(result['metrics']['max_drawdown'], abs=1e-4)
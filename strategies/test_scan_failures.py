@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+扫描失败分类和结束后重试的测试
+
+- scan_failures.classify() 把取数据阶段的各种异常归到正确的类别，
+  尤其是 Go 服务端以 HTTP 200 + code != 0 返回的网关错误不能被当成“无数据”跳过
+- FailureLedger 的跳过 / 待重试 / 恢复计数
+- strategy_b1.scan_market() + retry_failures()：偶发失败在重试轮中恢复，持续失败的留在台账里，
+  计算出错和无数据不重试
+
+用假的取数据 / 分析函数，不依赖网络和本地缓存。
+运行：cd strategies && python -m pytest -q test_scan_failures.py
+"""
+
+import asyncio
+
+import pytest
+import requests
+
+import http_client
+import scan_checkpoint
+import scan_failures
+import strategy_b1 as b1
+
+EMPTY_TRACE = {'conditions': [], 'features': {}}
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status}", response=response)
+
+
+# --- classify ---
+
+@pytest.mark.parametrize('exc, category', [
+    (requests.Timeout('read timed out'), scan_failures.TIMEOUT),
+    (requests.ConnectTimeout('connect timed out'), scan_failures.TIMEOUT),
+    (requests.ConnectionError('refused'), scan_failures.CONNECTION),
+    (http_error(502), scan_failures.HTTP_5XX),
+    (http_error(404), scan_failures.OTHER),
+    (http_client.APIError('/api/kline', -1, '获取K线失败'), scan_failures.GATEWAY),
+    (ValueError('Expecting value'), scan_failures.MALFORMED),
+    (KeyError('List'), scan_failures.MALFORMED),
+    (scan_failures.ScanFailure(scan_failures.SHORT_HISTORY), scan_failures.SHORT_HISTORY),
+    (RuntimeError('boom'), scan_failures.OTHER),
+])
+def test_classify(exc, category):
+    assert scan_failures.classify(exc) == category
+
+
+def test_gateway_is_retried_not_skipped():
+    assert scan_failures.GATEWAY in scan_failures.RETRY_CATEGORIES
+    assert scan_failures.GATEWAY not in scan_failures.SKIP_CATEGORIES
+
+
+def test_get_kline_data_categories(monkeypatch):
+    def gateway_error(code, base_url, until=None):
+        raise http_client.APIError('/api/kline', -1, 'upstream')
+
+    monkeypatch.setattr(b1.kline_cache, 'get_kline', gateway_error)
+    with pytest.raises(scan_failures.ScanFailure) as info:
+        b1.get_kline_data('sz000001')
+    assert info.value.category == scan_failures.GATEWAY
+
+    monkeypatch.setattr(b1.kline_cache, 'get_kline', lambda code, base_url, until=None: None)
+    with pytest.raises(scan_failures.ScanFailure) as info:
+        b1.get_kline_data('sz000001')
+    assert info.value.category == scan_failures.NO_DATA
+
+
+# --- FailureLedger ---
+
+def test_ledger_retry_and_recover():
+    ledger = scan_failures.FailureLedger()
+    ledger.record('a', scan_failures.GATEWAY, 'code=-1')
+    ledger.record('b', scan_failures.TIMEOUT)
+    ledger.record('c', scan_failures.ANALYSIS, 'ZeroDivisionError')
+    ledger.record('d', scan_failures.NO_DATA)
+    ledger.resolve('e')  # 从未失败的股票不计入恢复数
+
+    assert ledger.retry_codes() == ['a', 'b']
+    assert ledger.failed_codes() == ['a', 'b', 'c']
+    assert ledger.recovered == 0
+
+    ledger.resolve('a')
+    ledger.record('b', scan_failures.TIMEOUT)
+    assert ledger.retry_codes() == ['b']
+    assert ledger.recovered == 1
+    assert ledger.counts == {scan_failures.GATEWAY: 1, scan_failures.TIMEOUT: 2,
+                             scan_failures.ANALYSIS: 1, scan_failures.NO_DATA: 1}
+    assert ledger.to_dict()['unresolved'] == {
+        'b': {'category': scan_failures.TIMEOUT, 'error': ''},
+        'c': {'category': scan_failures.ANALYSIS, 'error': 'ZeroDivisionError'},
+    }
+
+
+def test_ledger_skip_resolves_earlier_failure():
+    ledger = scan_failures.FailureLedger()
+    ledger.record('a', scan_failures.CONNECTION)
+    ledger.record('a', scan_failures.NO_DATA)
+    assert ledger.failed_codes() == []
+    assert ledger.recovered == 1
+
+
+# --- 扫描 + 结束后重试 ---
+
+def fake_evaluate(code, df, persist_state=None):
+    """在进程池中执行，必须是模块级函数"""
+    if code == 'bad':
+        raise ZeroDivisionError('bad data')
+    return None, EMPTY_TRACE
+
+
+def test_retry_round(monkeypatch, tmp_path):
+    calls = {}
+
+    def fake_fetch(code):
+        calls[code] = calls.get(code, 0) + 1
+        if code == 'flaky' and calls[code] == 1:
+            raise scan_failures.ScanFailure(scan_failures.GATEWAY, 'code=-1')
+        if code == 'down':
+            raise scan_failures.ScanFailure(scan_failures.HTTP_5XX, '503')
+        if code == 'empty':
+            raise scan_failures.ScanFailure(scan_failures.NO_DATA)
+        return code
+
+    monkeypatch.setattr(b1, 'get_kline_data', fake_fetch)
+    monkeypatch.setattr(b1, 'evaluate_kline_traced', fake_evaluate)
+    monkeypatch.setattr(b1, 'ANALYZE_WORKERS', 1)
+    monkeypatch.setattr(b1, 'RETRY_DELAY', 0)
+
+    codes = ['ok', 'flaky', 'down', 'empty', 'bad']
+    checkpoint = scan_checkpoint.ScanCheckpoint('2025-07-14', {}, directory=str(tmp_path))
+    try:
+        results, stats, ledger = asyncio.run(b1.scan_market(codes, checkpoint=checkpoint))
+        assert sorted(ledger.retry_codes()) == ['down', 'flaky']
+        b1.retry_failures(ledger, checkpoint=checkpoint, results=results, stats=stats)
+    finally:
+        checkpoint.close()
+
+    assert ledger.recovered == 1
+    assert sorted(ledger.failed_codes()) == ['bad', 'down']
+    assert ledger.unresolved['bad'] == scan_failures.ANALYSIS
+    # 持续失败的股票每轮都重试，无数据和计算出错的不重试
+    assert calls == {'ok': 1, 'flaky': 2, 'down': 1 + b1.RETRY_ROUNDS, 'empty': 1, 'bad': 1}
+    assert ledger.counts[scan_failures.HTTP_5XX] == 1 + b1.RETRY_ROUNDS
+    assert ledger.counts[scan_failures.GATEWAY] == 1
+    assert stats['conditions'] == {}
+
+    # 断点：恢复的和无数据的记为完成，仍失败的下次运行重新扫描
+    reloaded = scan_checkpoint.ScanCheckpoint('2025-07-14', {}, directory=str(tmp_path))
+    reloaded.close()
+    assert reloaded.pending(codes) == ['down', 'bad']
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储层（storage）的测试
+
+- 默认以 WAL 模式打开 data/stocks.db（目录不存在时创建）
+- 项目根目录下的旧数据库连同 -wal / -shm 在第一次打开时移到 data/，未 checkpoint 的写入不丢
+
+在临时目录中运行，不碰项目里的数据库。
+运行：cd strategies && python -m pytest -q test_storage.py
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+import storage
+
+
+@pytest.fixture(autouse=True)
+def workdir(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    yield tmp_path
+    storage.close_all()
+    storage._CONNECTIONS.clear()
+
+
+def test_default_is_wal_under_data_dir(workdir):
+    conn = storage.connect(storage.DEFAULT_DB_FILE)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    assert os.path.exists(workdir / 'data' / 'stocks.db')
+
+
+def test_legacy_database_is_moved_with_wal(workdir):
+    legacy = sqlite3.connect('stocks.db')
+    legacy.execute("PRAGMA journal_mode=wal")
+    legacy.execute("PRAGMA wal_autocheckpoint=0")  # 写入留在 stocks.db-wal 里
+    legacy.execute("CREATE TABLE t (x INTEGER)")
+    legacy.execute("INSERT INTO t VALUES (42)")
+    legacy.commit()
+    assert os.path.getsize('stocks.db-wal') > 0
+
+    conn = storage.connect(storage.DEFAULT_DB_FILE)
+    assert conn.execute("SELECT x FROM t").fetchall() == [(42,)]
+    assert not os.path.exists('stocks.db')
+    assert not os.path.exists('stocks.db-wal')
+    legacy.close()
+
+
+def test_existing_target_is_not_overwritten(workdir):
+    storage.connect(storage.DEFAULT_DB_FILE).execute("CREATE TABLE t (x INTEGER)")
+    storage.close_all()
+    storage._CONNECTIONS.clear()
+    sqlite3.connect('stocks.db').close()
+
+    conn = storage.connect(storage.DEFAULT_DB_FILE)
+    assert conn.execute("SELECT name FROM sqlite_master").fetchall() == [('t',)]
+    assert os.path.exists('stocks.db')
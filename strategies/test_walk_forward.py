@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+滚动优化（walk_forward）的测试
+
+训练窗口不能用到测试窗口内的行情：选股日中只要有一笔交易（例如停牌后复牌才卖出）
+在测试窗口开始当天或之后卖出，这一天就不计入训练指标。
+
+运行：cd strategies && python -m pytest -q test_walk_forward.py
+"""
+
+import walk_forward
+
+
+def daily_result(select_date, sell_dates, pnl=1.0):
+    trades = [{'select_date': select_date, 'code': f"sz{i:06d}", 'sell_date': d, 'pnl': pnl}
+              for i, d in enumerate(sell_dates)]
+    return {
+        'select_date': select_date,
+        'sell_date': sell_dates[0],
+        'valid_count': len(trades),
+        'win_count': len(trades) if pnl > 0 else 0,
+        'avg_return': pnl,
+        'trades': trades,
+    }
+
+
+def test_training_excludes_days_with_any_late_sell():
+    daily = {
+        '2025-01-02': daily_result('2025-01-02', ['2025-01-03', '2025-01-03']),
+        # 第一只次日卖出，第二只停牌到测试窗口内才卖出
+        '2025-01-03': daily_result('2025-01-03', ['2025-01-06', '2025-01-10']),
+        '2025-01-06': daily_result('2025-01-06', ['2025-01-07']),
+    }
+    train = ['2025-01-02', '2025-01-03', '2025-01-06']
+
+    metrics = walk_forward.window_metrics(daily, train, sell_before='2025-01-08')
+    assert metrics['days'] == 2
+    assert metrics['trades'] == 3
+
+    assert walk_forward.window_metrics(daily, train)['days'] == 3
+
+
+def test_last_sell_date():
+    assert walk_forward.last_sell_date(daily_result('2025-01-03', ['2025-01-06', '2025-01-10', '2025-01-07'])) \
+        == '2025-01-10'
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+B1 策略滚动（walk-forward）优化
+
+在训练窗口上从参数网格和评分权重中选出表现最好的一组，再拿到紧随其后的测试窗口上检验，
+窗口依次向后滚动；把各测试窗口的结果拼起来就是样本外表现，用来判断评分阈值是否过拟合。
+
+所有窗口共用一次计算：
+1. 指标和条件都是截至当日判断，与窗口无关，各参数组的全历史信号只算一次（param_sweep 的进程池）
+2. 每组 (参数, 评分权重) 的逐日回测结果（每天评分前10名，次日收盘卖出）也只算一次
+3. 每个窗口只是在这些逐日结果上按日期切片、计算指标
+
+训练窗口只统计所有交易都在测试窗口开始之前卖出的选股日，训练与测试不共用任何一天的行情。
+
+只读本地缓存，运行前先运行一次 strategy_b1.py 同步K线。
+
+用法：
+    python walk_forward.py                         # 全部历史
+    python walk_forward.py 2025-01-01 2025-06-30   # 指定选股日期范围
+"""
+
+import os
+import sys
+import time
+
+import backtest_panel
+import kline_cache
+import param_sweep
+from scoring import SCORE_COMPONENTS
+
+# 配置
+BASE_URL = "http://localhost:8080"
+TRAIN_DAYS = 120       # 训练窗口（交易日）
+TEST_DAYS = 20         # 测试窗口（交易日），也是每次向后滚动的步长
+MIN_TRAIN_TRADES = 30  # 训练窗口内交易次数少于此数的组合不参与选择
+RANK_BY = 'sharpe'
+RESULT_CSV = os.path.join("data", "walk_forward.csv")
+
+# 参与优化的参数网格（同 param_sweep.PARAM_GRID 的格式）
+PARAM_GRID = param_sweep.PARAM_GRID
+
+# 评分权重候选：各维度得分乘以对应权重后求和，未列出的维度权重为1
+SCORE_WEIGHT_SETS = [
+    {},
+    {'oversold': 1.5},
+    {'trend': 1.5},
+    {'volume': 1.5},
+    {'momentum': 1.5},
+    {'oversold': 0.5},
+    {'liquidity': 3},
+]
+
+def weighted_signals(signals, weights):
+    """按评分权重重新计算信号的评分"""
+    w = [weights.get(name, 1.0) for name in SCORE_COMPONENTS]
+    return [dict(sig, score=round(sum(a * b for a, b in zip(w, sig['components'])), 2))
+            for sig in signals]
+
+def build_candidates(param_sets, signals):
+    """
+    计算每组 (参数, 评分权重) 的全历史逐日回测结果
+
+    Returns:
+        [(params, weights, {选股日期: 当日回测结果})]
+    """
+    candidates = []
+    for params, param_signals in zip(param_sets, signals):
+        for weights in SCORE_WEIGHT_SETS:
+            daily = backtest_panel.build_daily_results(weighted_signals(param_signals, weights),
+                                                       param_sweep.TOP_N)
+            candidates.append((params, weights, {r['select_date']: r for r in daily}))
+    return candidates
+
+def make_windows(dates, train_days=TRAIN_DAYS, test_days=TEST_DAYS):
+    """按交易日切分滚动窗口，返回 [(训练日期列表, 测试日期列表)]"""
+    windows = []
+    start = 0
+    while start + train_days < len(dates):
+        train = dates[start:start + train_days]
+        test = dates[start + train_days:start + train_days + test_days]
+        windows.append((train, test))
+        start += test_days
+    return windows
+
+def last_sell_date(result):
+    """一个选股日所有交易中最晚的卖出日（停牌的股票卖出日晚于其他股票）"""
+    return max(t['sell_date'] for t in result['trades'])
+
+def window_metrics(daily_by_date, window_dates, sell_before=None):
+    """
+    一个窗口内的回测指标
+
+    sell_before: 只统计所有交易的卖出日都早于该日期的选股日。训练窗口传入测试窗口的第一天：
+                 训练窗口最后一个选股日次日收盘卖出，卖出日往往就是测试窗口第一天，
+                 不排除的话训练指标会用到测试窗口内的行情。
+                 结果里的 sell_date 只是第一只有效股票的卖出日，停牌股票的下一根K线更晚，
+                 所以按 trades 中最晚的卖出日判断
+    """
+    results = [daily_by_date[d] for d in window_dates if d in daily_by_date]
+    if sell_before is not None:
+        results = [r for r in results if last_sell_date(r) < sell_before]
+    return param_sweep.evaluate_results(results)
+
+def walk_forward(candidates, dates):
+    """
+    滚动选择并检验
+
+    Returns:
+        (steps, oos_results)：steps 为每个窗口的选择结果，oos_results 为拼接后的样本外逐日结果
+    """
+    steps = []
+    oos_results = []
+    for train, test in make_windows(dates):
+        best = None
+        for params, weights, daily in candidates:
+            metrics = window_metrics(daily, train, sell_before=test[0])
+            if metrics['trades'] < MIN_TRAIN_TRADES:
+                continue
+            if best is None or metrics[RANK_BY] > best[2][RANK_BY]:
+                best = (params, weights, metrics, daily)
+        if best is None:
+            continue
+
+        params, weights, train_metrics, daily = best
+        test_results = [daily[d] for d in test if d in daily]
+        oos_results.extend(test_results)
+        steps.append({
+            'train': (train[0], train[-1]),
+            'test': (test[0], test[-1]),
+            'params': params,
+            'weights': weights,
+            'train_metrics': train_metrics,
+            'test_metrics': param_sweep.evaluate_results(test_results),
+        })
+    return steps, oos_results
+
+def format_weights(weights):
+    if not weights:
+        return "(默认权重)"
+    return ", ".join(f"{k}×{v}" for k, v in weights.items())
+
+def save_csv(steps, path=RESULT_CSV):
+    """保存每个窗口的选择结果"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("train_start,train_end,test_start,test_end,params,weights,"
+                f"train_{RANK_BY},test_{RANK_BY},test_total_return,test_trades\n")
+        for s in steps:
+            f.write(f"{s['train'][0]},{s['train'][1]},{s['test'][0]},{s['test'][1]},"
+                    f"\"{param_sweep.format_params(s['params'])}\",\"{format_weights(s['weights'])}\","
+                    f"{s['train_metrics'][RANK_BY]:.4f},{s['test_metrics'][RANK_BY]:.4f},"
+                    f"{s['test_metrics']['total_return']:.4f},{s['test_metrics']['trades']}\n")
+
+def main():
+    start_date = sys.argv[1] if len(sys.argv) > 1 else None
+    end_date = sys.argv[2] if len(sys.argv) > 2 else None
+
+    param_sets = param_sweep.expand_grid(PARAM_GRID)
+
+    print("=" * 70)
+    print("🚶 B1 策略滚动优化（walk-forward）")
+    print("=" * 70)
+    print(f"选股日期: {start_date or '最早'} ~ {end_date or '最新'}")
+    print(f"训练 {TRAIN_DAYS} 天 / 测试 {TEST_DAYS} 天，"
+          f"候选组合: {len(param_sets)} 组参数 × {len(SCORE_WEIGHT_SETS)} 组权重\n")
+
+    codes = kline_cache.cached_codes()
+    if not codes:
+        print("❌ 本地没有K线缓存，请先运行 strategy_b1.py")
+        return
+
+    backtest_panel.BASE_URL = BASE_URL
+    backtest_panel.load_stock_names()
+
+    start_time = time.time()
+    signals = param_sweep.collect_signals(codes, param_sets, start_date, end_date)
+    candidates = build_candidates(param_sets, signals)
+    # 以出现过选股的交易日作为日历
+    dates = sorted({d for _, _, daily in candidates for d in daily})
+    steps, oos_results = walk_forward(candidates, dates)
+    duration = time.time() - start_time
+
+    print("\n" + "=" * 70)
+    print(f"🎉 完成！耗时: {duration:.2f}秒，窗口数: {len(steps)}")
+    if not steps:
+        print("❌ 历史数据不足一个训练窗口")
+        print("=" * 70)
+        return
+
+    for s in steps:
+        print(f"{s['test'][0]} ~ {s['test'][1]}  训练{RANK_BY} {s['train_metrics'][RANK_BY]:>6.2f}  "
+              f"测试{RANK_BY} {s['test_metrics'][RANK_BY]:>6.2f}  "
+              f"测试收益 {s['test_metrics']['total_return']:>+7.2f}%  "
+              f"{param_sweep.format_params(s['params'])}; {format_weights(s['weights'])}")
+
+    oos = param_sweep.evaluate_results(oos_results)
+    print(f"\n📊 样本外: 夏普 {oos['sharpe']:.2f}  总收益 {oos['total_return']:+.2f}%  "
+          f"最大回撤 {oos['max_drawdown']:.2f}%  胜率 {oos['win_rate']:.1f}%")
+
+    # 同一批测试日期上与默认参数、默认权重对比（网格中包含默认参数时）
+    default_daily = next((daily for params, weights, daily in candidates
+                          if params == param_sweep.DEFAULT_PARAMS and not weights), None)
+    if default_daily is not None:
+        oos_dates = [d for s in steps for d in dates if s['test'][0] <= d <= s['test'][1]]
+        baseline = window_metrics(default_daily, oos_dates)
+        print(f"📊 默认参数: 夏普 {baseline['sharpe']:.2f}  总收益 {baseline['total_return']:+.2f}%  "
+              f"最大回撤 {baseline['max_drawdown']:.2f}%  胜率 {baseline['win_rate']:.1f}%")
+
+    save_csv(steps)
+    print(f"\n💾 窗口明细已保存: {RESULT_CSV}")
+    print("=" * 70)
+
+if __name__ == "__main__":
+    main()